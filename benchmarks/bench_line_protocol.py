@@ -0,0 +1,62 @@
+"""Compare the line protocol encoder with the influxdb_client.Point serialization.
+
+Usage: python benchmarks/bench_line_protocol.py [--points 100000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "django_influxdb.settings.test")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django_influxdb.influxdb import Client  # noqa: E402
+from django_influxdb.line_protocol import LineProtocolEncoder  # noqa: E402
+
+SYMBOLS = ["BTC", "ETH", "ADA", "SOL", "DOT", "XRP", "LTC", "BNB"]
+
+
+def generate_rows(count: int) -> list:
+    return [{"symbol": SYMBOLS[i % len(SYMBOLS)], "exchange": "binance", "price": 1000.0 + i, "volume": i}
+            for i in range(count)]
+
+
+def measure(name: str, func, points: int) -> float:
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    rate = points / elapsed
+    print(f"{name:<30} {rate:>14,.0f} points/sec")
+    return rate
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--points", type=int, default=100000)
+    args = arg_parser.parse_args()
+    rows = generate_rows(args.points)
+    items = [{"tags": {"symbol": r["symbol"], "exchange": r["exchange"]},
+              "fields": {"price": r["price"], "volume": r["volume"]}} for r in rows]
+    columns = {key: [r[key] for r in rows] for key in rows[0]}
+    client = Client(measurement="prices")
+    encoder = LineProtocolEncoder("prices", tags=["symbol", "exchange"],
+                                  fields=[("price", float), ("volume", int)])
+
+    def point_path():
+        lines = [client.prepare_point(i["tags"], i["fields"]).to_line_protocol() for i in items]
+        return "\n".join(lines).encode()
+
+    baseline = measure("Point", point_path, args.points)
+    for name, func in [("encoder rows", lambda: encoder.encode(rows)),
+                       ("encoder validated items", lambda: encoder.encode_items(items)),
+                       ("encoder columns", lambda: encoder.encode_columns(columns))]:
+        rate = measure(name, func, args.points)
+        print(f"{'':<30} {rate / baseline:>13.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Compare the result flattening and cleaning with the previous reduce + dict implementation.
+
+Usage: python benchmarks/bench_results.py [--tables 10000] [--records 100]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from functools import reduce
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "django_influxdb.settings.test")
+
+import django  # noqa: E402
+
+django.setup()
+
+from influxdb_client.client.flux_table import FluxRecord, FluxTable  # noqa: E402
+from django_influxdb.models import InfluxModel  # noqa: E402
+
+
+class PriceModel(InfluxModel):
+    measurement = "prices"
+    bucket = "bench"
+    required_influx_tags = ["symbol"]
+    optional_influx_tags = ["exchange"]
+    fields = [{"name": "price", "type": float}]
+
+
+def generate_tables(tables: int, records: int) -> list:
+    output = []
+    for i in range(tables):
+        table = FluxTable()
+        for j in range(records):
+            record = FluxRecord(table=i)
+            record.values = {"result": "_result", "table": i, "_start": 0, "_stop": 1, "_time": j,
+                             "_measurement": "prices", "_field": "price", "_value": float(j),
+                             "symbol": f"S{i}", "exchange": "binance"}
+            table.records.append(record)
+        output.append(table)
+    return output
+
+
+def legacy_filter(model: InfluxModel, data: list) -> list:
+    """The reduce based flattening and per row dict cleaning which was replaced"""
+    def red(a, b):
+        if type(a) is list:
+            return a + b.records
+        return a.records + b.records
+
+    def clean(result):
+        current = result.values
+        output = {}
+        try:
+            output["timestamp"] = current["_time"]
+        except KeyError:
+            pass
+        for tag in model.influx_tags:
+            if tag not in current:
+                continue
+            output[tag] = current[tag]
+        for field in model.fields:
+            output[field["name"]] = current.get(field["name"])
+        try:
+            output[current["_field"]] = current["_value"]
+        except KeyError:
+            pass
+        return output
+    results = reduce(red, data)
+    return [clean(r) for r in results]
+
+
+def current_filter(model: InfluxModel, data: list) -> list:
+    model._flatten_results(data)
+    return model.clean_results()
+
+
+def measure(name: str, func, rows: int) -> float:
+    start = time.perf_counter()
+    results = func()
+    elapsed = time.perf_counter() - start
+    del results
+    # Memory is traced in a separate run - tracemalloc slows down the allocations
+    tracemalloc.start()
+    results = func()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<10} {elapsed:>8.2f}s {rows / elapsed:>14,.0f} rows/sec "
+          f"retained {size / 2 ** 20:>8.1f} MiB peak {peak / 2 ** 20:>8.1f} MiB")
+    del results
+    return elapsed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--tables", type=int, default=10000)
+    arg_parser.add_argument("--records", type=int, default=100)
+    args = arg_parser.parse_args()
+    data = generate_tables(args.tables, args.records)
+    rows = args.tables * args.records
+    model = PriceModel()
+    legacy = measure("legacy", lambda: legacy_filter(model, data), rows)
+    current = measure("current", lambda: current_filter(model, data), rows)
+    print(f"speedup {legacy / current:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
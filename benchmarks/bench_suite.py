@@ -0,0 +1,206 @@
+"""End to end benchmarks of the writes, queries and views against an in-process fake InfluxDB
+(fake_influxdb.py). Runs offline - the HTTP round trips, the CSV parsing, the cleaning and the rendering are
+all measured.
+
+Usage: python benchmarks/bench_suite.py [--quick] [--save results.json] [--compare baseline.json]
+                                        [--max-regression 0.25]
+
+--save records the results as a baseline, --compare prints the change against a baseline and exits with 1
+when a metric is worse by more than --max-regression (a fraction).
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "django_influxdb.settings.test")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.test import override_settings  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+from fake_influxdb import FakeInfluxDB  # noqa: E402
+from django_influxdb.connections import connections  # noqa: E402
+from django_influxdb.influxdb import Client  # noqa: E402
+from django_influxdb.models import InfluxModel  # noqa: E402
+from django_influxdb.views import ListViewSet  # noqa: E402
+
+TIME_START = "2021-01-01T00:00:00Z"
+TIME_STOP = "2021-01-02T00:00:00Z"
+SIZES = {"full": {"points": 200000, "rows": 200000, "series": 20, "requests": 50, "view_rows": 5000},
+         "quick": {"points": 20000, "rows": 20000, "series": 5, "requests": 10, "view_rows": 1000}}
+
+
+class PriceModel(InfluxModel):
+    measurement = "prices"
+    bucket = "bench"
+    required_influx_tags = ["symbol"]
+    optional_influx_tags = ["exchange"]
+    fields = [{"name": "price", "type": float}]
+    cache_queries = False
+
+
+class PriceViewSet(ListViewSet):
+    influx_model = PriceModel
+    required_filter_params = ["symbol"]
+    authentication_classes = []
+    permission_classes = []
+
+
+def timed(func, repeat: int = 3) -> float:
+    """Best time of the runs - the garbage collection is disabled while measuring"""
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def peak_memory(func) -> float:
+    """Peak traced memory of a run in MiB - a separate run, tracemalloc slows down the allocations"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak / 2 ** 20
+
+
+def bench_prepare_point(size: dict, server: FakeInfluxDB) -> dict:
+    client = Client(measurement="prices", bucket="bench")
+    count = size["points"] // 10
+
+    def run():
+        for i in range(count):
+            client.prepare_point({"symbol": "BTC"}, {"price": 100.5 + i}).to_line_protocol()
+    return {"prepare_point": (count / timed(run), "points/s", True)}
+
+
+def bench_writes(size: dict, server: FakeInfluxDB) -> dict:
+    data = [{"symbol": f"S{i % 20}", "exchange": "binance", "price": 100.5 + i}
+            for i in range(size["points"])]
+    server.points = 0
+    elapsed = timed(lambda: PriceModel.bulk_save(data, sync=True), repeat=1)
+    assert server.points == len(data), f"{server.points} points written instead of {len(data)}"
+    concurrent = timed(lambda: PriceModel.bulk_save(data, batch_size=5000, sync=True, concurrency=4),
+                       repeat=1)
+    return {"write": (len(data) / elapsed, "points/s", True),
+            "write_concurrent": (len(data) / concurrent, "points/s", True)}
+
+
+def bench_queries(size: dict, server: FakeInfluxDB) -> dict:
+    server.set_query_result(size["rows"], size["series"])
+    symbols = [f"S{i}" for i in range(size["series"])]
+
+    def query():
+        return PriceModel(data={"symbol": symbols}).filter(TIME_START, TIME_STOP, aggregate="1s")
+
+    def stream():
+        for _ in PriceModel(data={"symbol": symbols}).stream(TIME_START, TIME_STOP, aggregate="1s"):
+            pass
+    rows = len(query())
+    assert rows == size["rows"], f"{rows} rows returned instead of {size['rows']}"
+    return {"query": (rows / timed(query), "rows/s", True),
+            "query_stream": (rows / timed(stream), "rows/s", True),
+            "query_peak_memory": (peak_memory(query), "MiB", False)}
+
+
+def bench_view(size: dict, server: FakeInfluxDB) -> dict:
+    server.set_query_result(size["view_rows"], 1)
+    factory = APIRequestFactory()
+    view = PriceViewSet.as_view({"get": "list"})
+    results = {}
+    for name, extra in (("view", {}), ("view_stream", {"stream": "ndjson"})):
+        latencies = []
+        for _ in range(size["requests"]):
+            params = {"symbol": "S0", "time_start": TIME_START, "time_stop": TIME_STOP, "aggregate": "1s",
+                      **extra}
+            request = factory.get("/prices/", params)
+            start = time.perf_counter()
+            response = view(request)
+            if response.streaming:
+                b"".join(response.streaming_content)
+            else:
+                response.render()
+            latencies.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 200, response.status_code
+        latencies.sort()
+        results[f"{name}_p50"] = (statistics.median(latencies), "ms", False)
+        results[f"{name}_p95"] = (latencies[int(len(latencies) * 0.95) - 1], "ms", False)
+    return results
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> bool:
+    """Print the change of every metric - returns False when a metric regressed more than max_regression"""
+    ok = True
+    print(f"\n{'metric':<22} {'baseline':>14} {'current':>14} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline["results"]:
+            continue
+        old = baseline["results"][name]["value"]
+        new = result["value"]
+        change = (new - old) / old if old else 0.0
+        regression = -change if result["higher_is_better"] else change
+        flag = ""
+        if regression > max_regression:
+            ok = False
+            flag = " REGRESSION"
+        print(f"{name:<22} {old:>14,.2f} {new:>14,.2f} {change:>+8.1%}{flag}")
+    return ok
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    arg_parser.add_argument("--quick", action="store_true", help="small sizes for CI")
+    arg_parser.add_argument("--save", help="write the results to a JSON baseline")
+    arg_parser.add_argument("--compare", help="compare the results with a JSON baseline")
+    arg_parser.add_argument("--max-regression", type=float, default=0.25)
+    args = arg_parser.parse_args()
+    size = SIZES["quick" if args.quick else "full"]
+    server = FakeInfluxDB().start()
+    overrides = override_settings(INFLUXDB_URL=server.url, INFLUXDB_CONNECTIONS=None,
+                                  INFLUXDB_QUERY_CACHE=None)
+    overrides.enable()
+    connections.close_all()
+    try:
+        results = {}
+        for bench in (bench_prepare_point, bench_writes, bench_queries, bench_view):
+            for name, (value, unit, higher_is_better) in bench(size, server).items():
+                results[name] = {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+                print(f"{name:<22} {value:>14,.2f} {unit}")
+    finally:
+        connections.close_all()
+        overrides.disable()
+        server.stop()
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"python": platform.python_version(), "size": "quick" if args.quick else "full",
+                       "results": results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Compare the write validation with the compiled model schema against the previous per item checks.
+
+Usage: python benchmarks/bench_validation.py [--rows 200000]
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "django_influxdb.settings.test")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django_influxdb.models import InfluxModel  # noqa: E402
+
+
+class PriceModel(InfluxModel):
+    measurement = "prices"
+    bucket = "bench"
+    required_influx_tags = ["symbol", "exchange"]
+    optional_influx_tags = ["market"]
+    fields = [{"name": "price", "type": float}, {"name": "volume", "type": float},
+              {"name": "trades", "type": int}]
+
+
+def generate_rows(rows: int) -> list:
+    return [{"symbol": f"S{i % 100}", "exchange": "binance", "price": i * 0.5, "volume": i, "trades": i % 7}
+            for i in range(rows)]
+
+
+def legacy_validate(model: InfluxModel, data: list) -> list:
+    """The per item tag and field checks which were replaced"""
+    influx_tags = model.required_influx_tags + model.optional_influx_tags
+    output = []
+    for item in data:
+        tags = {}
+        for key in influx_tags:
+            if key not in item and key in model.required_influx_tags:
+                raise KeyError(f"Missing required tag {key} from model data")
+            elif key in model.optional_influx_tags and key not in item:
+                continue
+            tags[key] = item[key]
+        fields = {}
+        for field_dict in model.fields:
+            if "name" not in field_dict or "type" not in field_dict:
+                raise KeyError('Fields must be declared as a dict: {"name": "field_name", "type": "float"}')
+            if field_dict["name"] not in item:
+                raise KeyError(f"Setting the field is mandatory. Missing field: {field_dict['name']}")
+            fields[field_dict["name"]] = field_dict["type"](item[field_dict["name"]])
+        output.append({"tags": tags, "fields": fields})
+    return output
+
+
+def current_validate(data: list) -> list:
+    model = PriceModel(data=data)
+    model._validate()
+    return model.validated_data
+
+
+def measure(name: str, func, rows: int) -> float:
+    # Same as timeit - the garbage collections of the big input would dominate the timings
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+    finally:
+        gc.enable()
+    print(f"{name:<10} {elapsed:>8.2f}s {rows / elapsed:>14,.0f} rows/sec")
+    return elapsed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--rows", type=int, default=200000)
+    args = arg_parser.parse_args()
+    data = generate_rows(args.rows)
+    assert legacy_validate(PriceModel(), data[:100]) == current_validate(data[:100])
+    legacy = measure("legacy", lambda: legacy_validate(PriceModel(), data), args.rows)
+    current = measure("current", lambda: current_validate(data), args.rows)
+    print(f"speedup {legacy / current:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""In-process stand-in for the InfluxDB v2 HTTP API used by the benchmarks - no InfluxDB is needed.
+
+/api/v2/write accepts line protocol and counts the points, /api/v2/query serves an annotated CSV response of
+a configurable size (the same response for every query). The server runs on a daemon thread:
+
+    server = FakeInfluxDB().start()
+    server.set_query_result(rows=100000, series=10)
+    ... INFLUXDB_URL = server.url ...
+    server.stop()
+"""
+import gzip
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+CSV_HEADER = ("#datatype,string,long,dateTime:RFC3339,dateTime:RFC3339,dateTime:RFC3339,double,string,string,"
+              "string,string\r\n"
+              "#group,false,false,true,true,false,false,true,true,true,true\r\n"
+              "#default,_result,,,,,,,,,\r\n"
+              ",result,table,_start,_stop,_time,_value,_field,_measurement,symbol,exchange\r\n")
+
+
+def annotated_csv(rows: int, series: int = 1, measurement: str = "prices") -> bytes:
+    """Annotated CSV of rows price points split into series tables (1 symbol each)"""
+    start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    per_series = max(rows // max(series, 1), 1)
+    stop = start + timedelta(seconds=per_series)
+    bounds = "{},{}".format(start.isoformat().replace("+00:00", "Z"), stop.isoformat().replace("+00:00", "Z"))
+    times = [(start + timedelta(seconds=i)).isoformat().replace("+00:00", "Z") for i in range(per_series)]
+    lines = [CSV_HEADER]
+    written = 0
+    for table in range(series):
+        count = min(per_series, rows - written)
+        if count <= 0:
+            break
+        prefix = f",,{table},{bounds},"
+        suffix = f",price,{measurement},S{table},binance\r\n"
+        lines.extend(f"{prefix}{times[i]},{100 + i % 50}.5{suffix}" for i in range(count))
+        written += count
+    lines.append("\r\n")
+    return "".join(lines).encode()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self) -> bytes:
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return body
+
+    def _respond(self, status: int, body: bytes = b"", content_type: str = "application/json") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith(("/ping", "/health")):
+            return self._respond(204)
+        self._respond(404, b'{"code": "not found"}')
+
+    def do_POST(self):
+        server = self.server.fake
+        body = self._body()
+        if self.path.startswith("/api/v2/write"):
+            server.record_write(body)
+            return self._respond(204)
+        if self.path.startswith("/api/v2/query"):
+            server.record_query()
+            return self._respond(200, server.query_result, "text/csv; charset=utf-8")
+        self._respond(404, b'{"code": "not found"}')
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeInfluxDB:
+    """Fake InfluxDB v2 server - counts the written points and the queries"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self._server = _Server((host, port), _Handler)
+        self._server.fake = self
+        self._thread = None
+        self._lock = threading.Lock()
+        self.points = 0
+        self.write_bytes = 0
+        self.writes = 0
+        self.queries = 0
+        self.query_result = annotated_csv(0)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def set_query_result(self, rows: int, series: int = 1) -> None:
+        self.query_result = annotated_csv(rows, series)
+
+    def record_write(self, body: bytes) -> None:
+        with self._lock:
+            self.writes += 1
+            self.write_bytes += len(body)
+            self.points += body.count(b"\n") + (1 if body and not body.endswith(b"\n") else 0)
+
+    def record_query(self) -> None:
+        with self._lock:
+            self.queries += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-influxdb", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,181 @@
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+
+from .durations import is_relative, parse_duration, parse_time, window_start
+
+DEFAULT_CACHE_SETTINGS = {"BACKEND": "django_influxdb.cache.LocMemQueryCache", "OPTIONS": {},
+                          "HISTORICAL_TTL": 86400, "LIVE_TTL": 60, "KEY_PREFIX": "influxdb_query"}
+
+
+class BaseQueryCache:
+    """Cache for query results keyed on the compiled Flux query. The values are pickled."""
+
+    def __init__(self, key_prefix: str = DEFAULT_CACHE_SETTINGS["KEY_PREFIX"], **options):
+        self.key_prefix = key_prefix
+        self._stats_lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0}
+
+    def _count(self, stat: str, value: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[stat] += value
+
+    def make_key(self, *parts) -> str:
+        digest = hashlib.sha256("\n".join(str(p) for p in parts).encode()).hexdigest()
+        return f"{self.key_prefix}:{digest}"
+
+    def get(self, key: str):
+        """Get the cached value or None"""
+        raise NotImplementedError
+
+    def set(self, key: str, value, ttl: float) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class LocMemQueryCache(BaseQueryCache):
+    """In process LRU cache limited by the size of the pickled values (MAX_BYTES option)"""
+
+    def __init__(self, max_bytes: int = 64 * 2 ** 20, **options):
+        super().__init__(**options)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._delete(key)
+                entry = None
+            if entry is None:
+                self._count("misses")
+                return None
+            self._data.move_to_end(key)
+        self._count("hits")
+        return pickle.loads(entry[1])
+
+    def _delete(self, key: str) -> None:
+        _, payload = self._data.pop(key)
+        self.size -= len(payload)
+
+    def set(self, key: str, value, ttl: float) -> None:
+        payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.max_bytes:
+            # Bigger than the whole cache - never cached
+            return
+        with self._lock:
+            if key in self._data:
+                self._delete(key)
+            evicted = 0
+            while self._data and self.size + len(payload) > self.max_bytes:
+                self._delete(next(iter(self._data)))
+                evicted += 1
+            self._data[key] = (time.monotonic() + ttl, payload)
+            self.size += len(payload)
+        self._count("sets")
+        if evicted:
+            self._count("evictions", evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+
+class DjangoQueryCache(BaseQueryCache):
+    """Cache the query results in a Django cache (CACHE option is the alias)"""
+
+    def __init__(self, cache: str = "default", **options):
+        super().__init__(**options)
+        self.cache = caches[cache]
+
+    def get(self, key: str):
+        payload = self.cache.get(key)
+        if payload is None:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return pickle.loads(payload)
+
+    def set(self, key: str, value, ttl: float) -> None:
+        self.cache.set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ttl)
+        self._count("sets")
+
+    def clear(self) -> None:
+        self.cache.clear()
+
+
+def is_historical(time_start: str, time_stop: str, now: datetime) -> bool:
+    """The range is absolute and fully in the past - its data doesn't change"""
+    stop = None if is_relative(time_stop) else parse_time(time_stop)
+    return stop is not None and stop < now and not is_relative(time_start)
+
+
+def get_version(time_start: str, time_stop: str, aggregate: str = None):
+    """Version of a query result which changes when the result can change - constant for historical ranges
+    and the start of the current aggregate window for ranges which touch now(). None without an aggregate."""
+    now = datetime.now(timezone.utc)
+    if is_historical(time_start, time_stop, now):
+        return "historical"
+    every = parse_duration(aggregate)
+    if not every:
+        return None
+    return window_start(now, every).isoformat()
+
+
+def get_ttl(time_start: str, time_stop: str, aggregate: str = None) -> float:
+    """Time to live of a query result. Ranges fully in the past don't change and get the HISTORICAL_TTL.
+    Ranges which touch now() change with every aggregate window - they live until the current window ends,
+    but no longer than the LIVE_TTL."""
+    conf = get_cache_settings()
+    now = datetime.now(timezone.utc)
+    if is_historical(time_start, time_stop, now):
+        return conf["HISTORICAL_TTL"]
+    every = parse_duration(aggregate)
+    if not every:
+        return conf["LIVE_TTL"]
+    until_next_window = (window_start(now, every) + every - now).total_seconds()
+    return max(min(until_next_window, conf["LIVE_TTL"]), 1)
+
+
+def get_cache_settings() -> dict:
+    conf = getattr(settings, "INFLUXDB_QUERY_CACHE", None) or {}
+    return {**DEFAULT_CACHE_SETTINGS, **conf}
+
+
+_query_cache = None
+_query_cache_lock = threading.Lock()
+
+
+def get_query_cache():
+    """The process wide query cache from the INFLUXDB_QUERY_CACHE setting - None when it's not enabled"""
+    global _query_cache
+    if not getattr(settings, "INFLUXDB_QUERY_CACHE", None):
+        return None
+    if _query_cache is None:
+        with _query_cache_lock:
+            if _query_cache is None:
+                conf = get_cache_settings()
+                options = {k.lower(): v for k, v in conf["OPTIONS"].items()}
+                _query_cache = import_string(conf["BACKEND"])(key_prefix=conf["KEY_PREFIX"], **options)
+    return _query_cache
+
+
+def reset_query_cache(**kwargs) -> None:
+    global _query_cache
+    if kwargs.get("setting", "INFLUXDB_QUERY_CACHE") == "INFLUXDB_QUERY_CACHE":
+        _query_cache = None
+
+
+setting_changed.connect(reset_query_cache)
@@ -0,0 +1,187 @@
+import functools
+import re
+from django.conf import settings
+
+from . import exceptions
+
+# The shape of a query is cached, the values are passed in the params record
+SHAPE_CACHE_SIZE = 512
+
+
+def escape_string(value) -> str:
+    """Flux string literal - quotes, backslashes and interpolations are escaped"""
+    value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("${", "\\${")
+    return f'"{value}"'
+
+
+def to_literal(value) -> str:
+    """Flux literal of a params value"""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return "[{}]".format(", ".join(to_literal(v) for v in value))
+    return escape_string(value)
+
+
+def time_kind(value: str) -> str:
+    """Kind of a start/stop checked by Client._check_time - now, time or duration"""
+    if value == "now()":
+        return "now"
+    if value.startswith("time("):
+        return "time"
+    return "duration"
+
+
+def time_value(value: str) -> str:
+    """Params value of a start/stop checked by Client._check_time"""
+    if value.startswith("time("):
+        # time(v: "2021-10-10T14:00:00Z")
+        return value[value.index('"') + 1:value.rindex('"')]
+    return value
+
+
+# Functions which can be used as the fn of aggregateWindow
+AGGREGATE_FUNCTIONS = {"mean", "median", "min", "max", "first", "last", "sum", "count", "spread", "stddev",
+                       "mode", "unique"}
+_PERCENTILE_RE = re.compile(r"p(\d{1,2}(?:\.\d+)?)")
+
+
+def aggregate_function(name: str) -> str:
+    """Flux aggregate function of a function name - percentiles are p50, p95, p99.9"""
+    if name in AGGREGATE_FUNCTIONS:
+        return name
+    match = _PERCENTILE_RE.fullmatch(name or "")
+    if match is None:
+        functions = ",".join(sorted(AGGREGATE_FUNCTIONS))
+        raise exceptions.InvalidAggregation(
+            f"Aggregate function must be one of: [{functions}] or a pNN percentile")
+    q = float(match.group(1)) / 100
+    return f"(column, tables=<-) => tables |> quantile(q: {q!r}, column: column)"
+
+
+def compile_aggregation(spec):
+    """Normalise an aggregation - a function name for all fields ("max") or a dict of output columns which
+    aggregate 1 field each: {"open": ("price", "first"), "volume": ("volume", "sum")}.
+    Returns the Flux function or a tuple of (column, field, Flux function)."""
+    if spec is None or isinstance(spec, str):
+        return aggregate_function(spec or "mean")
+    if not isinstance(spec, dict) or not spec:
+        raise exceptions.InvalidAggregation("The aggregation must be a function name or a dict of columns")
+    columns = []
+    for column, value in spec.items():
+        if not isinstance(value, (list, tuple)) or len(value) != 2:
+            raise exceptions.InvalidAggregation(f"The column {column} must be a (field, function) pair")
+        field, function = value
+        columns.append((column, field, aggregate_function(function)))
+    return tuple(columns)
+
+
+def _time_expression(name: str, kind: str) -> str:
+    if kind == "now":
+        return "now()"
+    return f"{kind}(v: params.{name})"
+
+
+def build_sort(columns) -> str:
+    """Sort by the columns - all of them have to be descending ("-column") or ascending"""
+    desc = all(c.startswith("-") for c in columns)
+    columns = ", ".join(escape_string(c.lstrip("-")) for c in columns)
+    query = f" |> sort(columns: [{columns}]"
+    if desc:
+        query += ", desc: true"
+    return query + ")"
+
+
+@functools.lru_cache(maxsize=SHAPE_CACHE_SIZE)
+def compile_shape(start_kind: str, stop_kind: str, tags: tuple, drop_fields: tuple, aggregate: bool,
+                  sorting: tuple, pivot: bool, count: bool, paginated: bool, shift: bool = False,
+                  aggregation="mean", latest: bool = False) -> str:
+    """Flux query of a shape - the tags are (name, multiple values) pairs and the aggregation is compiled by
+    compile_aggregation. The values are referenced from the params record: bucket, measurement, start, stop,
+    tag_<i>, shift, every, limit and offset.
+    A latest query returns only the most recent point of the range (the change probe of the views)."""
+    query = "from(bucket: params.bucket)"
+    start = _time_expression("start", start_kind)
+    stop = _time_expression("stop", stop_kind)
+    query += f" |> range(start: {start}, stop: {stop})"
+    query += " |> filter(fn: (r) => r._measurement == params.measurement)"
+    if tags:
+        conditions = []
+        for i, (tag, multiple) in enumerate(tags):
+            column = f"r[{escape_string(tag)}]"
+            if multiple:
+                conditions.append(f"contains(value: {column}, set: params.tag_{i})")
+            else:
+                conditions.append(f"{column} == params.tag_{i}")
+        query += " |> filter(fn: (r) => {})".format(" and ".join(conditions))
+    if latest:
+        return query + ' |> last() |> group() |> max(column: "_time")'
+    if shift:
+        # Rollup points stamped with the window stop are moved back to the window start
+        query += " |> timeShift(duration: duration(v: params.shift))"
+    if drop_fields:
+        query += " |> drop(columns: [{}])".format(", ".join(escape_string(f) for f in drop_fields))
+    if aggregate and isinstance(aggregation, tuple):
+        # All the columns are aggregated in 1 query and pivoted to 1 row per window
+        tables = []
+        for column, field, function in aggregation:
+            tables.append(f"data |> filter(fn: (r) => r._field == {escape_string(field)})"
+                          f" |> aggregateWindow(every: duration(v: params.every), fn: {function},"
+                          " createEmpty: false)"
+                          f" |> map(fn: (r) => ({{r with _field: {escape_string(column)}}}))")
+        query = "data = {}\nunion(tables: [{}])".format(query, ", ".join(tables))
+        pivot = True
+    elif aggregate:
+        query += " |> aggregateWindow(every: duration(v: params.every), fn: {}, createEmpty: false)".format(
+            aggregation)
+    if sorting and not (count or paginated):
+        query += build_sort(sorting)
+    if pivot:
+        query += ' |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")'
+    if count:
+        # Merge the tables so that the result is the total number of rows
+        query += ' |> group() |> count(column: "_time")'
+    elif paginated:
+        # Merge and sort the tables so that the page is taken from the whole result
+        query += " |> group()" + build_sort(sorting or ("_time",))
+        query += " |> limit(n: params.limit, offset: params.offset)"
+    return query
+
+
+def compile_query(bucket: str, measurement: str, time_start: str, time_stop: str, tags: dict = None,
+                  drop_fields=(), aggregate: str = None, sorting=(), pivot: bool = False, count: bool = False,
+                  limit: int = None, offset: int = 0, shift: str = None, aggregation="mean",
+                  latest: bool = False) -> tuple:
+    """Compile a query to a (query, params) tuple. The start and stop are checked by Client._check_time.
+    The shift is a negative duration the times are moved by before the aggregation, the aggregation is
+    compiled by compile_aggregation.
+    With the INFLUXDB_QUERY_PARAMS setting the params are sent with the query (InfluxDB Cloud), otherwise
+    they are defined in the query and the params are None.
+    A latest query (compile_shape) uses only the range and the tags."""
+    if latest:
+        drop_fields, aggregate, sorting, pivot, count, limit, shift = (), None, (), False, False, None, None
+    tags = tags or {}
+    shape_tags = tuple((tag, isinstance(value, (list, tuple))) for tag, value in tags.items())
+    query = compile_shape(time_kind(time_start), time_kind(time_stop), shape_tags, tuple(drop_fields),
+                          bool(aggregate), tuple(sorting), bool(pivot), bool(count), limit is not None,
+                          bool(shift), aggregation, bool(latest))
+    params = {"bucket": bucket, "measurement": measurement}
+    if time_start != "now()":
+        params["start"] = time_value(time_start)
+    if time_stop != "now()":
+        params["stop"] = time_value(time_stop)
+    for i, value in enumerate(tags.values()):
+        params[f"tag_{i}"] = [str(v) for v in value] if isinstance(value, (list, tuple)) else str(value)
+    if shift:
+        params["shift"] = shift
+    if aggregate:
+        params["every"] = aggregate
+    if limit is not None and not count:
+        params["limit"] = int(limit)
+        params["offset"] = int(offset)
+    if getattr(settings, "INFLUXDB_QUERY_PARAMS", False):
+        return query, params
+    record = ", ".join(f"{key}: {to_literal(value)}" for key, value in params.items())
+    return f"params = {{{record}}}\n{query}", None
@@ -0,0 +1,117 @@
+import asyncio
+import atexit
+import os
+import threading
+import weakref
+from influxdb_client import InfluxDBClient
+from urllib3.util.retry import Retry
+from django.conf import settings
+
+from . import exceptions
+
+DEFAULT_INFLUX_ALIAS = "default"
+
+
+class ConnectionHandler:
+    """Process wide registry of InfluxDB clients - concept was taken from django.db.connections.
+
+    Connections are configured with the INFLUXDB_CONNECTIONS setting:
+    {"default": {"URL": "http://localhost:8086", "TOKEN": "...", "ORG": "...", "POOL_SIZE": 10}}
+    Missing keys (or the whole setting) fall back to the INFLUXDB_URL/INFLUXDB_TOKEN/INFLUXDB_ORG settings.
+    Every alias gets 1 long lived InfluxDBClient per process. The client wraps a urllib3 pool manager which is
+    thread safe and keeps the connections alive between requests.
+    """
+    defaults = {"TIMEOUT": 3000, "POOL_SIZE": 10, "GZIP": False, "RETRIES": 3, "BACKOFF_FACTOR": 0.1,
+                "VERIFY_SSL": True}
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        # The async clients are bound to the event loop they were created in
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def aliases(self) -> list:
+        return list(getattr(settings, "INFLUXDB_CONNECTIONS", None) or [DEFAULT_INFLUX_ALIAS])
+
+    def settings(self, alias: str = DEFAULT_INFLUX_ALIAS) -> dict:
+        """Get the connection settings for an alias with all the defaults filled in"""
+        connections = getattr(settings, "INFLUXDB_CONNECTIONS", None) or {DEFAULT_INFLUX_ALIAS: {}}
+        if alias not in connections:
+            raise exceptions.ConnectionDoesNotExist(f"The InfluxDB connection '{alias}' doesn't exist")
+        conf = {**self.defaults, "TIMEOUT": getattr(settings, "INFLUXDB_TIMEOUT", self.defaults["TIMEOUT"])}
+        for key in ["URL", "TOKEN", "ORG"]:
+            conf[key] = getattr(settings, f"INFLUXDB_{key}", None)
+        conf.update(connections[alias])
+        return conf
+
+    def _create(self, alias: str) -> InfluxDBClient:
+        conf = self.settings(alias)
+        retries = Retry(total=conf["RETRIES"], backoff_factor=conf["BACKOFF_FACTOR"],
+                        status_forcelist=[429, 502, 503, 504],
+                        # Queries and writes are both POST requests, writes are idempotent in InfluxDB
+                        allowed_methods=None)
+        return InfluxDBClient(url=conf["URL"], token=conf["TOKEN"], org=conf["ORG"], timeout=conf["TIMEOUT"],
+                              enable_gzip=conf["GZIP"], verify_ssl=conf["VERIFY_SSL"],
+                              connection_pool_maxsize=conf["POOL_SIZE"], retries=retries)
+
+    def _check_fork(self) -> None:
+        """A forked worker must not share the sockets of its parent - drop the inherited clients"""
+        if self._pid != os.getpid():
+            self._clients = {}
+            self._pid = os.getpid()
+
+    def __getitem__(self, alias: str) -> InfluxDBClient:
+        self._check_fork()
+        try:
+            return self._clients[alias]
+        except KeyError:
+            pass
+        with self._lock:
+            if alias not in self._clients:
+                self._clients[alias] = self._create(alias)
+            return self._clients[alias]
+
+    def _create_async(self, alias: str):
+        try:
+            from influxdb_client.client.influxdb_client_async import InfluxDBClientAsync
+        except ImportError as e:
+            raise ImportError("The async API requires the influxdb-client[async] extra") from e
+        conf = self.settings(alias)
+        return InfluxDBClientAsync(url=conf["URL"], token=conf["TOKEN"], org=conf["ORG"],
+                                   timeout=conf["TIMEOUT"], enable_gzip=conf["GZIP"],
+                                   verify_ssl=conf["VERIFY_SSL"],
+                                   connection_pool_maxsize=conf["POOL_SIZE"])
+
+    def get_async(self, alias: str = DEFAULT_INFLUX_ALIAS):
+        """Get the InfluxDBClientAsync of the alias for the running event loop.
+        Must be called from a coroutine."""
+        loop = asyncio.get_running_loop()
+        clients = self._async_clients.setdefault(loop, {})
+        if alias not in clients:
+            clients[alias] = self._create_async(alias)
+        return clients[alias]
+
+    async def aclose_all(self) -> None:
+        """Close the async clients of the running event loop"""
+        clients = self._async_clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            await client.close()
+
+    def __contains__(self, alias: str) -> bool:
+        return alias in self.aliases
+
+    def close(self, alias: str) -> None:
+        with self._lock:
+            client = self._clients.pop(alias, None)
+        if client is not None:
+            client.close()
+
+    def close_all(self) -> None:
+        for alias in list(self._clients):
+            self.close(alias)
+
+
+connections = ConnectionHandler()
+atexit.register(connections.close_all)
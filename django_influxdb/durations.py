@@ -0,0 +1,71 @@
+import re
+from datetime import datetime, timedelta, timezone
+from dateutil import parser
+
+_DURATION_RE = re.compile(r"(\d+)(ns|us|µs|ms|s|mo|m|h|d|w|y)")
+# Nanoseconds can't be represented by a timedelta, mo and y aren't fixed durations
+_UNITS = {"us": timedelta(microseconds=1), "µs": timedelta(microseconds=1),
+          "ms": timedelta(milliseconds=1), "s": timedelta(seconds=1), "m": timedelta(minutes=1),
+          "h": timedelta(hours=1), "d": timedelta(days=1), "w": timedelta(weeks=1)}
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def parse_duration(value: str):
+    """Convert an InfluxDB duration literal ("5m", "1h30m", "-2d") to a timedelta.
+    Returns None for calendar units (mo, y) and anything that isn't a duration."""
+    if not value or not isinstance(value, str):
+        return None
+    negative = value.startswith("-")
+    value = value.lstrip("-")
+    parts = _DURATION_RE.findall(value)
+    if not parts or "".join(m + u for m, u in parts) != value:
+        return None
+    total = timedelta()
+    for magnitude, unit in parts:
+        if unit not in _UNITS:
+            return None
+        total += int(magnitude) * _UNITS[unit]
+    return -total if negative else total
+
+
+def parse_time(value: str, now: datetime = None):
+    """Resolve a query start/stop (ISO timestamp, relative duration or now()) to an aware datetime.
+    Returns None when the time can't be resolved (calendar durations)."""
+    now = now or datetime.now(timezone.utc)
+    if value is None or value == "now()":
+        return now
+    duration = parse_duration(value)
+    if duration is not None:
+        # Relative times are always in the past
+        return now - abs(duration)
+    try:
+        moment = parser.isoparse(value)
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+def is_relative(value: str) -> bool:
+    """Check if the start/stop moves with the current time (anything but an ISO timestamp)"""
+    if value is None or value == "now()":
+        return True
+    try:
+        parser.isoparse(value)
+    except ValueError:
+        return True
+    return False
+
+
+def window_start(moment: datetime, every: timedelta) -> datetime:
+    """Start of the aggregate window which holds the moment - InfluxDB aligns the windows to the epoch"""
+    return moment - (moment - EPOCH) % every
+
+
+def to_flux_duration(value: timedelta) -> str:
+    """Format a timedelta as an InfluxDB duration literal"""
+    microseconds = value // timedelta(microseconds=1)
+    if microseconds % 10 ** 6:
+        return f"{microseconds}us"
+    return f"{microseconds // 10 ** 6}s"
@@ -24,3 +24,27 @@ class InvalidTimestamp(Exception):
     def __init__(self, message=invalid_timestamp_msg):
         self.message = message
         super().__init__(self.message)
+
+
+class TaskExists(Exception):
+    pass
+
+
+class ConnectionDoesNotExist(Exception):
+    pass
+
+
+class WriteBufferFull(Exception):
+    pass
+
+
+class WriterClosed(Exception):
+    pass
+
+
+class InvalidModelSchema(Exception):
+    pass
+
+
+class InvalidAggregation(Exception):
+    pass
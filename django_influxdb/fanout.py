@@ -0,0 +1,74 @@
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from .durations import parse_duration, parse_time, window_start
+
+
+def _format_time(moment: datetime) -> str:
+    return moment.isoformat().replace("+00:00", "Z")
+
+
+def split_range(time_start: str, time_stop: str, chunk: str, aggregate: str = None,
+                offset: timedelta = None) -> list:
+    """Split a query range into consecutive (start, stop) sub-ranges of about the chunk duration.
+    The boundaries are aligned to the aggregate windows, so no window is split between 2 sub-ranges.
+    The offset moves the alignment - for ranges which are shifted before the aggregation.
+    The first start and the last stop are kept as they are (relative times stay relative).
+    Ranges which can't be resolved (calendar durations) are not split."""
+    chunk = parse_duration(chunk)
+    now = datetime.now(timezone.utc)
+    start = parse_time(time_start, now)
+    stop = parse_time(time_stop, now)
+    if not chunk or chunk < timedelta() or start is None or stop is None:
+        return [(time_start, time_stop)]
+    every = parse_duration(aggregate)
+    if every:
+        chunk = max(chunk // every, 1) * every
+    offset = offset or timedelta()
+    boundaries = []
+    # The windows are aligned to the epoch, so are the multiples of the window
+    moment = window_start(start - offset, chunk) + chunk + offset
+    while moment < stop:
+        boundaries.append(_format_time(moment))
+        moment += chunk
+    starts = [time_start] + boundaries
+    stops = boundaries + [time_stop]
+    return list(zip(starts, stops))
+
+
+def split_tags(tags: dict, size: int) -> list:
+    """Split the multi value tag filters into filters of at most size values each"""
+    if not size:
+        return [tags]
+    options = []
+    for tag, value in tags.items():
+        if isinstance(value, list) and len(value) > size:
+            options.append([(tag, value[i:i + size]) for i in range(0, len(value), size)])
+        else:
+            options.append([(tag, value)])
+    return [dict(combination) for combination in itertools.product(*options)]
+
+
+def fan_out(function, jobs: list, max_workers: int):
+    """Run the function for every job on a bounded thread pool. Returns an iterator of the results in the
+    order of the jobs - at most max_workers jobs are running or waiting to be consumed at the same time.
+    The first jobs are submitted before returning."""
+    jobs = iter(jobs)
+    max_workers = max(max_workers or 1, 1)
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="influxdb-fan-out")
+    futures = deque(executor.submit(function, job) for job in itertools.islice(jobs, max_workers))
+
+    def results():
+        try:
+            while futures:
+                result = futures.popleft().result()
+                for job in itertools.islice(jobs, 1):
+                    futures.append(executor.submit(function, job))
+                yield result
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+    return results()
@@ -0,0 +1,108 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from django.conf import settings
+
+from .durations import parse_duration, window_start
+
+# Columns of the group key which change with every query range
+_RANGE_COLUMNS = ("_start", "_stop")
+
+
+def series_key(table) -> tuple:
+    """Group key of a table without the range columns - the same for a series across query ranges"""
+    if not table.records:
+        return ()
+    values = table.records[0].values
+    columns = [c.label for c in table.get_group_key() if c.label not in _RANGE_COLUMNS]
+    return tuple((label, values.get(label)) for label in columns)
+
+
+class TailEntry:
+    """Records of a rolling window query grouped by series (table group key) and ordered by time.
+    Records up to the boundary belong to complete aggregate windows and don't change any more. The records
+    cover the range from start."""
+
+    def __init__(self, boundary: datetime, start: datetime):
+        self.boundary = boundary
+        self.start = start
+        self.series = OrderedDict()
+
+    def merged(self, tables, boundary: datetime, start: datetime):
+        """New entry with the fresh tables merged in - the partial windows after the old boundary are replaced
+        and the windows which end before the start of the range are trimmed"""
+        entry = TailEntry(boundary, start)
+        for key, records in self.series.items():
+            kept = [r for r in records if start < r.get_time() <= self.boundary]
+            if kept:
+                entry.series[key] = kept
+        for table in tables:
+            if table.records:
+                entry.series.setdefault(series_key(table), []).extend(table.records)
+        return entry
+
+    @classmethod
+    def from_tables(cls, tables, boundary: datetime, start: datetime):
+        entry = cls(boundary, start)
+        for table in tables:
+            entry.series.setdefault(series_key(table), []).extend(table.records)
+        return entry
+
+    def records(self):
+        for records in self.series.values():
+            yield from records
+
+
+class TailCache:
+    """Process wide LRU of rolling window query results. The next query for the same series fetches only
+    the data since the last complete aggregate window instead of the whole range."""
+
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries or getattr(settings, "INFLUXDB_TAIL_CACHE_SIZE", 128)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def supports(cls, time_start: str, time_stop: str, aggregate: str) -> bool:
+        """Only rolling windows (relative start, stop at now) with a fixed aggregate window can be merged"""
+        return time_stop in (None, "now()") and parse_duration(time_start) is not None and \
+            bool(parse_duration(aggregate))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry: TailEntry) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def query(self, key, query, time_start: str, aggregate: str):
+        """Get the records of a rolling window query. query(time_start) runs the query from time_start to now
+        and returns the tables."""
+        now = datetime.now(timezone.utc)
+        every = parse_duration(aggregate)
+        start = now - abs(parse_duration(time_start))
+        boundary = window_start(now, every)
+        entry = self.get(key)
+        if entry is None or entry.boundary <= start or start < entry.start:
+            # Nothing to reuse - or a wider range than the cached one
+            entry = TailEntry.from_tables(query(time_start), boundary, start)
+        else:
+            # Only the windows which were not complete on the last query are fetched
+            tables = query(entry.boundary.isoformat().replace("+00:00", "Z"))
+            entry = entry.merged(tables, boundary, start)
+        self.set(key, entry)
+        return entry.records()
+
+
+tail_cache = TailCache()
@@ -1,26 +1,41 @@
 import logging
-from influxdb_client import InfluxDBClient, Point, WritePrecision
+from influxdb_client import Point, WritePrecision
+from influxdb_client.client.write_api import SYNCHRONOUS
 from influxdb_client.rest import ApiException
 from django.utils import timezone
 from django.conf import settings
 from dateutil import parser
 from . import exceptions
-logger = logging.getLogger("marketmanager")
+from .cache import get_query_cache, get_ttl
+from .compiler import compile_query
+from .connections import connections, DEFAULT_INFLUX_ALIAS
+from .instrumentation import measure
+from .line_protocol import LineProtocolEncoder, get_encoder
+from .singleflight import get_single_flight
+from .relay import relays
+from .spool import spools
+from .writer import writers, get_write_setting
+logger = logging.getLogger(__name__)
 
 
 class Client:
     """InfluxDB client"""
     def __init__(self, measurement: str, bucket: str = settings.INFLUXDB_DEFAULT_BUCKET,
-                 drop_fields: list = [], sorting_tags: list = []):
+                 drop_fields: list = [], sorting_tags: list = [], using: str = DEFAULT_INFLUX_ALIAS,
+                 use_cache: bool = True):
         self.measurement = measurement
+        self.using = using
+        # Query results are cached only when the INFLUXDB_QUERY_CACHE setting is configured
+        self.use_cache = use_cache
         defaults = {"INFLUXDB_TIMEOUT": 3000, "INFLUXDB_BATCH_SIZE": 500, "INFLUXDB_FLUSH_SIZE": 100}
         for key in defaults:
             value = defaults[key]
             if hasattr(settings, key):
                 value = getattr(settings, key)
             setattr(self, key, value)
-        self.client = InfluxDBClient(url=settings.INFLUXDB_URL, token=settings.INFLUXDB_TOKEN,
-                                     timeout=self.INFLUXDB_TIMEOUT)
+        # The InfluxDB client is shared by the whole process, never close it from here
+        self.client = self._connect(using)
+        self.org = connections.settings(using)["ORG"]
         self.bucket = bucket
         self.time_start = "30m"
         self.time_stop = "now()"
@@ -29,6 +44,22 @@ class Client:
         self.drop_fields = drop_fields
         self.sorting_tags = sorting_tags
         self.tags = []
+        # Values of the compiled query - None when they are defined in the query
+        self.params = None
+        self.pivot_tables = False
+        # Pagination pushdown - limit(n:, offset:) or count() on the merged result tables
+        self.limit = None
+        self.offset = 0
+        self.count_rows = False
+        # Negative duration the times are shifted by before the aggregation (rollup buckets)
+        self.time_shift = None
+        # Aggregate function(s) of the aggregate windows - compiler.compile_aggregation
+        self.aggregation = "mean"
+        # Only the most recent point of the range is queried
+        self.latest_only = False
+
+    def _connect(self, using: str):
+        return connections[using]
 
     @classmethod
     def _check_write_item(cls, item) -> bool:
@@ -55,33 +86,13 @@ class Client:
             return "-{}".format(timestamp)
 
     def _build_query(self) -> str:
-        """Build InfluxDB query"""
-        query = f'from(bucket: "{self.bucket}")'
-        query += f' |> range(start: {self.time_start}, stop: {self.time_stop})'
-        query += f' |> filter(fn: (r) => (r._measurement == "{self.measurement}"))'
-        if self.tags:
-            query += ' |> filter(fn: (r) => ('
-            tag_queries = []
-            for tag, value in self.tags.items():
-                if isinstance(value, list):
-                    tmp = []
-                    for v in value:
-                        tmp.append(f'r.{tag} == "{v}"')
-                    tag_queries.append(" or ".join(tmp))
-                else:
-                    tag_queries.append(f'r.{tag} == "{value}"')
-            query += '{}))'.format(" and ".join(tag_queries))
-        if self.drop_fields:
-            query += ' |> drop(columns: ["{}"])'.format('","'.join(self.drop_fields))
-        if hasattr(self, "aggregate"):
-            query += f' |> aggregateWindow(every: {self.aggregate}, fn: mean, createEmpty: false)'
-        if self.sorting_tags:
-            # Influx doesn't like the single quotes when building the query columns, hence this
-            query += ' |> sort(columns: ["{}"])'.format('","'.join(self.sorting_tags))
-        if self.pivot_tables:
-            query += ' |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")'
-        self.query = query
-        return query
+        """Build InfluxDB query - the shape of the query is compiled once and the values are params"""
+        self.query, self.params = compile_query(
+            self.bucket, self.measurement, self.time_start, self.time_stop, tags=self.tags,
+            drop_fields=self.drop_fields, aggregate=getattr(self, "aggregate", None),
+            sorting=self.sorting_tags, pivot=self.pivot_tables, count=self.count_rows, limit=self.limit,
+            offset=self.offset, shift=self.time_shift, aggregation=self.aggregation, latest=self.latest_only)
+        return self.query
 
     def prepare_point(self, tags: dict, fields: dict, timestamp: bool = True):
         """Prepare an Influx point give the tags and fields"""
@@ -94,30 +105,225 @@ class Client:
             point.time(timezone.now(), WritePrecision.MS)
         return point
 
-    def write(self, data, timestamp: bool = True):
+    def _encode(self, data, timestamp: bool, encoder: LineProtocolEncoder = None):
+        if encoder is None:
+            encoder = get_encoder(self.measurement, precision=WritePrecision.MS)
+        payload, points = encoder.encode_items((i for i in data if self._check_write_item(i)), timestamp)
+        return encoder, payload, points
+
+    def write(self, data, timestamp: bool = True, sync: bool = None, encoder: LineProtocolEncoder = None):
         """Write timeseries points to the InfluxDB. Data item structure:
         {"tags": {"tag1": "value1"}, "fields": {"value": 15}}
-        Each list entry must have a tags and fields key
+        Each list entry must have a tags and fields key.
+        The points are handed to the background batch writer unless sync is set (or INFLUXDB_WRITE_MODE is
+        "synchronous") - then they are written before returning. INFLUXDB_WRITE_MODE "spool" appends them to
+        the disk spool instead and "relay" sends them to the run_influx_relay command.
+        An encoder with the schema of the data (InfluxModel.get_encoder) skips the per value type checks.
         """
-        points = []
-        for item in data:
-            if not self._check_write_item(item):
-                continue
-            points.append(self.prepare_point(item["tags"], item["fields"], timestamp))
-        with self.client.write_api() as write_api:
-            write_api.write(self.bucket, settings.INFLUXDB_ORG, points)
+        mode = get_write_setting("INFLUXDB_WRITE_MODE")
+        if sync is None:
+            sync = mode == "synchronous"
+        with measure("write", measurement=self.measurement, sync=sync) as m:
+            encoder, payload, points = self._encode(data, timestamp, encoder)
+            if m:
+                m.rows, m.bytes = points, len(payload)
+            if not points:
+                return
+            if not sync:
+                handler = {"spool": spools, "relay": relays}.get(mode, writers)
+                return handler[self.using].write(self.bucket, self.org, payload, points=points,
+                                                 precision=encoder.precision)
+            try:
+                self.client.write_api(write_options=SYNCHRONOUS).write(self.bucket, self.org, payload,
+                                                                       write_precision=encoder.precision)
+            except ApiException as e:
+                raise exceptions.InfluxApiException(e)
 
-    def query(self, time_start: str, time_stop: str = "now()", tags: list = [], aggregate: str = None,
-              pivot_tables: bool = False):
-        """Query the InfluxDB - returns List of InfluxDB tables which contain records"""
+    def _prepare_query(self, time_start: str, time_stop: str = "now()", tags: list = [],
+                       aggregate: str = None, pivot_tables: bool = False, limit: int = None,
+                       offset: int = 0, count_rows: bool = False) -> str:
         self.tags = tags
         self.time_start = self._check_time(time_start)
         self.time_stop = self._check_time(time_stop)
         self.aggregate = aggregate
         self.pivot_tables = pivot_tables
-        self._build_query()
-        logger.debug(f"Running query: \"{self.query}\"")
-        try:
-            return self.client.query_api().query(self.query, org=settings.INFLUXDB_ORG,)
-        except ApiException as e:
-            raise exceptions.InfluxApiException(e)
+        self.limit = limit
+        self.offset = offset
+        self.count_rows = count_rows
+        with measure("build_query", measurement=self.measurement) as m:
+            self._build_query()
+            if m:
+                m.bytes = len(self.query)
+        logger.debug("Running query: \"%s\"", self.query)
+        return self.query
+
+    @classmethod
+    def _count_rows(cls, tables) -> int:
+        return sum(len(table.records) for table in tables or [])
+
+    def _run_query(self):
+        """Run the prepared query - the measured time is the HTTP round trip and the parsing of the CSV
+        response, they overlap as the response is parsed while it's read"""
+        with measure("query", measurement=self.measurement, bucket=self.bucket) as m:
+            try:
+                tables = self.client.query_api().query(self.query, org=self.org, params=self.params)
+            except ApiException as e:
+                raise exceptions.InfluxApiException(e)
+            if m:
+                m.query = self.query
+                m.rows = self._count_rows(tables)
+            return tables
+
+    def _get_cache(self) -> tuple:
+        """Get the query cache and the key of the prepared query - (None, None) without a cache"""
+        cache = get_query_cache() if self.use_cache else None
+        if cache is None:
+            return None, None
+        return cache, cache.make_key(self.using, self.org, self.query, self.params)
+
+    def _flight_key(self) -> tuple:
+        return self.using, self.org, self.query, repr(self.params)
+
+    def _run_shared_query(self):
+        """Run the prepared query - identical concurrent queries share 1 execution (INFLUXDB_SINGLE_FLIGHT)"""
+        single_flight = get_single_flight()
+        if single_flight is None:
+            return self._run_query()
+        return single_flight.do(self._flight_key(), self._run_query)
+
+    def _execute(self, time_start: str, time_stop: str):
+        """Run the prepared query through the query cache"""
+        cache, key = self._get_cache()
+        if cache is None:
+            return self._run_shared_query()
+        tables = cache.get(key)
+        if tables is None:
+            tables = self._run_shared_query()
+            cache.set(key, tables, get_ttl(time_start, time_stop, self.aggregate))
+        return tables
+
+    @classmethod
+    def _get_count(cls, tables) -> int:
+        for table in tables:
+            for record in table.records:
+                return record["_time"]
+        return 0
+
+    def query(self, time_start: str, time_stop: str = "now()", tags: list = [], aggregate: str = None,
+              pivot_tables: bool = False, limit: int = None, offset: int = 0):
+        """Query the InfluxDB - returns List of InfluxDB tables which contain records.
+        With a limit only that many rows (after skipping offset rows) of the merged tables are returned."""
+        self._prepare_query(time_start, time_stop, tags, aggregate, pivot_tables, limit, offset)
+        return self._execute(time_start, time_stop)
+
+    def count(self, time_start: str, time_stop: str = "now()", tags: list = [], aggregate: str = None,
+              pivot_tables: bool = False) -> int:
+        """Count the rows the query would return - counted by InfluxDB"""
+        self._prepare_query(time_start, time_stop, tags, aggregate, pivot_tables, count_rows=True)
+        return self._get_count(self._execute(time_start, time_stop))
+
+    def latest_time(self, time_start: str, time_stop: str = "now()", tags: list = []):
+        """Time of the most recent point of the range - None when it's empty. Never cached."""
+        self.latest_only = True
+        self._prepare_query(time_start, time_stop, tags)
+        for table in self._run_query() or []:
+            for record in table.records:
+                return record["_time"]
+        return None
+
+    def query_stream(self, time_start: str, time_stop: str = "now()", tags: list = [], aggregate: str = None,
+                     pivot_tables: bool = False, limit: int = None, offset: int = 0):
+        """Query the InfluxDB - returns a generator of records which are parsed while the response is read"""
+        self._prepare_query(time_start, time_stop, tags, aggregate, pivot_tables, limit, offset)
+        # Only the request is measured - the records are parsed while they are consumed
+        with measure("query_stream", measurement=self.measurement, bucket=self.bucket) as m:
+            if m:
+                m.query = self.query
+            try:
+                # The request is sent here, only the response body is consumed lazily
+                return self.client.query_api().query_stream(self.query, org=self.org, params=self.params)
+            except ApiException as e:
+                raise exceptions.InfluxApiException(e)
+
+
+class AsyncClient(Client):
+    """InfluxDB client for asyncio - the queries and writes don't block the event loop.
+    Requires the influxdb-client[async] extra and has to be used from coroutines."""
+
+    def _connect(self, using: str):
+        # The async client is bound to the running event loop - it's taken when the request is made
+        return None
+
+    @property
+    def async_client(self):
+        return connections.get_async(self.using)
+
+    async def _run_query(self):
+        with measure("query", measurement=self.measurement, bucket=self.bucket) as m:
+            try:
+                query_api = self.async_client.query_api()
+                tables = await query_api.query(self.query, org=self.org, params=self.params)
+            except ApiException as e:
+                raise exceptions.InfluxApiException(e)
+            if m:
+                m.query = self.query
+                m.rows = self._count_rows(tables)
+            return tables
+
+    async def _run_shared_query(self):
+        single_flight = get_single_flight()
+        if single_flight is None:
+            return await self._run_query()
+        return await single_flight.ado(self._flight_key(), self._run_query)
+
+    async def _execute(self, time_start: str, time_stop: str):
+        """Run the prepared query through the query cache"""
+        cache, key = self._get_cache()
+        if cache is None:
+            return await self._run_shared_query()
+        tables = cache.get(key)
+        if tables is None:
+            tables = await self._run_shared_query()
+            cache.set(key, tables, get_ttl(time_start, time_stop, self.aggregate))
+        return tables
+
+    async def query(self, time_start: str, time_stop: str = "now()", tags: list = [], aggregate: str = None,
+                    pivot_tables: bool = False, limit: int = None, offset: int = 0):
+        """Query the InfluxDB - returns List of InfluxDB tables which contain records"""
+        self._prepare_query(time_start, time_stop, tags, aggregate, pivot_tables, limit, offset)
+        return await self._execute(time_start, time_stop)
+
+    async def count(self, time_start: str, time_stop: str = "now()", tags: list = [], aggregate: str = None,
+                    pivot_tables: bool = False) -> int:
+        """Count the rows the query would return - counted by InfluxDB"""
+        self._prepare_query(time_start, time_stop, tags, aggregate, pivot_tables, count_rows=True)
+        return self._get_count(await self._execute(time_start, time_stop))
+
+    async def query_stream(self, time_start: str, time_stop: str = "now()", tags: list = [],
+                           aggregate: str = None, pivot_tables: bool = False, limit: int = None,
+                           offset: int = 0):
+        """Query the InfluxDB - returns an async generator of records parsed while the response is read"""
+        self._prepare_query(time_start, time_stop, tags, aggregate, pivot_tables, limit, offset)
+        with measure("query_stream", measurement=self.measurement, bucket=self.bucket) as m:
+            if m:
+                m.query = self.query
+            try:
+                query_api = self.async_client.query_api()
+                return await query_api.query_stream(self.query, org=self.org, params=self.params)
+            except ApiException as e:
+                raise exceptions.InfluxApiException(e)
+
+    async def write(self, data, timestamp: bool = True, encoder: LineProtocolEncoder = None):
+        """Write timeseries points to the InfluxDB (same data structure as Client.write).
+        The write doesn't block the event loop, so it's always sent right away instead of being batched."""
+        with measure("write", measurement=self.measurement, sync=True) as m:
+            encoder, payload, points = self._encode(data, timestamp, encoder)
+            if m:
+                m.rows, m.bytes = points, len(payload)
+            if not points:
+                return
+            try:
+                await self.async_client.write_api().write(self.bucket, self.org, payload,
+                                                          write_precision=encoder.precision)
+            except ApiException as e:
+                raise exceptions.InfluxApiException(e)
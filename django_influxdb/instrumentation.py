@@ -0,0 +1,203 @@
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import Signal
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("django_influxdb.slow_queries")
+
+DEFAULT_INSTRUMENTATION_SETTINGS = {"ENABLED": False, "HOOKS": [], "SLOW_QUERY_THRESHOLD": None,
+                                    "COLLECTOR": True}
+# Phases which run a query - they are checked against the slow query threshold
+QUERY_PHASES = ("query", "query_stream")
+
+# Sent when an instrumented phase finishes - the sender is the phase name and measurement the Measurement
+phase_finished = Signal()
+
+
+class Measurement:
+    """Timing of 1 run of a phase: build_query, query, query_stream, flatten, clean, render, write and
+    write_batch. The instrumented code sets the rows and bytes it handled."""
+    __slots__ = ("instrumentation", "phase", "labels", "rows", "bytes", "query", "duration", "error",
+                 "_start")
+
+    def __init__(self, instrumentation, phase: str, labels: dict):
+        self.instrumentation = instrumentation
+        self.phase = phase
+        self.labels = labels
+        self.rows = None
+        self.bytes = None
+        self.query = None
+        self.duration = None
+        self.error = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._start
+        self.error = exc_type
+        self.instrumentation.finish(self)
+        return False
+
+
+class _NoMeasurement:
+    """Shared measurement of the disabled instrumentation - it's falsy, so the counting can be skipped"""
+    __slots__ = ()
+
+    def __bool__(self):
+        return False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+NO_MEASUREMENT = _NoMeasurement()
+
+
+class MetricsCollector:
+    """Prometheus style metrics of the phases - a duration histogram and the rows, bytes and errors counters
+    by phase and labels. render() returns the text exposition format."""
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            # (phase, labels) -> [bucket counts, sum, count, rows, bytes, errors]
+            self._series = {}
+
+    def observe(self, measurement: Measurement) -> None:
+        key = (measurement.phase, tuple(sorted(measurement.labels.items())))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0, 0, 0, 0]
+            for i, bound in enumerate(self.buckets):
+                if measurement.duration <= bound:
+                    series[0][i] += 1
+            series[1] += measurement.duration
+            series[2] += 1
+            series[3] += measurement.rows or 0
+            series[4] += measurement.bytes or 0
+            series[5] += measurement.error is not None
+
+    def samples(self) -> dict:
+        """Copy of the series - {(phase, labels): {"count":, "sum":, "rows":, "bytes":, "errors":}}"""
+        with self._lock:
+            return {key: {"buckets": list(s[0]), "sum": s[1], "count": s[2], "rows": s[3], "bytes": s[4],
+                          "errors": s[5]} for key, s in self._series.items()}
+
+    @classmethod
+    def _labels(cls, phase: str, labels: tuple, **extra) -> str:
+        pairs = [("phase", phase)] + list(labels) + list(extra.items())
+        escape = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n"})
+        return "{" + ",".join(f'{k}="{str(v).translate(escape)}"' for k, v in pairs) + "}"
+
+    def render(self) -> str:
+        name = "influxdb_phase_duration_seconds"
+        lines = [f"# TYPE {name} histogram"]
+        samples = self.samples()
+        for (phase, labels), s in samples.items():
+            for bound, count in zip(self.buckets, s["buckets"]):
+                lines.append(f"{name}_bucket{self._labels(phase, labels, le=bound)} {count}")
+            lines.append(f"{name}_bucket{self._labels(phase, labels, le='+Inf')} {s['count']}")
+            lines.append(f"{name}_sum{self._labels(phase, labels)} {s['sum']}")
+            lines.append(f"{name}_count{self._labels(phase, labels)} {s['count']}")
+        for counter in ("rows", "bytes", "errors"):
+            lines.append(f"# TYPE influxdb_phase_{counter}_total counter")
+            for (phase, labels), s in samples.items():
+                lines.append(f"influxdb_phase_{counter}_total{self._labels(phase, labels)} {s[counter]}")
+        return "\n".join(lines) + "\n"
+
+
+collector = MetricsCollector()
+
+
+class Instrumentation:
+    """Reports the measurements to the collector, the hooks (callables which receive the measurement), the
+    phase_finished signal and the slow query log"""
+
+    def __init__(self, enabled: bool = False, hooks=(), slow_query_threshold: float = None,
+                 collector: MetricsCollector = None):
+        self.enabled = enabled
+        self.hooks = [import_string(hook) if isinstance(hook, str) else hook for hook in hooks]
+        # Milliseconds
+        self.slow_query_threshold = slow_query_threshold
+        self.collector = collector
+
+    def finish(self, measurement: Measurement) -> None:
+        if self.collector is not None:
+            self.collector.observe(measurement)
+        for hook in self.hooks:
+            try:
+                hook(measurement)
+            except Exception:
+                logger.exception("InfluxDB instrumentation hook %s failed", hook)
+        phase_finished.send(sender=measurement.phase, measurement=measurement)
+        threshold = self.slow_query_threshold
+        if (threshold is not None and measurement.phase in QUERY_PHASES
+                and measurement.duration * 1000 >= threshold):
+            slow_query_logger.warning("Slow InfluxDB query (%.1f ms, %s rows): %s",
+                                      measurement.duration * 1000, measurement.rows, measurement.query)
+
+
+def get_instrumentation_settings() -> dict:
+    return {**DEFAULT_INSTRUMENTATION_SETTINGS, **getattr(settings, "INFLUXDB_INSTRUMENTATION", {})}
+
+
+_instrumentation = None
+_instrumentation_lock = threading.Lock()
+
+
+def get_instrumentation() -> Instrumentation:
+    """The process wide instrumentation from the INFLUXDB_INSTRUMENTATION setting"""
+    global _instrumentation
+    if _instrumentation is None:
+        with _instrumentation_lock:
+            if _instrumentation is None:
+                conf = get_instrumentation_settings()
+                _instrumentation = Instrumentation(conf["ENABLED"], conf["HOOKS"],
+                                                   conf["SLOW_QUERY_THRESHOLD"],
+                                                   collector if conf["COLLECTOR"] else None)
+    return _instrumentation
+
+
+def measure(phase: str, **labels):
+    """Context manager which measures a phase - the measurement is falsy when the instrumentation is disabled:
+        with measure("clean", measurement="prices") as m:
+            results = clean(records)
+            if m:
+                m.rows = len(results)
+    """
+    instrumentation = _instrumentation or get_instrumentation()
+    if not instrumentation.enabled:
+        return NO_MEASUREMENT
+    return Measurement(instrumentation, phase, labels)
+
+
+def reset_instrumentation(**kwargs):
+    global _instrumentation
+    if kwargs.get("setting", "INFLUXDB_INSTRUMENTATION") == "INFLUXDB_INSTRUMENTATION":
+        _instrumentation = None
+
+
+setting_changed.connect(reset_instrumentation)
+
+
+def metrics_view(request):
+    """Django view of the collected metrics in the Prometheus text format"""
+    return HttpResponse(collector.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,204 @@
+import math
+import numbers
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from influxdb_client import WritePrecision
+
+_MEASUREMENT_ESCAPE = str.maketrans({",": "\\,", " ": "\\ ", "\n": "\\n", "\r": "\\r", "\t": "\\t"})
+_KEY_ESCAPE = str.maketrans({",": "\\,", "=": "\\=", " ": "\\ ", "\n": "\\n", "\r": "\\r", "\t": "\\t"})
+_STRING_ESCAPE = str.maketrans({'"': '\\"', "\\": "\\\\"})
+_PRECISION_FACTORS = {WritePrecision.NS: 1, WritePrecision.US: 10 ** 3, WritePrecision.MS: 10 ** 6,
+                      WritePrecision.S: 10 ** 9}
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# Bound for the escaped series (measurement + tags) cache of an encoder
+SERIES_CACHE_SIZE = 10000
+
+
+def escape_measurement(value) -> str:
+    return str(value).translate(_MEASUREMENT_ESCAPE)
+
+
+def escape_key(value) -> str:
+    """Escape a tag key, tag value or field key"""
+    return str(value).translate(_KEY_ESCAPE)
+
+
+def format_float(value):
+    value = float(value)
+    if not math.isfinite(value):
+        # InfluxDB doesn't support NaN and infinity - the field is skipped
+        return None
+    return repr(value)
+
+
+def format_int(value) -> str:
+    return f"{int(value)}i"
+
+
+def format_bool(value) -> str:
+    return "true" if value else "false"
+
+
+def format_string(value) -> str:
+    return '"' + str(value).translate(_STRING_ESCAPE) + '"'
+
+
+FORMATTERS = {float: format_float, int: format_int, bool: format_bool, str: format_string}
+
+
+def format_value(value):
+    """Format a field value of any type"""
+    formatter = FORMATTERS.get(type(value))
+    if formatter is not None:
+        return formatter(value)
+    if isinstance(value, bool):
+        return format_bool(value)
+    if isinstance(value, numbers.Integral):
+        return format_int(value)
+    if isinstance(value, numbers.Real):
+        return format_float(value)
+    return format_string(value)
+
+
+class LineProtocolEncoder:
+    """Encode points to InfluxDB line protocol without building influxdb_client Point objects.
+
+    The encoding plan is built once from the declared tags and fields (a list of (name, type) pairs) - every
+    field gets the formatter of its type. Without declared fields the formatter is picked per value.
+    Each encode call returns a tuple of (line protocol bytes, number of points) for the whole batch.
+    """
+
+    def __init__(self, measurement: str, tags=(), fields=None, precision: str = WritePrecision.MS,
+                 time_key: str = "timestamp"):
+        self.measurement = measurement
+        self.precision = precision
+        self.time_key = time_key
+        self._measurement = escape_measurement(measurement)
+        # InfluxDB handles the tags best when they are sorted by key
+        self._tags = tuple((name, escape_key(name)) for name in sorted(tags))
+        self._fields = None
+        if fields is not None:
+            self._fields = tuple((name, escape_key(name) + "=", FORMATTERS.get(field_type, format_value))
+                                 for name, field_type in sorted(fields))
+            self._field_names = frozenset(field[0] for field in self._fields)
+        self._series = {}
+
+    def _timestamp(self, timestamp):
+        """Convert the timestamp argument to a line protocol suffix. True means now."""
+        if timestamp is True:
+            return " " + str(time.time_ns() // _PRECISION_FACTORS[self.precision])
+        if timestamp is None or timestamp is False:
+            return ""
+        return " " + str(self.convert_time(timestamp))
+
+    def convert_time(self, value) -> int:
+        """Convert a datetime or an integer in the encoder precision to an integer timestamp"""
+        if isinstance(value, datetime):
+            if value.tzinfo is None:
+                # Naive datetimes are treated as UTC
+                value = value.replace(tzinfo=timezone.utc)
+            delta = value - _EPOCH
+            nanoseconds = (delta.days * 86400 + delta.seconds) * 10 ** 9 + delta.microseconds * 10 ** 3
+            return nanoseconds // _PRECISION_FACTORS[self.precision]
+        return int(value)
+
+    def _series_key(self, tags) -> str:
+        """Escaped measurement and tag set - cached because the same series repeat in a batch"""
+        values = tuple(tags.get(name) for name, _ in self._tags)
+        try:
+            return self._series[values]
+        except KeyError:
+            pass
+        key = self._measurement
+        for (_, escaped_name), value in zip(self._tags, values):
+            if value is None or value == "":
+                continue
+            key += "," + escaped_name + "=" + escape_key(value)
+        if len(self._series) >= SERIES_CACHE_SIZE:
+            self._series.clear()
+        self._series[values] = key
+        return key
+
+    def _dynamic_series_key(self, tags: dict) -> str:
+        key = self._measurement
+        for name in sorted(tags):
+            value = tags[name]
+            if value is None or value == "":
+                continue
+            key += "," + escape_key(name) + "=" + escape_key(value)
+        return key
+
+    def _field_set(self, fields: dict) -> str:
+        output = []
+        if self._fields is None:
+            for name, value in fields.items():
+                if value is None:
+                    continue
+                value = format_value(value)
+                if value is not None:
+                    output.append(escape_key(name) + "=" + value)
+            return ",".join(output)
+        for name, prefix, formatter in self._fields:
+            value = fields.get(name)
+            if value is None:
+                continue
+            value = formatter(value)
+            if value is not None:
+                output.append(prefix + value)
+        return ",".join(output)
+
+    def _line(self, series: str, field_set: str, row_time, suffix: str):
+        if not field_set:
+            # A point without fields is invalid line protocol
+            return None
+        if row_time is not None:
+            suffix = " " + str(self.convert_time(row_time))
+        return series + " " + field_set + suffix
+
+    def _finish(self, lines: list):
+        lines = [line for line in lines if line is not None]
+        return "\n".join(lines).encode(), len(lines)
+
+    def encode(self, rows, timestamp=True):
+        """Encode flat rows which hold both the tags and the fields: {"symbol": "BTC", "price": 1.5}.
+        A row value under time_key overrides the batch timestamp. With declared fields and no declared tags
+        the other keys of a row are its tags, same as the items of encode_items."""
+        suffix = self._timestamp(timestamp)
+        lines = []
+        for row in rows:
+            if self._fields is None:
+                tags = {name: row[name] for name, _ in self._tags if name in row}
+                fields = {k: v for k, v in row.items() if k not in tags and k != self.time_key}
+                lines.append(self._line(self._dynamic_series_key(tags), self._field_set(fields),
+                                        row.get(self.time_key), suffix))
+            elif not self._tags:
+                tags = {k: v for k, v in row.items() if k not in self._field_names and k != self.time_key}
+                lines.append(self._line(self._dynamic_series_key(tags), self._field_set(row),
+                                        row.get(self.time_key), suffix))
+            else:
+                lines.append(self._line(self._series_key(row), self._field_set(row), row.get(self.time_key),
+                                        suffix))
+        return self._finish(lines)
+
+    def encode_items(self, items, timestamp=True):
+        """Encode validated items: {"tags": {"symbol": "BTC"}, "fields": {"price": 1.5}}"""
+        suffix = self._timestamp(timestamp)
+        lines = []
+        for item in items:
+            tags = item["tags"]
+            series = self._series_key(tags) if self._tags else self._dynamic_series_key(tags)
+            lines.append(self._line(series, self._field_set(item["fields"]), item.get("time"), suffix))
+        return self._finish(lines)
+
+    def encode_columns(self, columns: dict, timestamp=True):
+        """Encode columnar data - a dict of equally sized lists: {"symbol": ["BTC"], "price": [1.5]}"""
+        names = list(columns)
+        return self.encode((dict(zip(names, values)) for values in zip(*columns.values())), timestamp)
+
+
+@lru_cache(maxsize=256)
+def get_encoder(measurement: str, tags: tuple = (), fields: tuple = None,
+                precision: str = WritePrecision.MS) -> LineProtocolEncoder:
+    """Shared encoder for a measurement and schema. The fields are a tuple of (name, type) pairs."""
+    return LineProtocolEncoder(measurement, tags=tags, fields=fields, precision=precision)
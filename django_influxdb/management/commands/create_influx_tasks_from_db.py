@@ -1,7 +1,7 @@
 from django.core.management.base import BaseCommand
 
 from django_influxdb.models import InfluxTasks
-from django_influxdb.tasks import EveryTask
+from django_influxdb.tasks import EveryTask, MetadataIndex
 
 
 class Command(BaseCommand):
@@ -11,13 +11,15 @@ class Command(BaseCommand):
         parser.add_argument("--name", action="store", dest="name",
                             help="name of the influx task")
 
-    def create(self, name):
-        return EveryTask(name=name).create_from_db()
+    def create(self, name, index=None):
+        return EveryTask(name=name, index=index).create_from_db()
 
     def handle(self, **options):
         qs = InfluxTasks.objects.all()
         if options["name"]:
             qs = qs.filter(name=options["name"])
+        # The orgs, buckets and tasks are loaded once instead of for every task
+        index = MetadataIndex()
         for task in qs:
-            result = self.create(task.name)
+            result = self.create(task.name, index)
             self.stdout.write(result)
@@ -0,0 +1,43 @@
+import signal
+from django.core.management.base import BaseCommand
+
+from django_influxdb.connections import DEFAULT_INFLUX_ALIAS
+from django_influxdb.relay import RelayServer, get_relay_settings
+from django_influxdb.spool import DiskSpool
+from django_influxdb.writer import BatchWriter
+
+
+class Command(BaseCommand):
+    help = ("Receive the points of the worker processes (INFLUXDB_WRITE_MODE = \"relay\") on a Unix socket "
+            "or a UDP port and write them to InfluxDB in large batches.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--address", action="store", dest="address",
+                            help="path of the Unix socket or udp://host:port (INFLUXDB_RELAY[\"ADDRESS\"])")
+        parser.add_argument("--using", action="store", dest="using", default=DEFAULT_INFLUX_ALIAS,
+                            help="InfluxDB connection alias of the upstream writes")
+        parser.add_argument("--spool", action="store_true", dest="spool",
+                            help="buffer the points in the disk spool instead of in memory")
+        parser.add_argument("--bucket", action="store", dest="bucket",
+                            help="bucket of the plain line protocol datagrams")
+        parser.add_argument("--org", action="store", dest="org",
+                            help="org of the plain line protocol datagrams")
+
+    def handle(self, **options):
+        conf = get_relay_settings()
+        if options["spool"]:
+            writer = DiskSpool(using=options["using"], batch_size=conf["BATCH_SIZE"])
+        else:
+            writer = BatchWriter(using=options["using"], batch_size=conf["BATCH_SIZE"],
+                                 flush_size=conf["BATCH_SIZE"], flush_interval=conf["FLUSH_INTERVAL"],
+                                 buffer_size=conf["BUFFER_SIZE"])
+        server = RelayServer(writer, address=options["address"], bucket=options["bucket"], org=options["org"])
+        signal.signal(signal.SIGTERM, lambda *args: server.stop())
+        self.stdout.write(f"Relaying {server.address} to the '{options['using']}' InfluxDB connection")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close(timeout=10)
+        self.stdout.write(", ".join(f"{key}: {value}" for key, value in server.stats.items()))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from django_influxdb.connections import DEFAULT_INFLUX_ALIAS
+from django_influxdb.fanout import fan_out
+from django_influxdb.models import InfluxTasks
+from django_influxdb.tasks import EveryTask, MetadataIndex
+
+
+class Command(BaseCommand):
+    help = "Create and update the InfluxDB tasks from the DB - the unchanged tasks are skipped."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--name", action="store", dest="name",
+                            help="name of the influx task")
+        parser.add_argument("--using", action="store", dest="using", default=DEFAULT_INFLUX_ALIAS,
+                            help="InfluxDB connection alias")
+        parser.add_argument("--concurrency", action="store", dest="concurrency", type=int, default=8,
+                            help="tasks synced at the same time")
+        parser.add_argument("--dry-run", action="store_true", dest="dry_run",
+                            help="only print the changes")
+
+    def handle(self, **options):
+        qs = InfluxTasks.objects.all()
+        if options["name"]:
+            qs = qs.filter(name=options["name"])
+        # The orgs, buckets and tasks are loaded once for all the tasks
+        index = MetadataIndex(options["using"])
+
+        def sync(db_obj):
+            task = EveryTask(name=db_obj.name, using=options["using"], index=index)
+            return db_obj.name, task.sync(db_obj, dry_run=options["dry_run"])
+        totals = {"create": 0, "update": 0, "unchanged": 0}
+        for name, (action, diff) in fan_out(sync, list(qs), options["concurrency"]):
+            totals[action] += 1
+            if action == "unchanged":
+                continue
+            self.stdout.write(f"{action} {name}")
+            if options["dry_run"]:
+                for line in diff:
+                    self.stdout.write(f"  {line}")
+        prefix = "Would " if options["dry_run"] else ""
+        self.stdout.write(prefix + ", ".join(f"{action}: {count}" for action, count in totals.items()))
@@ -1,10 +1,24 @@
 from django.db import models
-from functools import reduce
+from collections import OrderedDict
+from itertools import chain, islice
 import logging
-from django_influxdb.influxdb import Client as InfluxClient
+import time
+from django_influxdb.influxdb import AsyncClient, Client as InfluxClient
 from django_influxdb import exceptions
+from django_influxdb.compiler import compile_aggregation
+from django_influxdb.connections import DEFAULT_INFLUX_ALIAS
+from django_influxdb.durations import to_flux_duration
+from django_influxdb.fanout import fan_out, split_range, split_tags
+from django_influxdb.incremental import series_key, tail_cache
+from django_influxdb.instrumentation import measure
+from django_influxdb.line_protocol import LineProtocolEncoder, get_encoder
+from django_influxdb.preaggregation import compile_pre_aggregation, rollup_buffers
+from django_influxdb.queryset import InfluxManager
+from django_influxdb.records import Record, record_type
+from django_influxdb.routing import Route, compile_rollups, route
+from django_influxdb.schema import SCHEMA_ATTRIBUTES, ModelSchema
 
-logger = logging.getLogger()
+logger = logging.getLogger(__name__)
 
 
 class InfluxTasks(models.Model):
@@ -25,116 +39,388 @@ class InfluxModel:
     optional_influx_tags = []
     fields = []
     drop_fields = []
+    sorting_tags = []
     default_aggregation = "5m"
-    pivot_tables = False  # Set to true if you have multiple fields and want them in 1 row instead of different tables
+    using = DEFAULT_INFLUX_ALIAS  # Connection alias from the INFLUXDB_CONNECTIONS setting
+    cache_queries = True  # Use the query cache when the INFLUXDB_QUERY_CACHE setting is configured
+    # Rolling window queries (relative start, stop at now) fetch only the data since the last query
+    incremental_queries = False
+    # Set to true if you have multiple fields and want them in 1 row instead of different tables
+    pivot_tables = False
+    # Long ranges are split into sub-queries of this duration (e.g. "7d") which run in parallel
+    query_chunk = None
+    # Multi value tag filters are split into sub-queries with at most this many values
+    query_tag_chunk = None
+    query_concurrency = 4  # Sub-queries running at the same time
+    bulk_batch_size = 5000  # Items validated, encoded and written together by bulk_save
+    # Downsampled buckets of the measurement, the queries are routed to the coarsest one which fits:
+    # [{"bucket": "prices_1h", "resolution": "1h", "retention": "365d"}] - see routing.compile_rollups
+    rollups = []
+    # Named aggregations selectable per query - a function name or a dict of output columns which aggregate
+    # 1 field each in the same query: {"ohlc": {"open": ("price", "first"), "close": ("price", "last")}}
+    aggregations = {}
+    # Points saved with save/asave are aggregated in memory and 1 point per series is written every interval:
+    # {"interval": "10s", "fields": {"price": "mean", "price_max": ("price", "max")}} - see
+    # preaggregation.compile_pre_aggregation. bulk_save writes the raw points.
+    pre_aggregation = None
+    objects = InfluxManager()
+    # Compiled from the declaration above for every model class
+    influx_tags = []
+    _schema = ModelSchema([], [], [])
+    _rollups = ()
+    _aggregations = {}
+    _pre_aggregation = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # The declaration errors are raised when the model is defined
+        cls._schema = ModelSchema.from_model(cls)
+        cls.influx_tags = list(cls._schema.tags)
+        cls._rollups = compile_rollups(cls.rollups)
+        cls._aggregations = {name: compile_aggregation(spec) for name, spec in cls.aggregations.items()}
+        cls._pre_aggregation = compile_pre_aggregation(cls.pre_aggregation, cls._schema)
 
     def __init__(self, **kwargs):
         self.data = kwargs.get("data", {})
         self.validated_data = []
-        self.influx_tags = self.required_influx_tags + self.optional_influx_tags
         if kwargs.get("sorting_tags"):
             self.sorting_tags = kwargs["sorting_tags"]
 
+    @property
+    def schema(self) -> ModelSchema:
+        """The compiled schema of the model - recompiled if the tags or fields were replaced on the object"""
+        if any(attr in self.__dict__ for attr in SCHEMA_ATTRIBUTES):
+            return ModelSchema.from_model(self)
+        return self._schema
+
     def _generate_tags(self, item, exc_on_missing: bool = True) -> dict:
         """Generate a dictionary of tag->value pairs from a list of tags and a data dict"""
+        required_tags = self.schema.required_tags
         output = {}
         for key in self.influx_tags:
-            if exc_on_missing and key not in item and key in self.required_influx_tags:
+            if key in item:
+                output[key] = item[key]
+            elif exc_on_missing and key in required_tags:
                 raise KeyError(f"Missing required tag {key} from model data")
-            elif key in self.optional_influx_tags and key not in item:
-                continue
-            output[key] = item[key]
         return output
 
     def _generate_fields(self, item) -> dict:
-        """Generate the fields """
-        fields = {}
-        for field_dict in self.fields:
-            if "name" not in field_dict or "type" not in field_dict:
-                raise KeyError('Fields must be declared as a dict: {"name": "field_name", "type": "float"}')
-            field_name = field_dict["name"]
-            field_type = field_dict["type"]
-            if field_name not in item:
-                raise KeyError(f"Setting the field is mandatory. Missing field: {self.field}")
-            value = item[field_name]
-            # Add the casted value to the list of ffield_type(value)ields
-            fields[field_name] = field_type(value)
-        return fields
+        """Generate the fields casted to their declared types"""
+        return self.schema.cast_fields(item)
 
     def _validate(self) -> None:
         """Validate the tags and fields in the class are present in the data"""
-        logger.debug(f"Starting validation for {self.data}")
+        logger.debug("Starting validation for %s", self.data)
         if not isinstance(self.data, dict) and not isinstance(self.data, list):
             raise exceptions.BadDataType("Data type must be list or dict")
         if not isinstance(self.data, list):
             self.data = [self.data]
-        for item in self.data:
-            entry = {}
-            entry["tags"] = self._generate_tags(item)
-            entry["fields"] = self._generate_fields(item)
-            self.validated_data.append(entry)
-        logger.debug(f"Finished validation. Validated data: {self.validated_data}")
-
-    def _clean_result(self, result):
-        """Clean out InfluxDB internal fields and tags and leave only the model tags"""
-        current = result.values
-        output = {}
-        try:
-            output["timestamp"] = current["_time"]
-        except KeyError:
-            pass
+        self.validated_data.extend(map(self.schema.validate_row, self.data))
+        logger.debug("Finished validation. Validated data: %s", self.validated_data)
+
+    def _clean_plan(self, current: dict, columns: tuple = None) -> tuple:
+        """Get the record type and the source column of each output key for a record's columns.
+        The columns of a multi column aggregation replace the fields."""
+        keys = []
+        sources = []
+        if "_time" in current:
+            keys.append("timestamp")
+            sources.append("_time")
         for tag in self.influx_tags:
-            if tag not in current:
-                continue
-            output[tag] = current[tag]
-        for field in self.fields:
-            field_name = field["name"]
-            output[field_name] = current.get(field_name)
-        try:
-            output[current["_field"]] = current["_value"]
-        except KeyError:
-            pass
-        return output
+            if tag in current:
+                keys.append(tag)
+                sources.append(tag)
+        for name in columns or [field["name"] for field in self.fields]:
+            keys.append(name)
+            sources.append(name)
+        if "_field" in current and "_value" in current:
+            field_name = current["_field"]
+            if field_name in keys:
+                sources[keys.index(field_name)] = "_value"
+            else:
+                keys.append(field_name)
+                sources.append("_value")
+        return record_type(tuple(keys)), tuple(sources)
+
+    def _iter_clean(self, records, aggregation=None):
+        """Clean out InfluxDB internal fields and tags and leave only the model tags - in a single pass.
+        Records of the same table and field share the columns, so the cleaning plan is built once for them."""
+        columns = tuple(c[0] for c in aggregation) if isinstance(aggregation, tuple) else None
+        plans = {}
+        for record in records:
+            current = record.values
+            key = (record.table, current.get("_field"))
+            try:
+                cls, sources = plans[key]
+            except KeyError:
+                cls, sources = plans[key] = self._clean_plan(current, columns)
+            yield cls(map(current.get, sources))
+
+    def _clean_records(self, records, aggregation=None) -> list:
+        """Cleaned list of the records - records which are parsed or fetched lazily are measured with the
+        cleaning"""
+        with measure("clean", model=type(self).__name__) as m:
+            results = list(self._iter_clean(records, aggregation))
+            if m:
+                m.rows = len(results)
+        return results
+
+    def _clean_result(self, result) -> Record:
+        """Clean out InfluxDB internal fields and tags and leave only the model tags"""
+        cls, sources = self._clean_plan(result.values)
+        return cls(map(result.values.get, sources))
 
     def _flatten_results(self, data):
         """Influx returns the records as a list of tables, which have lists of results.
         Flatten the results to a simple list of results."""
-        def red(a, b):
-            """Reducer function to flatten the list of table records"""
-            if type(a) == list:
-                return a + b.records
-            return a.records + b.records
-        if not data:
-            return []
-        self.results = reduce(red, data)
+        with measure("flatten", model=type(self).__name__) as m:
+            self.results = list(chain.from_iterable(table.records for table in data or []))
+            if m:
+                m.rows = len(self.results)
         return self.results
 
     def clean_results(self):
         """Clean each of the results in the list"""
-        output = []
-        for result in self.results:
-            output.append(self._clean_result(result))
-        self.results = output
+        self.results = self._clean_records(self.results)
         return self.results
 
-    def filter(self, time_start: str, time_stop: str = "now()", aggregate: str = None):
-        """Query Influx based on the tags from the object (the object must be initialized with the tags)."""
-        client = InfluxClient(measurement=self.measurement, sorting_tags=self.sorting_tags,
-                              bucket=self.bucket, drop_fields=self.drop_fields)
+    def _get_client(self, part: Route = None, aggregation="mean", client_class=None) -> InfluxClient:
+        """Client for the model bucket or the bucket of a route"""
+        client_class = client_class or InfluxClient
+        client = client_class(measurement=self.measurement, sorting_tags=self.sorting_tags,
+                              bucket=part.bucket if part else self.bucket, drop_fields=self.drop_fields,
+                              using=self.using, use_cache=self.cache_queries)
+        if part is not None and part.shift:
+            client.time_shift = "-" + to_flux_duration(part.shift)
+        client.aggregation = aggregation
+        return client
+
+    def _get_async_client(self, part: Route = None, aggregation="mean") -> AsyncClient:
+        return self._get_client(part, aggregation, client_class=AsyncClient)
+
+    def _get_aggregation(self, aggregation=None):
+        """Compiled aggregation - the name of a declared aggregation, a function name or a dict of columns"""
+        if aggregation is None:
+            return "mean"
+        if isinstance(aggregation, str) and aggregation in self._aggregations:
+            return self._aggregations[aggregation]
+        return compile_aggregation(aggregation)
+
+    def _route(self, time_start: str, time_stop: str, aggregate: str, aggregation="mean",
+               single: bool = False) -> list:
+        """Routes of a query to the rollup buckets - single routes the whole range to 1 bucket.
+        The rollups hold the means of the windows, other aggregations are read from the raw bucket."""
+        rollups = self._rollups if aggregation == "mean" else ()
+        return route(self.bucket, rollups, time_start, time_stop, aggregate, single=single)
+
+    def _tail_key(self, tags: dict, aggregate: str, aggregation="mean") -> tuple:
+        tags = tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in tags.items()))
+        return (self.using, self.bucket, self.measurement, tags, aggregate, aggregation, self.pivot_tables,
+                tuple(self.drop_fields), tuple(self.sorting_tags))
+
+    def _incremental_records(self, tags: dict, time_start: str, aggregate: str, aggregation="mean"):
+        """Records of a rolling window query - only the windows since the last query are fetched"""
+        def query(start):
+            client = self._get_client(aggregation=aggregation)
+            # The tail cache replaces the query cache for these queries
+            client.use_cache = False
+            return client.query(time_start=start, tags=tags, aggregate=aggregate,
+                                pivot_tables=self.pivot_tables)
+        key = self._tail_key(tags, aggregate, aggregation)
+        return tail_cache.query(key, query, time_start, aggregate)
+
+    def _query_jobs(self, tags: dict, time_start: str, time_stop: str, aggregate: str,
+                    aggregation="mean") -> list:
+        """Sub-queries (route, tags) of a query - grouped by the tag filter and ordered by time"""
+        parts = []
+        for part in self._route(time_start, time_stop, aggregate, aggregation):
+            if not self.query_chunk:
+                parts.append(part)
+                continue
+            ranges = split_range(part.time_start, part.time_stop, self.query_chunk, aggregate, part.shift)
+            parts += [part._replace(time_start=start, time_stop=stop) for start, stop in ranges]
+        tag_filters = split_tags(tags, self.query_tag_chunk)
+        return [(part, tag_filter) for tag_filter in tag_filters for part in parts]
+
+    def _fan_out_records(self, jobs: list, aggregate: str, aggregation="mean"):
+        """Records of the sub-queries - they run on a thread pool and are merged lazily, series by series like
+        the result of the unsplit query: the records of a series in time order, the series in the order they
+        first appear. The first series of a tag filter is yielded as its sub-queries finish, the other
+        series of the tag filter are kept until its last sub-query. The sorting_tags are applied within each
+        sub-query."""
+        def query(job):
+            part, tags = job
+            client = self._get_client(part, aggregation)
+            tables = client.query(time_start=part.time_start, time_stop=part.time_stop, tags=tags,
+                                  aggregate=aggregate, pivot_tables=self.pivot_tables)
+            return tags, [(series_key(table), table.records) for table in tables]
+
+        def merge(results):
+            current, head, rest = None, None, OrderedDict()
+            for tags, tables in results:
+                # The sub-queries of a tag filter share its dict
+                if tags is not current:
+                    yield from chain.from_iterable(rest.values())
+                    current, head, rest = tags, None, OrderedDict()
+                for key, records in tables:
+                    if head is None:
+                        head = key
+                    if key == head:
+                        yield from records
+                    else:
+                        rest.setdefault(key, []).extend(records)
+            yield from chain.from_iterable(rest.values())
+        return merge(fan_out(query, jobs, self.query_concurrency))
+
+    def filter(self, time_start: str, time_stop: str = "now()", aggregate: str = None, limit: int = None,
+               offset: int = 0, incremental: bool = None, aggregation=None):
+        """Query Influx based on the tags from the object (the object must be initialized with the tags).
+        The windows are aggregated with the mean unless an aggregation is given: the name of an aggregation
+        of the model, a function name ("max", "p95") or a dict of columns like the model aggregations.
+        The limit and offset are applied by InfluxDB on the merged result.
+        Incremental (incremental_queries by default) rolling window queries reuse the previous results and
+        fetch only the data since the last complete aggregate window. The first window of the range is
+        aggregated over the data of the previous query.
+        The query is routed to the coarsest rollup buckets which hold the range at the aggregate.
+        Without a limit and offset the query is split into parallel sub-queries by query_chunk and
+        query_tag_chunk."""
         tags = self._generate_tags(self.data)
         if not aggregate:
             aggregate = self.default_aggregation
-        tables = client.query(time_start=time_start, time_stop=time_stop, tags=tags, aggregate=aggregate,
-                              pivot_tables=self.pivot_tables)
+        aggregation = self._get_aggregation(aggregation)
+        if incremental is None:
+            incremental = self.incremental_queries
+        incremental = incremental and limit is None and not offset
+        if incremental and tail_cache.supports(time_start, time_stop, aggregate):
+            records = self._incremental_records(tags, time_start, aggregate, aggregation)
+            self.results = self._clean_records(records, aggregation)
+            return self.results
+        if limit is None and not offset:
+            jobs = self._query_jobs(tags, time_start, time_stop, aggregate, aggregation)
+        else:
+            jobs = [(self._route(time_start, time_stop, aggregate, aggregation, single=True)[0], tags)]
+        if len(jobs) > 1:
+            records = self._fan_out_records(jobs, aggregate, aggregation)
+            self.results = self._clean_records(records, aggregation)
+            return self.results
+        part, tags = jobs[0]
+        client = self._get_client(part, aggregation)
+        tables = client.query(time_start=part.time_start, time_stop=part.time_stop, tags=tags,
+                              aggregate=aggregate, pivot_tables=self.pivot_tables, limit=limit, offset=offset)
         if not tables:
             return []
-        self._flatten_results(tables)
-        self.clean_results()
+        records = chain.from_iterable(table.records for table in tables)
+        self.results = self._clean_records(records, aggregation)
         return self.results
 
+    def count(self, time_start: str, time_stop: str = "now()", aggregate: str = None,
+              aggregation=None) -> int:
+        """Number of results filter would return - counted by InfluxDB"""
+        tags = self._generate_tags(self.data)
+        if not aggregate:
+            aggregate = self.default_aggregation
+        aggregation = self._get_aggregation(aggregation)
+        part = self._route(time_start, time_stop, aggregate, aggregation, single=True)[0]
+        return self._get_client(part, aggregation).count(time_start=part.time_start, time_stop=part.time_stop,
+                                                         tags=tags, aggregate=aggregate,
+                                                         pivot_tables=self.pivot_tables)
+
+    def latest_time(self, time_start: str, time_stop: str = "now()"):
+        """Time of the most recent point of the range - read from the raw bucket, where the new data is"""
+        tags = self._generate_tags(self.data)
+        client = self._get_client()
+        client.use_cache = False
+        return client.latest_time(time_start=time_start, time_stop=time_stop, tags=tags)
+
+    async def afilter(self, time_start: str, time_stop: str = "now()", aggregate: str = None,
+                      limit: int = None, offset: int = 0, aggregation=None):
+        """Same as filter, but the query doesn't block the event loop (no incremental queries)"""
+        tags = self._generate_tags(self.data)
+        if not aggregate:
+            aggregate = self.default_aggregation
+        aggregation = self._get_aggregation(aggregation)
+        part = self._route(time_start, time_stop, aggregate, aggregation, single=True)[0]
+        client = self._get_async_client(part, aggregation)
+        tables = await client.query(time_start=part.time_start, time_stop=part.time_stop, tags=tags,
+                                    aggregate=aggregate, pivot_tables=self.pivot_tables, limit=limit,
+                                    offset=offset)
+        if not tables:
+            return []
+        records = chain.from_iterable(table.records for table in tables)
+        self.results = self._clean_records(records, aggregation)
+        return self.results
+
+    async def acount(self, time_start: str, time_stop: str = "now()", aggregate: str = None,
+                     aggregation=None) -> int:
+        """Same as count, but the query doesn't block the event loop"""
+        tags = self._generate_tags(self.data)
+        if not aggregate:
+            aggregate = self.default_aggregation
+        aggregation = self._get_aggregation(aggregation)
+        part = self._route(time_start, time_stop, aggregate, aggregation, single=True)[0]
+        client = self._get_async_client(part, aggregation)
+        return await client.count(time_start=part.time_start, time_stop=part.time_stop, tags=tags,
+                                  aggregate=aggregate, pivot_tables=self.pivot_tables)
+
+    def stream(self, time_start: str, time_stop: str = "now()", aggregate: str = None, aggregation=None):
+        """Same as filter, but returns a generator of cleaned results which are parsed while the InfluxDB
+        response is read. The query is sent (and validated) before returning."""
+        tags = self._generate_tags(self.data)
+        if not aggregate:
+            aggregate = self.default_aggregation
+        aggregation = self._get_aggregation(aggregation)
+        jobs = self._query_jobs(tags, time_start, time_stop, aggregate, aggregation)
+        if len(jobs) > 1:
+            return self._iter_clean(self._fan_out_records(jobs, aggregate, aggregation), aggregation)
+        part, tags = jobs[0]
+        records = self._get_client(part, aggregation).query_stream(
+            time_start=part.time_start, time_stop=part.time_stop, tags=tags, aggregate=aggregate,
+            pivot_tables=self.pivot_tables)
+        return self._iter_clean(records, aggregation)
+
+    def get_encoder(self) -> LineProtocolEncoder:
+        """Line protocol encoder specialised for the declared tags and field types of the model"""
+        schema = self.schema
+        return get_encoder(self.measurement, schema.tags, schema.fields)
+
     def save(self):
         """Creates a new timeseries entry in Influx from this object"""
         self._validate()
-        client = InfluxClient(self.measurement, bucket=self.bucket)
-        result = client.write(data=self.validated_data)
+        if self._pre_aggregation is not None:
+            return rollup_buffers[type(self)].add(self.validated_data)
+        client = InfluxClient(self.measurement, bucket=self.bucket, using=self.using)
+        result = client.write(data=self.validated_data, encoder=self.get_encoder())
         return result
+
+    @classmethod
+    def bulk_save(cls, data, batch_size: int = None, sync: bool = True, concurrency: int = 1) -> list:
+        """Validate, encode and write the items of any iterable (or generator) in chunks of batch_size items.
+        The items are the same as the data of save - with an optional timestamp (datetime or integer in ms).
+        At most concurrency chunks are in memory (and written in parallel) at a time. The chunks are written
+        synchronously, so a backfill goes at the pace of InfluxDB and stops at the first failed chunk with
+        its exception - sync=None hands them to the INFLUXDB_WRITE_MODE instead.
+        Returns the stats of each chunk: {"chunk": 0, "points": 5000, "seconds": 0.01}"""
+        batch_size = batch_size or cls.bulk_batch_size
+        validate_row = cls._schema.validate_row
+        encoder = cls().get_encoder()
+        items = iter(data)
+        chunks = iter(lambda: list(islice(items, batch_size)), [])
+
+        def write(job):
+            index, chunk = job
+            start = time.perf_counter()
+            client = InfluxClient(cls.measurement, bucket=cls.bucket, using=cls.using)
+            client.write(data=list(map(validate_row, chunk)), sync=sync, encoder=encoder)
+            return {"chunk": index, "points": len(chunk), "seconds": time.perf_counter() - start}
+        if concurrency > 1:
+            return list(fan_out(write, enumerate(chunks), concurrency))
+        return list(map(write, enumerate(chunks)))
+
+    async def asave(self):
+        """Same as save, but the point is written right away without blocking the event loop (pre-aggregated
+        points are buffered like in save)"""
+        self._validate()
+        if self._pre_aggregation is not None:
+            return rollup_buffers[type(self)].add(self.validated_data)
+        client = AsyncClient(self.measurement, bucket=self.bucket, using=self.using)
+        await client.write(data=self.validated_data, encoder=self.get_encoder())
@@ -0,0 +1,220 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from . import exceptions
+from .durations import parse_duration
+from .influxdb import Client
+from .line_protocol import get_encoder
+
+logger = logging.getLogger(__name__)
+
+
+def _mean_update(state: list, value) -> list:
+    state[0] += value
+    state[1] += 1
+    return state
+
+
+# Function name: (state of the first value, state updated with a value, field value of the state)
+AGGREGATORS = {"sum": (lambda v: v, lambda s, v: s + v, None),
+               "count": (lambda v: 1, lambda s, v: s + 1, None),
+               "min": (lambda v: v, lambda s, v: v if v < s else s, None),
+               "max": (lambda v: v, lambda s, v: v if v > s else s, None),
+               "first": (lambda v: v, lambda s, v: s, None),
+               "last": (lambda v: v, lambda s, v: v, None),
+               "mean": (lambda v: [v, 1], _mean_update, lambda s: s[0] / s[1])}
+# Type of the written field - None keeps the type of the aggregated field
+RESULT_TYPES = {"count": int, "mean": float}
+
+# The compiled pre_aggregation of a model: the window length in ms, the (column, field, function) triples,
+# the window end which stamps a point (0 or the interval), the delay of the flush and the grace period in ms
+PreAggregation = namedtuple("PreAggregation", ["interval", "columns", "shift", "delay", "grace"])
+
+
+def compile_pre_aggregation(declaration, schema):
+    """Compile the pre_aggregation of a model:
+    {"interval": "10s", "fields": {"price": "mean", "price_max": ("price", "max")}, "delay": "2s",
+     "grace": "1m"}
+    A column is a function of the field of the same name or a (field, function) pair. The points are stamped
+    with the window stop (like aggregateWindow) unless time_src is "_start". The aggregates of a written
+    window are kept for the grace period (the interval by default). None when not declared."""
+    if not declaration:
+        return None
+    interval = parse_duration(declaration.get("interval"))
+    if not interval or not declaration.get("fields") or not isinstance(declaration["fields"], dict):
+        raise exceptions.InvalidModelSchema(
+            'The pre_aggregation must be declared as a dict: {"interval": "10s", "fields": {"price": "max"}}')
+    fields = dict(schema.fields)
+    columns = []
+    for column, spec in declaration["fields"].items():
+        field, function = (column, spec) if isinstance(spec, str) else tuple(spec)
+        if field not in fields:
+            raise exceptions.InvalidModelSchema(f"The pre-aggregated field {field} isn't a model field")
+        if function not in AGGREGATORS:
+            raise exceptions.InvalidModelSchema(
+                f"Unsupported pre-aggregation {function} - use one of {', '.join(AGGREGATORS)}")
+        columns.append((column, field, function))
+    delay = parse_duration(declaration.get("delay")) or timedelta()
+    grace = parse_duration(declaration.get("grace")) or interval
+    interval_ms = interval // timedelta(milliseconds=1)
+    shift = 0 if declaration.get("time_src") == "_start" else interval_ms
+    millisecond = timedelta(milliseconds=1)
+    return PreAggregation(interval_ms, tuple(columns), shift, delay // millisecond, grace // millisecond)
+
+
+class RollupBuffer:
+    """In-memory aggregates of the points of a model - 1 point per series (tag set) and window.
+
+    The validated rows are folded into the aggregates of their window (by their timestamp or the current
+    time) and the windows are written once they are over (plus the delay). The aggregates of a written window
+    are kept for the grace period: a late point is merged into them and the series is written again with
+    the merged aggregates, so its point in InfluxDB is replaced by a complete one. The points which arrive
+    after the grace period are dropped and counted in dropped_points."""
+
+    def __init__(self, model):
+        self.model = model
+        self.conf = model._pre_aggregation
+        schema = model._schema
+        types = dict(schema.fields)
+        self.fields = tuple((column, RESULT_TYPES.get(function) or types[field])
+                            for column, field, function in self.conf.columns)
+        self.encoder = get_encoder(model.measurement, schema.tags, self.fields)
+        self._plan = tuple((field, *AGGREGATORS[function]) for _, field, function in self.conf.columns)
+        # Window start in ms: {series key: [tags, aggregate states, changed since written]}
+        self._windows = {}
+        # The windows up to this start are expired - None before the first flush
+        self._expired = None
+        self.dropped_points = 0
+        self._lock = threading.Lock()
+
+    def add(self, rows) -> None:
+        interval = self.conf.interval
+        plan = self._plan
+        convert_time = self.encoder.convert_time
+        now = None
+        with self._lock:
+            windows = self._windows
+            expired = self._expired
+            for row in rows:
+                moment = row.get("time")
+                if moment is None:
+                    if now is None:
+                        now = time.time_ns() // 10 ** 6
+                    moment = now
+                else:
+                    moment = convert_time(moment)
+                window = moment - moment % interval
+                if expired is not None and window <= expired:
+                    if not self.dropped_points:
+                        logger.warning("Dropped a late point of %s - the window expired", self.model.__name__)
+                    self.dropped_points += 1
+                    continue
+                series = windows.get(window)
+                if series is None:
+                    series = windows[window] = {}
+                tags = row["tags"]
+                fields = row["fields"]
+                key = tuple(tags.items())
+                entry = series.get(key)
+                if entry is None:
+                    series[key] = [tags, [init(fields[field]) for field, init, _, _ in plan], True]
+                    continue
+                states = entry[1]
+                for i, (field, _, update, _) in enumerate(plan):
+                    states[i] = update(states[i], fields[field])
+                entry[2] = True
+
+    def take(self, everything: bool = False) -> list:
+        """The points of the series which changed in the finished windows (all the windows with everything).
+        The windows older than the grace period are removed from the buffer."""
+        cutoff = time.time_ns() // 10 ** 6 - self.conf.interval - self.conf.delay
+        expired = cutoff - self.conf.grace
+        columns = tuple(column for column, _ in self.fields)
+        results = tuple(result for _, _, _, result in self._plan)
+        points = []
+        with self._lock:
+            for window in sorted(self._windows):
+                if not everything and window > cutoff:
+                    break
+                point_time = window + self.conf.shift
+                for entry in self._windows[window].values():
+                    tags, states, changed = entry
+                    if not changed:
+                        continue
+                    entry[2] = False
+                    values = (state if result is None else result(state)
+                              for state, result in zip(states, results))
+                    points.append({"tags": tags, "fields": dict(zip(columns, values)), "time": point_time})
+                if window <= expired:
+                    del self._windows[window]
+            if self._expired is None or expired > self._expired:
+                self._expired = expired
+        return points
+
+    def flush(self, everything: bool = False) -> int:
+        """Write the finished windows - returns the number of points"""
+        points = self.take(everything)
+        if points:
+            model = self.model
+            client = Client(model.measurement, bucket=model.bucket, using=model.using)
+            client.write(points, encoder=self.encoder)
+        return len(points)
+
+
+class RollupHandler:
+    """Process wide registry of the rollup buffers - 1 buffer per model, flushed by 1 background thread"""
+
+    def __init__(self, tick: float = 0.5):
+        self.tick = tick
+        self._buffers = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = os.getpid()
+
+    def __getitem__(self, model) -> RollupBuffer:
+        if self._pid != os.getpid():
+            # The aggregates of the parent are written by the parent, the flush thread doesn't survive a fork
+            self._buffers = {}
+            self._thread = None
+            self._pid = os.getpid()
+        try:
+            return self._buffers[model]
+        except KeyError:
+            pass
+        with self._lock:
+            if model not in self._buffers:
+                self._buffers[model] = RollupBuffer(model)
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._run, name="influxdb-rollups", daemon=True)
+                self._thread.start()
+            return self._buffers[model]
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.tick):
+            self.flush_all()
+
+    def flush_all(self, everything: bool = False) -> None:
+        for buffer in list(self._buffers.values()):
+            try:
+                buffer.flush(everything)
+            except Exception as e:
+                logger.error("Failed to write the pre-aggregated points of %s: %s", buffer.model.__name__, e)
+
+    def close_all(self) -> None:
+        """Stop the flush thread and write all the aggregates, the unfinished windows included"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._pid == os.getpid():
+            self.flush_all(everything=True)
+
+
+rollup_buffers = RollupHandler()
+atexit.register(rollup_buffers.close_all)
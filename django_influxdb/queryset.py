@@ -0,0 +1,159 @@
+class InfluxQuerySet:
+    """Lazy and chainable query on an InfluxModel - concept was taken from Django QuerySets.
+    The query is sent to InfluxDB only when the results are needed. Slicing is pushed down to
+    limit(n:, offset:) and count() to a count() in InfluxDB, so a paginator fetches only 1 page."""
+
+    # Results have a stable order - required by the Django paginator
+    ordered = True
+
+    def __init__(self, model):
+        self.model = model
+        self.tags = {}
+        self.time_start = "30m"
+        self.time_stop = "now()"
+        self.window = None
+        self.aggregation = None
+        self.ordering = []
+        self.limit = None
+        self.offset = 0
+        self._result_cache = None
+        self._count = None
+
+    def _clone(self):
+        clone = self.__class__(self.model)
+        clone.tags = dict(self.tags)
+        clone.time_start = self.time_start
+        clone.time_stop = self.time_stop
+        clone.window = self.window
+        clone.aggregation = self.aggregation
+        clone.ordering = list(self.ordering)
+        clone.limit = self.limit
+        clone.offset = self.offset
+        return clone
+
+    def filter(self, **tags):
+        """Filter on tag values - a list of values matches any of them"""
+        clone = self._clone()
+        clone.tags.update(tags)
+        return clone
+
+    def range(self, time_start: str, time_stop: str = "now()"):
+        clone = self._clone()
+        clone.time_start = time_start
+        clone.time_stop = time_stop or "now()"
+        return clone
+
+    def aggregate(self, window: str, aggregation=None):
+        """Aggregate the results in windows of the given duration (the model default_aggregation if empty).
+        The aggregation is the name of a model aggregation or a function name - the mean by default."""
+        clone = self._clone()
+        clone.window = window
+        clone.aggregation = aggregation
+        return clone
+
+    def order_by(self, *columns):
+        """Sort by the columns - prefix all of them with "-" for descending order"""
+        if len({c.startswith("-") for c in columns}) > 1:
+            raise ValueError("InfluxDB can sort either all columns ascending or all descending")
+        clone = self._clone()
+        # The results name the _time column timestamp
+        clone.ordering = [c.replace("timestamp", "_time") if c.lstrip("-") == "timestamp" else c
+                          for c in columns]
+        return clone
+
+    def _get_model(self):
+        kwargs = {"data": self.tags}
+        if self.ordering:
+            kwargs["sorting_tags"] = self.ordering
+        return self.model(**kwargs)
+
+    def _fetch(self) -> list:
+        if self._result_cache is None and self.limit == 0:
+            self._result_cache = []
+        if self._result_cache is None:
+            self._result_cache = self._get_model().filter(self.time_start, self.time_stop, self.window,
+                                                          limit=self.limit, offset=self.offset,
+                                                          aggregation=self.aggregation)
+        return self._result_cache
+
+    def count(self) -> int:
+        """Number of results - counted by InfluxDB unless the results are already fetched"""
+        if self._result_cache is not None:
+            return len(self._result_cache)
+        if self._count is None:
+            count = self._get_model().count(self.time_start, self.time_stop, self.window,
+                                            aggregation=self.aggregation)
+            self._count = self._slice_count(count)
+        return self._count
+
+    def _slice_count(self, count: int) -> int:
+        """Apply the slice of this queryset on the total"""
+        count = max(count - self.offset, 0)
+        if self.limit is not None:
+            count = min(count, self.limit)
+        return count
+
+    async def afetch(self) -> list:
+        """Fetch the results without blocking the event loop"""
+        if self._result_cache is None and self.limit == 0:
+            self._result_cache = []
+        if self._result_cache is None:
+            self._result_cache = await self._get_model().afilter(self.time_start, self.time_stop, self.window,
+                                                                 limit=self.limit, offset=self.offset,
+                                                                 aggregation=self.aggregation)
+        return self._result_cache
+
+    async def acount(self) -> int:
+        """Same as count, but the query doesn't block the event loop"""
+        if self._result_cache is not None:
+            return len(self._result_cache)
+        if self._count is None:
+            count = await self._get_model().acount(self.time_start, self.time_stop, self.window,
+                                                   aggregation=self.aggregation)
+            self._count = self._slice_count(count)
+        return self._count
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.step is not None:
+                raise ValueError("Slicing with a step is not supported")
+            start = key.start or 0
+            if start < 0 or (key.stop is not None and key.stop < 0):
+                raise ValueError("Negative indexing is not supported")
+            clone = self._clone()
+            clone.offset = self.offset + start
+            stop = key.stop
+            if self.limit is not None:
+                stop = self.limit if stop is None else min(stop, self.limit)
+            if stop is not None:
+                clone.limit = max(stop - start, 0)
+            if self._result_cache is not None:
+                clone._result_cache = self._result_cache[key]
+            return clone
+        if not isinstance(key, int):
+            raise TypeError(f"Indices must be integers or slices, not {type(key).__name__}")
+        if key < 0:
+            raise ValueError("Negative indexing is not supported")
+        if self._result_cache is not None:
+            return self._result_cache[key]
+        return self[key:key + 1]._fetch()[0]
+
+    def __iter__(self):
+        return iter(self._fetch())
+
+    def __len__(self):
+        return len(self._fetch())
+
+    def __bool__(self):
+        return bool(self._fetch())
+
+    def __repr__(self):
+        time_range = f"{self.time_start}:{self.time_stop}"
+        return f"<InfluxQuerySet {self.model.__name__} tags={self.tags} range={time_range}>"
+
+
+class InfluxManager:
+    """Entry point for querysets: Model.objects.filter(symbol="BTC").range("1h")[:100]"""
+
+    def __get__(self, instance, owner):
+        return InfluxQuerySet(owner)
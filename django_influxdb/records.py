@@ -0,0 +1,52 @@
+import threading
+from collections.abc import Mapping
+
+_record_types = {}
+_lock = threading.Lock()
+
+
+class Record(Mapping):
+    """Compact read only result row. The keys are stored once on the record type (shared by all the rows with
+    the same columns) and every row holds only a tuple of values. It behaves like a read only dict."""
+    __slots__ = ("_values",)
+    _fields = ()
+    _index = {}
+
+    def __init__(self, values):
+        self._values = tuple(values)
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]]
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __repr__(self):
+        return f"Record({self._asdict()})"
+
+    def __reduce__(self):
+        return make_record, (self._fields, self._values)
+
+    def _asdict(self) -> dict:
+        return dict(zip(self._fields, self._values))
+
+
+def record_type(fields: tuple) -> type:
+    """Get the (cached) Record subclass for the given keys"""
+    try:
+        return _record_types[fields]
+    except KeyError:
+        pass
+    with _lock:
+        if fields not in _record_types:
+            index = {name: i for i, name in enumerate(fields)}
+            attrs = {"__slots__": (), "_fields": fields, "_index": index}
+            _record_types[fields] = type("Record", (Record,), attrs)
+        return _record_types[fields]
+
+
+def make_record(fields: tuple, values) -> Record:
+    return record_type(tuple(fields))(values)
@@ -0,0 +1,236 @@
+import logging
+import os
+import socket
+import struct
+import tempfile
+import threading
+from influxdb_client import WritePrecision
+from django.conf import settings
+
+from . import exceptions
+from .connections import DEFAULT_INFLUX_ALIAS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RELAY_SETTINGS = {"ADDRESS": os.path.join(tempfile.gettempdir(), "django_influxdb_relay.sock"),
+                          "MAX_DATAGRAM": 60000, "SEND_TIMEOUT": 0, "RECEIVE_BUFFER": 4 * 2 ** 20,
+                          "BATCH_SIZE": 5000, "FLUSH_INTERVAL": 1000, "BUFFER_SIZE": 200000, "BUCKET": None,
+                          "ORG": None}
+# A frame starts with a NUL byte (line protocol can't) followed by the lengths of the bucket, org and
+# precision and the number of points - then the bucket, org, precision and the line protocol data
+FRAME_MAGIC = b"\x00"
+FRAME_HEADER = struct.Struct("<cHHBI")
+
+
+def get_relay_settings() -> dict:
+    return {**DEFAULT_RELAY_SETTINGS, **getattr(settings, "INFLUXDB_RELAY", {})}
+
+
+def parse_address(address: str) -> tuple:
+    """(socket family, socket address) of a relay address - udp://host:port or the path of a Unix socket"""
+    if address.startswith("udp://"):
+        host, _, port = address[len("udp://"):].rpartition(":")
+        host = host.strip("[]")
+        family = socket.AF_INET6 if ":" in host else socket.AF_INET
+        return family, (host, int(port))
+    return socket.AF_UNIX, address
+
+
+def encode_frame(bucket: str, org: str, precision: str, data: bytes, points: int) -> bytes:
+    bucket, org, precision = bucket.encode(), org.encode(), str(precision).encode()
+    header = FRAME_HEADER.pack(FRAME_MAGIC, len(bucket), len(org), len(precision), points)
+    return b"".join((header, bucket, org, precision, data))
+
+
+def decode_datagram(datagram: bytes, bucket: str = None, org: str = None) -> tuple:
+    """((bucket, org, precision), data, points) of a frame or of plain line protocol - the plain line protocol
+    is written to the given bucket and org with ns precision. Raises ValueError on a malformed datagram."""
+    if not datagram.startswith(FRAME_MAGIC):
+        if not bucket:
+            raise ValueError("Plain line protocol datagram without a relay BUCKET")
+        data = datagram.strip(b"\n")
+        return (bucket, org, WritePrecision.NS), data, len([line for line in data.split(b"\n") if line])
+    if len(datagram) < FRAME_HEADER.size:
+        raise ValueError("Truncated relay frame")
+    _, bucket_length, org_length, precision_length, points = FRAME_HEADER.unpack_from(datagram)
+    start = FRAME_HEADER.size
+    conf = []
+    for length in (bucket_length, org_length, precision_length):
+        conf.append(datagram[start:start + length].decode())
+        start += length
+    if start > len(datagram):
+        raise ValueError("Truncated relay frame")
+    return tuple(conf), datagram[start:], points
+
+
+class RelaySender:
+    """Sends the encoded points of a process to the relay (the run_influx_relay command) in datagrams of at
+    most MAX_DATAGRAM bytes. A send waits at most SEND_TIMEOUT seconds (0 - never): the points are handed to
+    the batch writer when the relay isn't running or its queue stays full. Only a Unix socket reports those -
+    UDP is lossy, the datagrams sent while the relay is down (or overloaded) are lost without a fallback."""
+
+    def __init__(self, using: str = DEFAULT_INFLUX_ALIAS, address: str = None, max_datagram: int = None,
+                 send_timeout: float = None):
+        conf = get_relay_settings()
+        self.using = using
+        self.address = address or conf["ADDRESS"]
+        self.max_datagram = max_datagram or conf["MAX_DATAGRAM"]
+        family, self._address = parse_address(self.address)
+        self._socket = socket.socket(family, socket.SOCK_DGRAM)
+        # A full relay queue must not block the request thread
+        self._socket.settimeout(conf["SEND_TIMEOUT"] if send_timeout is None else send_timeout)
+        self._lock = threading.Lock()
+        self._unreachable = False
+
+    def write(self, bucket: str, org: str, data: bytes, points: int = 1,
+              precision: str = WritePrecision.MS) -> None:
+        frame = encode_frame(bucket, org, precision, data, points)
+        if len(frame) <= self.max_datagram:
+            return self._send(frame, (bucket, org, precision), data, points)
+        # Split on the line boundaries
+        overhead = len(frame) - len(data)
+        chunk, size = [], 0
+        for line in data.split(b"\n"):
+            if chunk and size + len(line) + overhead > self.max_datagram:
+                self._send_lines(chunk, bucket, org, precision)
+                chunk, size = [], 0
+            chunk.append(line)
+            size += len(line) + 1
+        if chunk:
+            self._send_lines(chunk, bucket, org, precision)
+
+    def _send_lines(self, lines: list, bucket: str, org: str, precision: str) -> None:
+        data = b"\n".join(lines)
+        points = len(lines)
+        frame = encode_frame(bucket, org, precision, data, points)
+        if len(frame) > self.max_datagram:
+            # A single line bigger than a datagram
+            return self._fallback((bucket, org, precision), data, points)
+        self._send(frame, (bucket, org, precision), data, points)
+
+    def _send(self, frame: bytes, conf: tuple, data: bytes, points: int) -> None:
+        try:
+            with self._lock:
+                self._socket.sendto(frame, self._address)
+        except (BlockingIOError, socket.timeout):
+            # The relay is busy - this batch is written directly
+            return self._fallback(conf, data, points)
+        except OSError as e:
+            if not self._unreachable:
+                logger.warning("The InfluxDB relay %s isn't reachable, writing directly: %s", self.address, e)
+            self._unreachable = True
+            return self._fallback(conf, data, points)
+        self._unreachable = False
+
+    def _fallback(self, conf: tuple, data: bytes, points: int) -> None:
+        from .writer import writers
+        bucket, org, precision = conf
+        writers[self.using].write(bucket, org, data, points=points, precision=precision)
+
+    def close(self, timeout: float = None) -> None:
+        self._socket.close()
+
+
+class RelayHandler:
+    """Process wide registry of relay senders - 1 sender per connection alias"""
+
+    def __init__(self):
+        self._senders = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def __getitem__(self, alias: str) -> RelaySender:
+        if self._pid != os.getpid():
+            # A forked worker gets its own socket
+            self._senders = {}
+            self._pid = os.getpid()
+        try:
+            return self._senders[alias]
+        except KeyError:
+            pass
+        with self._lock:
+            if alias not in self._senders:
+                self._senders[alias] = RelaySender(using=alias)
+            return self._senders[alias]
+
+    def close_all(self, timeout: float = None) -> None:
+        with self._lock:
+            senders = list(self._senders.values())
+            self._senders = {}
+        for sender in senders:
+            sender.close(timeout)
+
+
+relays = RelayHandler()
+
+
+class RelayServer:
+    """Receives the datagrams of the relay senders (and plain line protocol) and merges them into a writer -
+    a BatchWriter or a DiskSpool - which sends large batches upstream"""
+
+    def __init__(self, writer, address: str = None, receive_buffer: int = None, bucket: str = None,
+                 org: str = None):
+        conf = get_relay_settings()
+        self.writer = writer
+        self.address = address or conf["ADDRESS"]
+        self.bucket = bucket or conf["BUCKET"]
+        self.org = org or conf["ORG"]
+        self.max_datagram = max(conf["MAX_DATAGRAM"], 65536)
+        family, self._address = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(self._address):
+            # A socket left by a relay which didn't stop cleanly
+            os.remove(self._address)
+        self._socket = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                    receive_buffer or conf["RECEIVE_BUFFER"])
+        except OSError:
+            pass
+        self._socket.bind(self._address)
+        self._socket.settimeout(0.5)
+        self._stopped = threading.Event()
+        self.stats = {"datagrams": 0, "points": 0, "errors": 0, "dropped": 0}
+        self._overloaded = False
+
+    def handle(self, datagram: bytes) -> None:
+        try:
+            conf, data, points = decode_datagram(datagram, self.bucket, self.org)
+        except (ValueError, UnicodeDecodeError) as e:
+            self.stats["errors"] += 1
+            logger.warning("Dropped a malformed relay datagram: %s", e)
+            return
+        self.stats["datagrams"] += 1
+        self.stats["points"] += points
+        try:
+            self.writer.write(*conf[:2], data, points=points, precision=conf[2])
+        except exceptions.WriteBufferFull as e:
+            # InfluxDB is down or too slow - the relay keeps running and recovers with it
+            self.stats["dropped"] += points
+            if not self._overloaded:
+                logger.error("Dropping relayed points, the upstream buffer is full: %s", e)
+            self._overloaded = True
+            return
+        self._overloaded = False
+
+    def serve_forever(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                datagram = self._socket.recv(self.max_datagram)
+            except socket.timeout:
+                continue
+            except OSError:
+                if self._stopped.is_set():
+                    break
+                raise
+            self.handle(datagram)
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def close(self, timeout: float = None) -> None:
+        """Stop receiving and write the buffered points"""
+        self.stop()
+        self._socket.close()
+        if self._socket.family == socket.AF_UNIX and os.path.exists(self._address):
+            os.remove(self._address)
+        self.writer.close(timeout)
@@ -0,0 +1,202 @@
+import csv
+import io
+from collections.abc import Mapping
+from datetime import datetime
+from json.encoder import encode_basestring
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from .records import Record
+
+
+class ValueEncoder:
+    """JSON encoding of the result values dispatched on the exact type. The timestamps repeat in every series
+    of a result, so their encoding is cached for the response. Other types fall back to the DRF
+    JSONEncoder."""
+
+    def __init__(self, ensure_ascii: bool = not api_settings.UNICODE_JSON):
+        self._datetimes = {}
+        encoder = JSONEncoder(ensure_ascii=ensure_ascii, allow_nan=not api_settings.STRICT_JSON,
+                              separators=(",", ":"))
+        self.fallback = encoder.encode
+        self.encoders = {str: self.fallback if ensure_ascii else encode_basestring, float: self._float,
+                         int: int.__repr__, bool: self._bool, type(None): self._none,
+                         datetime: self._datetime}
+
+    def __call__(self, value) -> str:
+        try:
+            return self.encoders[type(value)](value)
+        except KeyError:
+            return self.fallback(value)
+
+    def _float(self, value: float) -> str:
+        if value != value or value in (float("inf"), float("-inf")):
+            return self.fallback(value)
+        return float.__repr__(value)
+
+    @classmethod
+    def _bool(cls, value: bool) -> str:
+        return "true" if value else "false"
+
+    @classmethod
+    def _none(cls, value) -> str:
+        return "null"
+
+    def _datetime(self, value: datetime) -> str:
+        try:
+            return self._datetimes[value]
+        except KeyError:
+            encoded = self._datetimes[value] = self.fallback(value)
+            return encoded
+
+
+def _rows(data):
+    """The rows of a list or of a page of the PageNumberPagination - None for other data"""
+    if isinstance(data, Mapping) and "results" in data:
+        data = data["results"]
+    if isinstance(data, list) and all(isinstance(row, Mapping) for row in data):
+        return data
+    return None
+
+
+def _row_items(row):
+    """Keys and values of a row - the values of a Record are read without building a dict"""
+    if isinstance(row, Record):
+        return row._fields, row._values
+    return tuple(row.keys()), tuple(row.values())
+
+
+def _columns(rows) -> list:
+    """Union of the row keys in the order they are seen - Records of the same type are checked once"""
+    columns = {}
+    seen = set()
+    for row in rows:
+        keys = row._fields if isinstance(row, Record) else tuple(row)
+        if keys in seen:
+            continue
+        seen.add(keys)
+        columns.update(dict.fromkeys(keys))
+    return list(columns)
+
+
+def _finish(content: str) -> bytes:
+    # Same as the DRF JSONRenderer - the output is a strict javascript subset
+    return content.replace("\u2028", "\\u2028").replace("\u2029", "\\u2029").encode()
+
+
+def encode_rows(rows, encode: ValueEncoder):
+    """JSON objects of the rows - every row type is encoded with a template of its keys, so the key names are
+    encoded once and only the values per row"""
+    templates = {}
+    encoders = encode.encoders
+    fallback = encode.fallback
+    for row in rows:
+        keys, values = _row_items(row)
+        template = templates.get(keys)
+        if template is None:
+            members = ",".join(encode(str(key)).replace("%", "%%") + ":%s" for key in keys)
+            template = templates[keys] = "{" + members + "}"
+        # ValueEncoder.__call__ inlined
+        yield template % tuple([encoders.get(type(value), fallback)(value) for value in values])
+
+
+class FastJSONRenderer(JSONRenderer):
+    """Same output as the JSONRenderer for lists of result rows (and their pages) - the rows are encoded by
+    encode_rows. Other data is rendered by the JSONRenderer."""
+    format = "fastjson"
+
+    def encode_results(self, rows, encode: ValueEncoder) -> str:
+        return "[" + ",".join(encode_rows(rows, encode)) + "]"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = _rows(data)
+        if rows is None or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        encode = ValueEncoder(self.ensure_ascii)
+        content = self.encode_results(rows, encode)
+        if rows is not data:
+            # The page metadata is encoded by the JSONEncoder and the results are spliced in
+            page = {key: value for key, value in data.items() if key != "results"}
+            content = encode(dict(page, results=None))[:-len("null}")] + content + "}"
+        return _finish(content)
+
+
+class ColumnarJSONRenderer(FastJSONRenderer):
+    """Results as a JSON object of columns - {"timestamp": [...], "price": [...]}. The missing values of a
+    row are null. The results of a page are replaced by their columns."""
+    format = "columns"
+
+    def encode_results(self, rows, encode: ValueEncoder) -> str:
+        columns = _columns(rows)
+        index = {column: i for i, column in enumerate(columns)}
+        values = [[] for _ in columns]
+        positions = {}
+        for row in rows:
+            keys, row_values = _row_items(row)
+            missing = positions.get(keys)
+            if missing is None:
+                present = {index[key] for key in keys}
+                missing = positions[keys] = [values[i] for i in range(len(columns)) if i not in present]
+            for key, value in zip(keys, row_values):
+                values[index[key]].append(encode(value))
+            for column_values in missing:
+                column_values.append("null")
+        members = (f"{encode(str(column))}:[{','.join(column_values)}]"
+                   for column, column_values in zip(columns, values))
+        return "{" + ",".join(members) + "}"
+
+
+class NDJSONRenderer(JSONRenderer):
+    """Newline delimited JSON - 1 row per line. Only the results of a page are rendered, other data is
+    rendered as 1 line of JSON."""
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = _rows(data)
+        if rows is None:
+            return super().render(data, accepted_media_type, renderer_context) + b"\n"
+        return _finish("".join(row + "\n" for row in encode_rows(rows, ValueEncoder(self.ensure_ascii))))
+
+
+class CSVRenderer(BaseRenderer):
+    """Results as CSV with a header of all the columns - the missing values are empty. Only the results of a
+    page are rendered, other data is rendered as JSON."""
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = _rows(data)
+        if rows is None:
+            return JSONRenderer().render(data, accepted_media_type, renderer_context)
+        columns = _columns(rows)
+        index = {column: i for i, column in enumerate(columns)}
+        datetimes = {}
+        format_datetime = JSONEncoder().default
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(columns)
+        positions = {}
+        for row in rows:
+            keys, values = _row_items(row)
+            row_positions = positions.get(keys)
+            if row_positions is None:
+                row_positions = positions[keys] = tuple(index[key] for key in keys)
+            line = [""] * len(columns)
+            for position, value in zip(row_positions, values):
+                if type(value) is datetime:
+                    try:
+                        value = datetimes[value]
+                    except KeyError:
+                        value = datetimes[value] = format_datetime(value)
+                elif value is None:
+                    value = ""
+                line[position] = value
+            writer.writerow(line)
+        return output.getvalue().encode(self.charset)
+
+
+# The renderers selectable with the format query param of the ListViewSet
+RESULT_RENDERERS = [FastJSONRenderer, ColumnarJSONRenderer, NDJSONRenderer, CSVRenderer]
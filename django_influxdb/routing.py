@@ -0,0 +1,92 @@
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from . import exceptions
+from .durations import parse_duration, parse_time, window_start
+
+# A downsampled bucket of a model: the resolution of its points, how long they are kept and how long after the
+# end of a window its point is written
+Rollup = namedtuple("Rollup", ["bucket", "resolution", "retention", "delay", "shift"])
+# Part of a query sent to a bucket - the range of a shifted route is moved forward by the shift
+Route = namedtuple("Route", ["bucket", "time_start", "time_stop", "shift"])
+
+
+def compile_rollups(declarations) -> tuple:
+    """Compile the rollups of a model - coarsest first:
+    [{"bucket": "prices_1h", "resolution": "1h", "retention": "365d", "delay": "1h", "time_src": "_stop"}]
+    The retention is unlimited by default and the delay is the resolution. The points of the downsampling
+    tasks are stamped with the window stop (aggregateWindow default) unless time_src is "_start"."""
+    rollups = []
+    for declaration in declarations:
+        resolution = parse_duration(declaration.get("resolution"))
+        if "bucket" not in declaration or not resolution:
+            raise exceptions.InvalidModelSchema(
+                'Rollups must be declared as a dict: {"bucket": "bucket_1h", "resolution": "1h"}')
+        retention = parse_duration(declaration.get("retention"))
+        if declaration.get("retention") and not retention:
+            raise exceptions.InvalidModelSchema(f"Invalid retention of the rollup {declaration['bucket']}")
+        delay = parse_duration(declaration.get("delay")) or resolution
+        shift = None if declaration.get("time_src") == "_start" else resolution
+        rollups.append(Rollup(declaration["bucket"], resolution, retention, delay, shift))
+    return tuple(sorted(rollups, key=lambda r: r.resolution, reverse=True))
+
+
+def _format_time(moment: datetime) -> str:
+    return moment.isoformat().replace("+00:00", "Z")
+
+
+def _covers(rollup: Rollup, start: datetime, stop: datetime, now: datetime) -> bool:
+    if rollup.retention and start < now - rollup.retention:
+        return False
+    return stop <= now - rollup.delay
+
+
+def route(bucket: str, rollups: tuple, time_start: str, time_stop: str, aggregate: str,
+          single: bool = False) -> list:
+    """Split a query into routes to the coarsest buckets which hold the range at a resolution the aggregate
+    windows can be built from. The windows are never split between 2 buckets. Recent data which isn't
+    downsampled yet and data older than the retention of the rollups is read from the raw bucket.
+    With single the whole range is sent to 1 bucket (paginated queries)."""
+    every = parse_duration(aggregate)
+    raw = [Route(bucket, time_start, time_stop, None)]
+    rollups = [r for r in rollups if every and every >= r.resolution and not every % r.resolution]
+    now = datetime.now(timezone.utc)
+    start = parse_time(time_start, now)
+    stop = parse_time(time_stop, now)
+    if not rollups or start is None or stop is None or start >= stop:
+        return raw
+    if single:
+        for rollup in rollups:
+            if _covers(rollup, start, stop, now):
+                return [_segment_route(bucket, rollup, start, stop, time_start, time_stop, start, stop)]
+        return raw
+    # The coverage edges of the rollups - aligned to the aggregate windows
+    boundaries = {start, stop}
+    for rollup in rollups:
+        if rollup.retention:
+            edge = now - rollup.retention
+            aligned = window_start(edge, every)
+            boundaries.add(aligned if aligned == edge else aligned + every)
+        boundaries.add(window_start(now - rollup.delay, every))
+    boundaries = sorted(b for b in boundaries if start <= b <= stop)
+    segments = []
+    for segment_start, segment_stop in zip(boundaries, boundaries[1:]):
+        tier = next((r for r in rollups if _covers(r, segment_start, segment_stop, now)), None)
+        if segments and segments[-1][0] is tier:
+            segments[-1][2] = segment_stop
+        else:
+            segments.append([tier, segment_start, segment_stop])
+    return [_segment_route(bucket, tier, segment_start, segment_stop, time_start, time_stop, start, stop)
+            for tier, segment_start, segment_stop in segments]
+
+
+def _segment_route(bucket: str, rollup: Rollup, segment_start: datetime, segment_stop: datetime,
+                   time_start: str, time_stop: str, start: datetime, stop: datetime) -> Route:
+    if rollup is not None and rollup.shift:
+        # The point of a window is stamped with the window stop - read 1 resolution later and shift back
+        return Route(rollup.bucket, _format_time(segment_start + rollup.shift),
+                     _format_time(segment_stop + rollup.shift), rollup.shift)
+    # The original start and stop are kept - relative ranges stay relative
+    route_start = time_start if segment_start == start else _format_time(segment_start)
+    route_stop = time_stop if segment_stop == stop else _format_time(segment_stop)
+    return Route(rollup.bucket if rollup else bucket, route_start, route_stop, None)
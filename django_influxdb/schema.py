@@ -0,0 +1,82 @@
+from . import exceptions
+
+# Model attributes the schema is compiled from
+SCHEMA_ATTRIBUTES = ("required_influx_tags", "optional_influx_tags", "fields")
+
+
+class ModelSchema:
+    """Tags and fields of an InfluxModel compiled once per class - the declaration is checked when the model
+    is defined and the data is validated by a row validator specialised for the schema."""
+    __slots__ = ("required_tags", "optional_tags", "tags", "fields", "validate_row")
+
+    def __init__(self, required_tags, optional_tags, fields):
+        self.required_tags = frozenset(required_tags)
+        self.optional_tags = frozenset(optional_tags)
+        both = self.required_tags & self.optional_tags
+        if both:
+            raise exceptions.InvalidModelSchema(f"Tags can't be both required and optional: {sorted(both)}")
+        self.tags = tuple(required_tags) + tuple(optional_tags)
+        if not all(isinstance(tag, str) for tag in self.tags):
+            raise exceptions.InvalidModelSchema("The tag names must be strings")
+        self.fields = tuple(self._compile_field(field) for field in fields)
+        self.validate_row = self._compile_validator()
+
+    @classmethod
+    def _compile_field(cls, field) -> tuple:
+        """(name, caster) pair of a field declaration"""
+        if not isinstance(field, dict) or "name" not in field or "type" not in field:
+            raise exceptions.InvalidModelSchema(
+                'Fields must be declared as a dict: {"name": "field_name", "type": float}')
+        if not callable(field["type"]):
+            raise exceptions.InvalidModelSchema(f"The type of the field {field['name']} must be callable")
+        if not isinstance(field["name"], str):
+            raise exceptions.InvalidModelSchema(f"The field name {field['name']!r} must be a string")
+        return field["name"], field["type"]
+
+    @classmethod
+    def from_model(cls, model):
+        return cls(*(getattr(model, attr) for attr in SCHEMA_ATTRIBUTES))
+
+    def cast_fields(self, item) -> dict:
+        """Field values of a data item casted to their declared types"""
+        try:
+            return {name: caster(item[name]) for name, caster in self.fields}
+        except KeyError:
+            self._raise_missing({**dict.fromkeys(self.tags), **item})
+            raise
+
+    def _raise_missing(self, item) -> None:
+        for tag in self.tags:
+            if tag in self.required_tags and tag not in item:
+                raise KeyError(f"Missing required tag {tag} from model data")
+        for name, _ in self.fields:
+            if name not in item:
+                raise KeyError(f"Setting the field is mandatory. Missing field: {name}")
+
+    def _compile_validator(self):
+        """Generate the row validator - the tags and fields are unrolled into dict displays, so a row is
+        validated without any loops or membership tests against the declaration.
+        The timestamp of a data item becomes the time of the point."""
+        namespace = {"raise_missing": self._raise_missing}
+        required = ", ".join(f"{tag!r}: item[{tag!r}]" for tag in self.tags if tag in self.required_tags)
+        lines = ["def validate_row(item):",
+                 "    try:",
+                 f"        tags = {{{required}}}"]
+        for tag in self.tags:
+            if tag in self.optional_tags:
+                lines += [f"        if {tag!r} in item:",
+                          f"            tags[{tag!r}] = item[{tag!r}]"]
+        values = []
+        for i, (name, caster) in enumerate(self.fields):
+            namespace[f"cast_{i}"] = caster
+            values.append(f"{name!r}: cast_{i}(item[{name!r}])")
+        lines += [f"        row = {{'tags': tags, 'fields': {{{', '.join(values)}}}}}",
+                  # The point time of data which has a timestamp
+                  "        if 'timestamp' in item:",
+                  "            row['time'] = item['timestamp']",
+                  "        return row",
+                  "    except KeyError:",
+                  "        raise_missing(item)",
+                  "        raise"]
+        exec("\n".join(lines), namespace)
+        return namespace["validate_row"]
@@ -33,3 +33,7 @@ INFLUXDB_ORG = "django_influxdb"
 INSTALLED_APPS = [
     'django_influxdb',
 ]
+
+REST_FRAMEWORK = {
+    "UNAUTHENTICATED_USER": None,
+}
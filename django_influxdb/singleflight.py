@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+import pickle
+import threading
+import time
+import uuid
+import weakref
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+
+DEFAULT_SINGLE_FLIGHT_SETTINGS = {"CACHE": None, "LOCK_TIMEOUT": 30, "WAIT_TIMEOUT": 30,
+                                  "POLL_INTERVAL": 0.05, "RESULT_TTL": 5, "KEY_PREFIX": "influxdb_flight"}
+
+
+class _Call:
+    """In-flight execution shared by the callers of a key"""
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces identical concurrent queries - the callers of a key which arrive while it's running wait for
+    the running execution and share its result (and its exception). The results are shared, don't modify them.
+
+    With a Django cache the executions are coalesced across processes as well: the first process takes a lock
+    in the cache and publishes the pickled result for RESULT_TTL seconds, the others poll for it every
+    POLL_INTERVAL seconds. They run the query themselves when the lock is released without a result or after
+    WAIT_TIMEOUT seconds. The cache is only used by the threaded variant."""
+
+    def __init__(self, cache: str = None, lock_timeout: float = 30, wait_timeout: float = 30,
+                 poll_interval: float = 0.05, result_ttl: float = 5, key_prefix: str = "influxdb_flight"):
+        self.cache = caches[cache] if cache else None
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.result_ttl = result_ttl
+        self.key_prefix = key_prefix
+        self._calls = {}
+        self._lock = threading.Lock()
+        # The async executions are bound to the event loop they run in
+        self._async_calls = weakref.WeakKeyDictionary()
+        self._stats_lock = threading.Lock()
+        self.stats = {"executed": 0, "collapsed": 0, "remote_hits": 0, "remote_timeouts": 0}
+
+    def _count(self, stat: str) -> None:
+        with self._stats_lock:
+            self.stats[stat] += 1
+
+    def do(self, key, function):
+        """Result of function() - shared with the concurrent callers of the key"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            self._count("collapsed")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = self._execute(key, function)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _execute(self, key, function):
+        if self.cache is None:
+            self._count("executed")
+            return function()
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        lock_key = f"{self.key_prefix}:lock:{digest}"
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            token = uuid.uuid4().hex
+            if self.cache.add(lock_key, token, self.lock_timeout):
+                return self._execute_leader(function, lock_key, token,
+                                            f"{self.key_prefix}:result:{digest}:{token}")
+            # The result of the lock holder is published under its token
+            token = self.cache.get(lock_key)
+            if token is None:
+                continue
+            result_key = f"{self.key_prefix}:result:{digest}:{token}"
+            while time.monotonic() < deadline:
+                payload = self.cache.get(result_key)
+                if payload is not None:
+                    self._count("remote_hits")
+                    return pickle.loads(payload)
+                if self.cache.get(lock_key) != token:
+                    break
+                time.sleep(self.poll_interval)
+            else:
+                self._count("remote_timeouts")
+                self._count("executed")
+                return function()
+            # Released without a result (the query failed) - try to run it here
+            payload = self.cache.get(result_key)
+            if payload is not None:
+                self._count("remote_hits")
+                return pickle.loads(payload)
+
+    def _execute_leader(self, function, lock_key: str, token: str, result_key: str):
+        try:
+            self._count("executed")
+            result = function()
+            self.cache.set(result_key, pickle.dumps(result, pickle.HIGHEST_PROTOCOL), self.result_ttl)
+            return result
+        finally:
+            # The lock may have expired and been taken by another leader - only the own lock is released
+            if self.cache.get(lock_key) == token:
+                self.cache.delete(lock_key)
+
+    async def ado(self, key, function):
+        """Result of await function() - shared with the concurrent callers of the key in the event loop.
+        A cancelled caller doesn't cancel the shared execution."""
+        loop = asyncio.get_running_loop()
+        calls = self._async_calls.setdefault(loop, {})
+        task = calls.get(key)
+        if task is None:
+            self._count("executed")
+            task = calls[key] = loop.create_task(function())
+            task.add_done_callback(lambda t: self._finish_task(calls, key, t))
+        else:
+            self._count("collapsed")
+        return await asyncio.shield(task)
+
+    @classmethod
+    def _finish_task(cls, calls: dict, key, task) -> None:
+        if calls.get(key) is task:
+            del calls[key]
+        if not task.cancelled():
+            # Retrieved, so that a failure nobody waits for any more isn't reported as never retrieved
+            task.exception()
+
+
+def get_single_flight_settings() -> dict:
+    conf = getattr(settings, "INFLUXDB_SINGLE_FLIGHT", None)
+    if not isinstance(conf, dict):
+        conf = {}
+    return {**DEFAULT_SINGLE_FLIGHT_SETTINGS, **conf}
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    """The process wide single flight from the INFLUXDB_SINGLE_FLIGHT setting - None when it's not enabled"""
+    global _single_flight
+    if not getattr(settings, "INFLUXDB_SINGLE_FLIGHT", None):
+        return None
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                conf = get_single_flight_settings()
+                _single_flight = SingleFlight(**{k.lower(): v for k, v in conf.items()})
+    return _single_flight
+
+
+def reset_single_flight(**kwargs) -> None:
+    global _single_flight
+    if kwargs.get("setting", "INFLUXDB_SINGLE_FLIGHT") == "INFLUXDB_SINGLE_FLIGHT":
+        _single_flight = None
+
+
+setting_changed.connect(reset_single_flight)
@@ -0,0 +1,404 @@
+import atexit
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from influxdb_client import WritePrecision
+from influxdb_client.client.write_api import SYNCHRONOUS
+from influxdb_client.rest import ApiException
+from django.conf import settings
+
+from . import exceptions
+from .connections import connections, DEFAULT_INFLUX_ALIAS
+from .instrumentation import measure
+from .writer import BatchWriter, get_write_setting
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SPOOL_SETTINGS = {"DIRECTORY": os.path.join(tempfile.gettempdir(), "django_influxdb_spool"),
+                          "SEGMENT_SIZE": 64 * 2 ** 20, "MAX_SEGMENTS": 16, "FSYNC": False,
+                          "BATCH_SIZE": 5000, "MAX_POINTS_PER_SECOND": None, "RETRY_INTERVAL": 1000,
+                          "MAX_RETRY_INTERVAL": 60000, "DRAIN_INTERVAL": 1000, "SWEEP_INTERVAL": 60000}
+# Rejections of a batch which fail the same way on every retry
+PERMANENT_STATUSES = frozenset((400, 401, 403, 404, 413, 422))
+# Record header: length of the body, CRC32 of the body and number of points
+HEADER = struct.Struct("<III")
+SEGMENT_SUFFIX = ".spool"
+
+
+def get_spool_settings() -> dict:
+    return {**DEFAULT_SPOOL_SETTINGS, **getattr(settings, "INFLUXDB_SPOOL", {})}
+
+
+class Segment:
+    """Memory-mapped spool file of a fixed size - records are appended after each other and the zeroed rest
+    of the file marks the end. A torn record (a crash while appending) fails its checksum and ends the
+    segment."""
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.truncate(size)
+        self._file = open(path, "r+b")
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        self.size = len(self._mmap)
+        self.end = self.scan()
+
+    def read(self, offset: int):
+        """(body, points, next offset) of the record at the offset - None at the end of the segment"""
+        if offset + HEADER.size > self.size:
+            return None
+        length, checksum, points = HEADER.unpack_from(self._mmap, offset)
+        start = offset + HEADER.size
+        if not length or start + length > self.size:
+            return None
+        body = self._mmap[start:start + length]
+        if zlib.crc32(body) != checksum:
+            return None
+        return body, points, start + length
+
+    def scan(self) -> int:
+        offset = 0
+        while True:
+            record = self.read(offset)
+            if record is None:
+                return offset
+            offset = record[2]
+
+    def append(self, body: bytes, points: int, fsync: bool = False) -> bool:
+        """Append a record - False when it doesn't fit"""
+        end = self.end + HEADER.size + len(body)
+        if end > self.size:
+            return False
+        self._mmap[self.end + HEADER.size:end] = body
+        HEADER.pack_into(self._mmap, self.end, len(body), zlib.crc32(body), points)
+        if end + HEADER.size <= self.size:
+            # The end marker - overwrites what's left of a torn record
+            HEADER.pack_into(self._mmap, end, 0, 0, 0)
+        if fsync:
+            self._mmap.flush()
+        self.end = end
+        return True
+
+    def close(self) -> None:
+        self._mmap.close()
+        self._file.close()
+
+
+class DiskSpool:
+    """Write-ahead spool of encoded batches. The writes are appended to memory-mapped segment files and
+    acknowledged right away, a background drainer replays them to InfluxDB in order.
+
+    The read position is stored in a cursor file after every request, so the points are sent at least once:
+    the unacknowledged records are replayed after a restart (writes of the same points are idempotent in
+    InfluxDB). The failed requests are retried with an exponential backoff until they succeed. The drained
+    segments are deleted, at most max_segments are kept - writes raise WriteBufferFull when they're full.
+    Every process claims its own lane directory (a file lock). The drainer also sweeps the lanes no process
+    holds every sweep_interval ms and replays them, so the points of a stopped process are sent when fewer
+    processes come back. A lane is the directory of a lane to open instead of claiming one - it must be
+    locked by the caller and isn't drained in the background."""
+
+    def __init__(self, using: str = DEFAULT_INFLUX_ALIAS, directory: str = None, error_callback=None,
+                 lane: str = None, **options):
+        self.using = using
+        callbacks = get_write_setting("INFLUXDB_WRITE_CALLBACKS")
+        self.error_callback = error_callback or BatchWriter._load_callback(callbacks.get("error"))
+        conf = get_spool_settings()
+        for option in ("segment_size", "max_segments", "fsync", "batch_size", "max_points_per_second",
+                       "retry_interval", "max_retry_interval", "drain_interval", "sweep_interval"):
+            setattr(self, option, options.get(option, conf[option.upper()]))
+        self.directory = lane or self._claim_lane(os.path.join(directory or conf["DIRECTORY"], using))
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+        self._next_send = 0.0
+        self._next_sweep = 0.0
+        self._segments = {}
+        numbers = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                         if name.endswith(SEGMENT_SUFFIX))
+        for number in numbers:
+            self._segments[number] = Segment(self._segment_path(number), self.segment_size)
+        if not self._segments:
+            self._segments[0] = Segment(self._segment_path(0), self.segment_size)
+        self._write_number = max(self._segments)
+        self._read_number, self._read_offset = self._load_cursor(min(self._segments))
+        if lane is None and self.pending_records():
+            self._start()
+
+    @staticmethod
+    def _lock_lane(directory: str):
+        """The open lock file of a lane - None when another spool holds it. The lock is held as long as the
+        file is open."""
+        lock = open(os.path.join(directory, "lock"), "a")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return None
+        return lock
+
+    def _claim_lane(self, root: str) -> str:
+        os.makedirs(root, exist_ok=True)
+        lane = 0
+        while True:
+            directory = os.path.join(root, f"lane-{lane}")
+            os.makedirs(directory, exist_ok=True)
+            if fcntl is None:
+                return directory
+            lock = self._lock_lane(directory)
+            if lock is not None:
+                self._lock_file = lock
+                return directory
+            lane += 1
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{number:012d}{SEGMENT_SUFFIX}")
+
+    def _load_cursor(self, first: int) -> tuple:
+        try:
+            with open(os.path.join(self.directory, "cursor")) as f:
+                number, offset = (int(v) for v in f.read().split())
+        except (OSError, ValueError):
+            return first, 0
+        if number not in self._segments:
+            return first, 0
+        return number, offset
+
+    def _save_cursor(self) -> None:
+        path = os.path.join(self.directory, "cursor")
+        with open(path + ".tmp", "w") as f:
+            f.write(f"{self._read_number} {self._read_offset}")
+        os.replace(path + ".tmp", path)
+
+    def _start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=f"influxdb-spool-{self.using}",
+                                            daemon=True)
+            self._thread.start()
+
+    def write(self, bucket: str, org: str, data: bytes, points: int = 1,
+              precision: str = WritePrecision.MS) -> None:
+        """Append line protocol data to the spool - it's sent by the drainer.
+        Raises WriteBufferFull when all the segments are full."""
+        if not points:
+            return
+        body = f"{bucket}\n{org}\n{precision}\n".encode() + data
+        with self._cond:
+            if self._closed:
+                raise exceptions.WriterClosed("The InfluxDB spool is closed")
+            segment = self._segments[self._write_number]
+            if not segment.append(body, points, self.fsync):
+                if len(self._segments) >= self.max_segments:
+                    raise exceptions.WriteBufferFull(f"The spool is full ({len(self._segments)} segments)")
+                self._write_number += 1
+                size = max(self.segment_size, HEADER.size * 2 + len(body))
+                segment = Segment(self._segment_path(self._write_number), size)
+                self._segments[self._write_number] = segment
+                segment.append(body, points, self.fsync)
+            self._cond.notify_all()
+            self._start()
+
+    def pending_records(self) -> bool:
+        if self._read_number != self._write_number:
+            return True
+        return self._read_offset < self._segments[self._read_number].end
+
+    def _take_batch(self) -> tuple:
+        """(conf, data, points, next position) of the records from the read position - the consecutive records
+        of the same bucket, org and precision up to batch_size points. Must be called with the lock held."""
+        number, offset = self._read_number, self._read_offset
+        conf, chunks, points = None, [], 0
+        while points < self.batch_size:
+            segment = self._segments[number]
+            record = segment.read(offset) if offset < segment.end else None
+            if record is None:
+                if number == self._write_number or chunks:
+                    break
+                # The end of a drained segment - continue in the next one
+                number, offset = self._drop_segment(number), 0
+                continue
+            body, record_points, next_offset = record
+            bucket, org, precision, data = bytes(body).split(b"\n", 3)
+            record_conf = (bucket.decode(), org.decode(), precision.decode())
+            if conf is not None and record_conf != conf:
+                break
+            conf = record_conf
+            chunks.append(data)
+            points += record_points
+            offset = next_offset
+        return conf, b"\n".join(chunks), points, (number, offset)
+
+    def _drop_segment(self, number: int) -> int:
+        segment = self._segments.pop(number)
+        segment.close()
+        os.remove(segment.path)
+        self._read_number, self._read_offset = min(self._segments), 0
+        self._save_cursor()
+        return self._read_number
+
+    def _run(self) -> None:
+        write_api = connections[self.using].write_api(write_options=SYNCHRONOUS)
+        while True:
+            with self._cond:
+                while not self._closed and not self.pending_records() and time.monotonic() < self._next_sweep:
+                    self._cond.wait(self.drain_interval / 1000)
+                if self._closed:
+                    return
+                pending = self.pending_records()
+            if not pending:
+                self._sweep(write_api)
+                continue
+            if not self._drain_batch(write_api):
+                # Closed while retrying - the batch stays in the spool for the next start
+                return
+
+    def _drain_batch(self, write_api, lane=None) -> bool:
+        """Send the next batch of the lane (this spool by default) and move its cursor past it - False when
+        this spool is closed first"""
+        lane = lane or self
+        with lane._cond:
+            conf, data, points, position = lane._take_batch()
+        if conf is None:
+            return True
+        self._throttle(points)
+        if not self._send(write_api, conf, data, points):
+            return False
+        with lane._cond:
+            lane._read_number, lane._read_offset = position
+            lane._save_cursor()
+            lane._cond.notify_all()
+        return True
+
+    def _sweep(self, write_api) -> None:
+        """Replay the lanes which no process holds - the lanes of the stopped processes"""
+        self._next_sweep = time.monotonic() + self.sweep_interval / 1000
+        if fcntl is None:
+            return
+        root = os.path.dirname(self.directory)
+        for name in sorted(os.listdir(root)):
+            directory = os.path.join(root, name)
+            if not name.startswith("lane-") or directory == self.directory or self._closed:
+                continue
+            lock = self._lock_lane(directory)
+            if lock is None:
+                continue
+            lane = DiskSpool(self.using, lane=directory, segment_size=self.segment_size,
+                             batch_size=self.batch_size, error_callback=self.error_callback)
+            lane._lock_file = lock
+            try:
+                while lane.pending_records():
+                    if not self._drain_batch(write_api, lane):
+                        return
+            finally:
+                lane.close()
+
+    def _throttle(self, points: int) -> None:
+        if not self.max_points_per_second:
+            return
+        now = time.monotonic()
+        wait = self._next_send - now
+        if wait > 0:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed, wait)
+        self._next_send = max(now, self._next_send) + points / self.max_points_per_second
+
+    def _send(self, write_api, conf: tuple, data: bytes, points: int) -> bool:
+        """Send a batch until it succeeds or InfluxDB rejects it for good (PERMANENT_STATUSES) - a rejected
+        batch goes to the error callback and is skipped. False when the spool is closed first."""
+        bucket, org, precision = conf
+        attempt = 0
+        while True:
+            try:
+                with measure("spool_drain", using=self.using, bucket=bucket) as m:
+                    if m:
+                        m.rows, m.bytes = points, len(data)
+                    write_api.write(bucket, org, data, write_precision=precision)
+                return True
+            except ApiException as e:
+                if e.status in PERMANENT_STATUSES:
+                    if self.error_callback:
+                        self.error_callback(conf, data, e)
+                    else:
+                        logger.error("InfluxDB bucket %s rejected a spooled batch of %s points, skipped: %s",
+                                     bucket, points, e)
+                    return True
+                logger.warning("Failed to write a spooled batch to InfluxDB bucket %s: %s", bucket, e)
+            except Exception as e:
+                logger.warning("Failed to write a spooled batch to InfluxDB bucket %s: %s", bucket, e)
+            delay = min(self.retry_interval * 2 ** attempt, self.max_retry_interval) / 1000
+            attempt += 1
+            with self._cond:
+                if self._cond.wait_for(lambda: self._closed, delay):
+                    return False
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait for the spooled points to be sent. Returns False on timeout."""
+        with self._cond:
+            if not self.pending_records():
+                return True
+            self._start()
+            return self._cond.wait_for(lambda: not self.pending_records(), timeout)
+
+    def close(self, timeout: float = None) -> None:
+        """Try to drain the spool for up to timeout seconds and stop the drainer - the rest is kept on disk"""
+        if timeout:
+            self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with self._cond:
+            for segment in self._segments.values():
+                segment.close()
+            self._segments = {}
+        if getattr(self, "_lock_file", None) is not None:
+            self._lock_file.close()
+
+
+class SpoolHandler:
+    """Process wide registry of disk spools - 1 spool per connection alias"""
+
+    def __init__(self):
+        self._spools = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def __getitem__(self, alias: str) -> DiskSpool:
+        if self._pid != os.getpid():
+            # The drainer threads don't survive a fork and the lanes are claimed per process
+            self._spools = {}
+            self._pid = os.getpid()
+        try:
+            return self._spools[alias]
+        except KeyError:
+            pass
+        with self._lock:
+            if alias not in self._spools:
+                self._spools[alias] = DiskSpool(using=alias)
+            return self._spools[alias]
+
+    def flush_all(self, timeout: float = None) -> None:
+        for spool in list(self._spools.values()):
+            spool.flush(timeout)
+
+    def close_all(self, timeout: float = None) -> None:
+        with self._lock:
+            spools = list(self._spools.values())
+            self._spools = {}
+        for spool in spools:
+            spool.close(timeout)
+
+
+spools = SpoolHandler()
+atexit.register(spools.close_all, 5)
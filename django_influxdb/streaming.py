@@ -0,0 +1,36 @@
+from itertools import islice
+from rest_framework.utils.encoders import JSONEncoder
+
+# Number of rows encoded into a single chunk of the streamed response
+STREAM_CHUNK_SIZE = 500
+STREAM_CONTENT_TYPES = {"json": "application/json", "ndjson": "application/x-ndjson"}
+
+
+def _chunks(rows, size: int):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_json(rows, chunk_size: int = STREAM_CHUNK_SIZE):
+    """Encode the rows as a JSON list, chunk by chunk"""
+    encode = JSONEncoder().encode
+    yield "["
+    separator = ""
+    for chunk in _chunks(rows, chunk_size):
+        yield separator + ",".join(encode(row) for row in chunk)
+        separator = ","
+    yield "]"
+
+
+def iter_ndjson(rows, chunk_size: int = STREAM_CHUNK_SIZE):
+    """Encode the rows as newline delimited JSON, chunk by chunk"""
+    encode = JSONEncoder().encode
+    for chunk in _chunks(rows, chunk_size):
+        yield "".join(encode(row) + "\n" for row in chunk)
+
+
+STREAM_ENCODERS = {"json": iter_json, "ndjson": iter_ndjson}
@@ -1,24 +1,143 @@
-from django.core import exceptions
-from influxdb_client import InfluxDBClient, Task
+import difflib
+import hashlib
+import threading
+from influxdb_client import Task
 from influxdb_client.rest import ApiException
 from django.conf import settings
+from django.core.signals import setting_changed
 # from django_influxdb.influxdb import Client
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import ChoiceLoader, Environment, FileSystemBytecodeCache, FileSystemLoader, PackageLoader
 
+from django_influxdb import exceptions
+from django_influxdb.connections import connections, DEFAULT_INFLUX_ALIAS
 from django_influxdb.models import InfluxTasks
 
+# InfluxDB appends the task options to the Flux of the tasks created with create_task_every
+_TASK_OPTION = "\n\noption task ="
+
+# Jinja environments by template folder - a template is compiled once per process
+_environments = {}
+_environments_lock = threading.Lock()
+
+
+def get_environment(folder: str) -> Environment:
+    """The shared Jinja environment of a template folder. The templates shipped in django_influxdb/flux are
+    used when the folder doesn't have them. With the INFLUXDB_TEMPLATE_BYTECODE_CACHE setting (a directory)
+    the compiled templates are cached on disk for the other processes."""
+    env = _environments.get(folder)
+    if env is None:
+        with _environments_lock:
+            env = _environments.get(folder)
+            if env is None:
+                bytecode_dir = getattr(settings, "INFLUXDB_TEMPLATE_BYTECODE_CACHE", None)
+                loader = ChoiceLoader([FileSystemLoader(folder), PackageLoader("django_influxdb", "flux")])
+                bytecode_cache = FileSystemBytecodeCache(bytecode_dir) if bytecode_dir else None
+                env = Environment(loader=loader, auto_reload=settings.DEBUG, bytecode_cache=bytecode_cache)
+                _environments[folder] = env
+    return env
+
+
+def reset_environments(**kwargs):
+    if kwargs.get("setting", "DEBUG") in ("INFLUXDB_TEMPLATE_BYTECODE_CACHE", "DEBUG"):
+        with _environments_lock:
+            _environments.clear()
+
+
+setting_changed.connect(reset_environments)
+
+
+def task_flux(task: Task) -> str:
+    """The Flux of an InfluxDB task without the task options"""
+    return (task.flux or "").split(_TASK_OPTION)[0].strip()
+
+
+def task_hash(flux: str, every: str) -> str:
+    """Hash of the Flux and the interval of a task - equal hashes don't need an update"""
+    return hashlib.sha256(f"{every}\n{flux.strip()}".encode()).hexdigest()
+
+
+def find_all(find, page_size: int, by_offset: bool = False):
+    """All the items of a paginated list API - each page starts after the id of the last item, or at the
+    offset for the APIs which don't support after (organizations)"""
+    after, offset = None, 0
+    while True:
+        kwargs = {"limit": page_size}
+        if by_offset and offset:
+            kwargs["offset"] = offset
+        elif after:
+            kwargs["after"] = after
+        items = find(**kwargs) or []
+        yield from items
+        if len(items) < page_size:
+            return
+        after = items[-1].id
+        offset += len(items)
+
+
+class MetadataIndex:
+    """The organizations, buckets and tasks of a connection loaded once and indexed by name.
+    Shared by the tasks of a sync run, so the lookups don't call the API for every task."""
+    # The largest pages InfluxDB accepts
+    org_page_size = 100
+    bucket_page_size = 100
+    task_page_size = 500
+
+    def __init__(self, using: str = DEFAULT_INFLUX_ALIAS):
+        self.using = using
+        self.org_name = connections.settings(using)["ORG"]
+        self.client = connections[using]
+        self._lock = threading.Lock()
+        orgs_api = self.client.organizations_api()
+        orgs = find_all(orgs_api.find_organizations, self.org_page_size, by_offset=True)
+        self.orgs = {org.name: org for org in orgs}
+        buckets_api = self.client.buckets_api()
+        buckets = find_all(lambda **kw: buckets_api.find_buckets(**kw).buckets, self.bucket_page_size)
+        self.buckets = {b.name: b for b in buckets}
+        self.tasks = {}
+        for task in find_all(self.client.tasks_api().find_tasks, self.task_page_size):
+            # There can be more than 1 task with a name - the first one is used, same as BaseTask
+            self.tasks.setdefault(task.name, task)
+
+    @property
+    def org(self):
+        try:
+            return self.orgs[self.org_name]
+        except KeyError:
+            raise exceptions.NonExistingOrg()
+
+    def get_or_create_bucket(self, name: str):
+        with self._lock:
+            if name not in self.buckets:
+                self.buckets[name] = self.client.buckets_api().create_bucket(bucket_name=name,
+                                                                             org_id=self.org.id)
+            return self.buckets[name]
+
+    def add_task(self, task: Task) -> None:
+        with self._lock:
+            self.tasks.setdefault(task.name, task)
+
 
 class BaseTask:
+    using = DEFAULT_INFLUX_ALIAS
+    index = None  # MetadataIndex of a sync run - the lookups don't call the API
+
+    @property
+    def org_name(self) -> str:
+        return connections.settings(self.using)["ORG"]
+
     def _get_org(self) -> str:
+        if self.index is not None:
+            return self.index.org
         org_api = self.client.organizations_api()
-        orgs = org_api.find_organizations()
-        for o in orgs:
-            if o.name == settings.INFLUXDB_ORG:
+        for o in find_all(org_api.find_organizations, MetadataIndex.org_page_size, by_offset=True):
+            if o.name == self.org_name:
                 return o
         raise exceptions.NonExistingOrg()
 
     def _get_influx_task(self) -> Task:
         """Get an existing task by filtering on self.name"""
+        if self.index is not None and not hasattr(self, "task_id"):
+            return self.index.tasks.get(self.name)
         if hasattr(self, "task_id"):
             try:
                 return self.task_api.find_task_by_id(self.task_id)
@@ -32,6 +151,9 @@ class BaseTask:
                 return i
 
     def _get_or_create_destination_bucket(self, name):
+        if self.index is not None:
+            self.index.get_or_create_bucket(name)
+            return
         if not self.buckets_api.find_bucket_by_name(name):
             org_id = self._get_org().id
             self.buckets_api.create_bucket(bucket_name=name, org_id=org_id)
@@ -46,15 +168,14 @@ class EveryTask(BaseTask):
         self.name = name
         self.source_bucket = kwargs.get("source_bucket", settings.INFLUXDB_DEFAULT_BUCKET)
         self.__dict__ = {**kwargs, **self.__dict__}
-        self.client = InfluxDBClient(url=settings.INFLUXDB_URL, token=settings.INFLUXDB_TOKEN, timeout=3000)
+        self.client = connections[self.using]
         self.task_api = self.client.tasks_api()
         self.buckets_api = self.client.buckets_api()
 
     def load_template(self) -> str:
         """Load and render the template with the values"""
-        env = Environment(loader=FileSystemLoader(self.flux_template_folder))
-        template = env.get_template(self.flux_template)
-        return template.render(org=settings.INFLUXDB_ORG, **self.__dict__)
+        template = get_environment(self.flux_template_folder).get_template(self.flux_template)
+        return template.render(org=self.org_name, **self.__dict__)
 
     def get_from_db(self) -> InfluxTasks:
         return InfluxTasks.objects.get(name=self.name)
@@ -105,6 +226,37 @@ class EveryTask(BaseTask):
         return self.task_api.create_task_every(db_obj.name, db_obj.flux, db_obj.task_interval,
                                                organization=org)
 
+    def sync(self, db_obj: InfluxTasks, dry_run: bool = False) -> tuple:
+        """Create or update the InfluxDB task of a DB entry - skipped when its Flux and interval are the same.
+        Returns the action ("create", "update" or "unchanged") and the diff of the Flux and the interval."""
+        influx_task = self._get_influx_task()
+        flux = db_obj.flux.strip()
+        if influx_task is None:
+            action, old_flux, old_every = "create", "", ""
+        else:
+            old_flux, old_every = task_flux(influx_task), influx_task.every or ""
+            same = task_hash(old_flux, old_every) == task_hash(flux, db_obj.task_interval)
+            action = "unchanged" if same else "update"
+        diff = []
+        if action != "unchanged":
+            if old_every != db_obj.task_interval:
+                diff += [f"-every: {old_every}", f"+every: {db_obj.task_interval}"]
+            diff += list(difflib.unified_diff(old_flux.splitlines(), flux.splitlines(), "influxdb", "db",
+                                              lineterm=""))
+        if dry_run or action == "unchanged":
+            return action, diff
+        self._get_or_create_destination_bucket(db_obj.destination_bucket)
+        if action == "create":
+            task = self.task_api.create_task_every(db_obj.name, flux, db_obj.task_interval,
+                                                   organization=self._get_org())
+            if self.index is not None:
+                self.index.add_task(task)
+        else:
+            influx_task.every = db_obj.task_interval
+            influx_task.flux = flux
+            self.task_api.update_task(influx_task)
+        return action, diff
+
     @classmethod
     def run_task(self, name):
         self.name = name
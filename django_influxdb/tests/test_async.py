@@ -0,0 +1,102 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import AsyncMock, patch
+from django.test import RequestFactory
+from rest_framework import pagination
+from rest_framework.permissions import IsAuthenticated
+
+from .mocks import MockInfluxClient, MOCK_RECORD
+from .test_views import PriceModel, PriceViewSet
+from django_influxdb.influxdb import AsyncClient
+
+
+class PagedPriceViewSet(PriceViewSet):
+    paginator = pagination.PageNumberPagination()
+    paginator.page_size = 10
+
+
+class TestAsyncClient(unittest.TestCase):
+    """Test the async client with a mocked InfluxDBClientAsync"""
+
+    def setUp(self):
+        patcher = patch("django_influxdb.influxdb.connections")
+        self.influx = patcher.start().get_async.return_value
+        self.addCleanup(patcher.stop)
+        self.query_api = self.influx.query_api.return_value
+        self.query_api.query = AsyncMock(
+            side_effect=lambda query, org, params: MockInfluxClient.query("1h", {}))
+
+    def test_no_sync_client(self):
+        client = AsyncClient("prices", bucket="test")
+        self.assertIsNone(client.client)
+
+    def test_query(self):
+        client = AsyncClient("prices", bucket="test")
+        tables = asyncio.run(client.query(time_start="1h", tags={"symbol": "BTC"}))
+        self.assertEqual(tables[0].records[0]["price"], MOCK_RECORD["price"])
+        self.assertIn('tag_0: "BTC"', self.query_api.query.call_args[0][0])
+
+    def test_write(self):
+        write_api = self.influx.write_api.return_value
+        write_api.write = AsyncMock()
+        client = AsyncClient("prices", bucket="test")
+        asyncio.run(client.write([{"tags": {"symbol": "BTC"}, "fields": {"price": 1.5}}], timestamp=False))
+        args = write_api.write.call_args[0]
+        self.assertEqual(args[:2], ("test", client.org))
+        self.assertEqual(args[2], b"prices,symbol=BTC price=1.5")
+
+
+class TestAsyncModel(unittest.TestCase):
+    """Test the async model and view paths with a mocked async client"""
+
+    def setUp(self):
+        patcher = patch("django_influxdb.models.AsyncClient")
+        self.client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.client.query = AsyncMock(side_effect=MockInfluxClient.query)
+        self.client.count = AsyncMock(return_value=25)
+        self.client.write = AsyncMock()
+
+    def test_afilter(self):
+        results = asyncio.run(PriceModel(data={"symbol": "BTC"}).afilter("1h"))
+        self.assertEqual(results[0]["price"], MOCK_RECORD["price"])
+
+    def test_queryset(self):
+        queryset = PriceModel.objects.filter(symbol="BTC").range("1h")[20:40]
+        self.assertEqual(asyncio.run(queryset.acount()), 5)
+        self.assertEqual(len(asyncio.run(queryset.afetch())), 1)
+        self.assertEqual(self.client.query.call_args[1]["offset"], 20)
+
+    def test_asave(self):
+        model = PriceModel(data={"symbol": "BTC", "price": 1.5})
+        asyncio.run(model.asave())
+        self.assertTrue(self.client.write.called)
+
+    def test_view(self):
+        view = PagedPriceViewSet.as_async_view()
+        self.assertTrue(asyncio.iscoroutinefunction(view))
+        request = RequestFactory().get("/prices/", {"time_start": "1h", "symbol": "BTC", "page": 2})
+        data = json.loads(asyncio.run(view(request)).content)
+        self.assertEqual(data["count"], 25)
+        self.assertEqual(data["results"][0]["symbol"], "BTC")
+        self.assertNotIn("page=", data["previous"])
+        self.assertIn("page=3", data["next"])
+        self.assertEqual(self.client.query.call_args[1]["offset"], 10)
+
+    def test_view_permissions(self):
+        """Test the DRF authentication and permissions of the viewset protect the async view"""
+        view = type("PrivatePriceViewSet", (PagedPriceViewSet,), {"permission_classes": [IsAuthenticated]})
+        request = RequestFactory().get("/prices/", {"time_start": "1h", "symbol": "BTC"})
+        response = asyncio.run(view.as_async_view()(request))
+        self.assertEqual(response.status_code, 403)
+        self.assertIn(b"permission", response.content)
+        self.client.query.assert_not_called()
+
+    def test_view_errors(self):
+        view = PagedPriceViewSet.as_async_view()
+        response = asyncio.run(view(RequestFactory().get("/prices/", {"time_start": "1h"})))
+        self.assertEqual(response.status_code, 400)
+        request = RequestFactory().get("/prices/", {"time_start": "1h", "symbol": "BTC", "page": 9})
+        self.assertEqual(asyncio.run(view(request)).status_code, 404)
+        self.assertEqual(asyncio.run(view(RequestFactory().post("/prices/"))).status_code, 405)
@@ -0,0 +1,82 @@
+import unittest
+from unittest.mock import MagicMock
+from django.test import override_settings
+
+from .mocks import MockInfluxClient
+from django_influxdb.cache import DjangoQueryCache, LocMemQueryCache, get_query_cache, get_ttl
+from django_influxdb.influxdb import Client
+
+LOCMEM_CACHE = {"BACKEND": "django_influxdb.cache.LocMemQueryCache", "HISTORICAL_TTL": 3600, "LIVE_TTL": 30}
+
+
+class TestLocMemQueryCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = LocMemQueryCache(max_bytes=200)
+
+    def test_get_set(self):
+        self.cache.set("key", [1, 2], ttl=10)
+        self.assertEqual(self.cache.get("key"), [1, 2])
+        self.assertIsNone(self.cache.get("missing"))
+        self.assertEqual(self.cache.stats["hits"], 1)
+        self.assertEqual(self.cache.stats["misses"], 1)
+
+    def test_expired(self):
+        self.cache.set("key", [1, 2], ttl=-1)
+        self.assertIsNone(self.cache.get("key"))
+        self.assertEqual(self.cache.size, 0)
+
+    def test_byte_budget(self):
+        """Test the least recently used entries are evicted to stay in the byte budget"""
+        for key in ["a", "b", "c"]:
+            self.cache.set(key, "x" * 80, ttl=10)
+        self.assertIsNone(self.cache.get("a"))
+        self.assertIsNotNone(self.cache.get("c"))
+        self.assertEqual(self.cache.stats["evictions"], 1)
+        self.assertLessEqual(self.cache.size, 200)
+
+    def test_too_big(self):
+        self.cache.set("key", "x" * 500, ttl=10)
+        self.assertIsNone(self.cache.get("key"))
+
+
+class TestDjangoQueryCache(unittest.TestCase):
+    def test_get_set(self):
+        cache = DjangoQueryCache()
+        cache.set("django-key", {"a": 1}, ttl=10)
+        self.assertEqual(cache.get("django-key"), {"a": 1})
+
+
+class TestQueryCaching(unittest.TestCase):
+    def setUp(self):
+        overrides = override_settings(INFLUXDB_QUERY_CACHE=LOCMEM_CACHE)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_ttl(self):
+        """Test past ranges live long and live ranges until the window ends"""
+        self.assertEqual(get_ttl("2020-01-01T00:00:00Z", "2020-01-02T00:00:00Z", "1h"), 3600)
+        self.assertLessEqual(get_ttl("1d", "now()", "1h"), 30)
+        self.assertLessEqual(get_ttl("1d", "now()", "10s"), 10)
+
+    def get_client(self, influx, **kwargs):
+        client = Client(measurement="test-cache", **kwargs)
+        client.client = influx
+        return client
+
+    def test_client_query(self):
+        """Test the second identical query is served from the cache"""
+        influx = MagicMock()
+        influx.query_api.return_value.query.return_value = MockInfluxClient.query(None, None)
+        time_range = {"time_start": "2020-01-01T00:00:00Z", "time_stop": "2020-01-02T00:00:00Z"}
+        first = self.get_client(influx).query(**time_range)
+        second = self.get_client(influx).query(**time_range)
+        self.assertEqual(influx.query_api.return_value.query.call_count, 1)
+        self.assertEqual(first[0].records[0].values, second[0].records[0].values)
+        self.assertEqual(get_query_cache().stats["hits"], 1)
+
+    def test_disabled(self):
+        influx = MagicMock()
+        influx.query_api.return_value.query.return_value = []
+        self.get_client(influx, use_cache=False).query(time_start="1h")
+        self.get_client(influx, use_cache=False).query(time_start="1h")
+        self.assertEqual(influx.query_api.return_value.query.call_count, 2)
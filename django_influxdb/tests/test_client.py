@@ -45,6 +45,21 @@ class TestBuildQuery(unittest.TestCase):
         self.client._build_query()
         assert "aggregateWindow" in self.client.query
 
+    def test_limit(self):
+        """Test the limit is applied on the merged tables"""
+        self.client.limit = 10
+        self.client.offset = 20
+        self.client._build_query()
+        assert "group()" in self.client.query
+        assert "limit(n: params.limit, offset: params.offset)" in self.client.query
+        assert "limit: 10, offset: 20" in self.client.query
+
+    def test_count(self):
+        self.client.count_rows = True
+        self.client._build_query()
+        assert "count(" in self.client.query
+        assert "limit" not in self.client.query
+
 
 class TestCheckTime(TestCase):
     def setUp(self):
@@ -0,0 +1,78 @@
+import unittest
+from django.test import override_settings
+
+from django_influxdb import exceptions
+from django_influxdb.compiler import compile_aggregation, compile_query, compile_shape, escape_string
+
+
+class TestCompiler(unittest.TestCase):
+    """Test the Flux query compilation"""
+
+    def test_contains(self):
+        query, params = compile_query("test", "prices", "-1h", "now()", tags={"symbol": ["BTC", "ETH"]})
+        self.assertIn('contains(value: r["symbol"], set: params.tag_0)', query)
+        self.assertIn('tag_0: ["BTC", "ETH"]', query)
+        self.assertIsNone(params)
+
+    def test_grouped_conditions(self):
+        """Test multi value filters don't leak out of the and conditions"""
+        query, _ = compile_query("test", "prices", "-1h", "now()",
+                                 tags={"symbol": ["BTC", "ETH"], "exchange": "binance"})
+        conditions = 'contains(value: r["symbol"], set: params.tag_0) and r["exchange"] == params.tag_1'
+        self.assertIn(conditions, query)
+
+    def test_escaped_values(self):
+        query, _ = compile_query("test", "prices", "-1h", "now()", tags={"symbol": 'BTC" or true or "${x}'})
+        self.assertIn(r'tag_0: "BTC\" or true or \"\${x}"', query)
+        self.assertEqual(escape_string("a\\b"), r'"a\\b"')
+
+    def test_latest(self):
+        query, _ = compile_query("test", "prices", "-1h", "now()", tags={"symbol": "BTC"}, aggregate="5m",
+                                 sorting=("-_time",), latest=True)
+        self.assertTrue(query.endswith(' |> last() |> group() |> max(column: "_time")'))
+        self.assertNotIn("aggregateWindow", query)
+        self.assertNotIn("every", query)
+
+    def test_shape_cache(self):
+        compile_shape.cache_clear()
+        compile_query("test", "prices", "-1h", "now()", tags={"symbol": ["BTC"]}, aggregate="5m")
+        compile_query("test", "prices", "-2d", "now()", tags={"symbol": ["ETH", "LTC"]}, aggregate="1h")
+        self.assertEqual(compile_shape.cache_info().hits, 1)
+
+    def test_times(self):
+        query, _ = compile_query("test", "prices", 'time(v: "2021-10-10T14:00:00Z")', "now()")
+        self.assertIn("range(start: time(v: params.start), stop: now())", query)
+        self.assertIn('start: "2021-10-10T14:00:00Z"', query)
+
+    def test_params(self):
+        with override_settings(INFLUXDB_QUERY_PARAMS=True):
+            query, params = compile_query("test", "prices", "-1h", "now()", tags={"symbol": ["BTC"]},
+                                          aggregate="5m", limit=10)
+        self.assertTrue(query.startswith("from(bucket: params.bucket)"))
+        self.assertEqual(params, {"bucket": "test", "measurement": "prices", "start": "-1h",
+                                  "tag_0": ["BTC"], "every": "5m", "limit": 10, "offset": 0})
+
+
+class TestAggregations(unittest.TestCase):
+    """Test the aggregate function pushdown"""
+
+    def test_function(self):
+        query, _ = compile_query("test", "prices", "-1h", "now()", aggregate="5m",
+                                 aggregation=compile_aggregation("max"))
+        self.assertIn("fn: max, createEmpty: false", query)
+        self.assertIn("quantile(q: 0.95, column: column)", compile_aggregation("p95"))
+        with self.assertRaises(exceptions.InvalidAggregation):
+            compile_aggregation("max() |> drop")
+
+    def test_multiple(self):
+        """Test the columns are aggregated in 1 query and pivoted to 1 row per window"""
+        aggregation = compile_aggregation({"open": ("price", "first"), "close": ("price", "last"),
+                                           "volume": ("volume", "sum")})
+        query, _ = compile_query("test", "prices", "-1d", "now()", aggregate="1h", aggregation=aggregation)
+        self.assertIn("\ndata = from(bucket: params.bucket)", query)
+        self.assertIn("union(tables: [data |> filter(fn: (r) => r._field == \"price\")", query)
+        self.assertIn('fn: sum, createEmpty: false) |> map(fn: (r) => ({r with _field: "volume"}))', query)
+        pivot = 'pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")'
+        self.assertTrue(query.endswith(pivot))
+        with self.assertRaises(exceptions.InvalidAggregation):
+            compile_aggregation({"open": "price"})
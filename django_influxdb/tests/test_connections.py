@@ -0,0 +1,56 @@
+import unittest
+from django.test import override_settings
+
+from django_influxdb.connections import ConnectionHandler
+from django_influxdb.influxdb import Client
+from django_influxdb import exceptions
+
+CONNECTIONS = {
+    "default": {},
+    "other": {"URL": "http://influx-other:8086", "ORG": "other", "POOL_SIZE": 2, "GZIP": True},
+}
+
+
+class TestConnectionHandler(unittest.TestCase):
+    """Test the InfluxDB connection registry"""
+
+    def setUp(self):
+        self.connections = ConnectionHandler()
+
+    def tearDown(self):
+        self.connections.close_all()
+
+    def test_same_client(self):
+        """Test the client is created once per alias"""
+        self.assertIs(self.connections["default"], self.connections["default"])
+
+    def test_settings_fallback(self):
+        """Test the alias settings fall back to the INFLUXDB_* settings"""
+        conf = self.connections.settings()
+        self.assertEqual(conf["URL"], "http://localhost:8086")
+        self.assertEqual(conf["ORG"], "django_influxdb")
+
+    @override_settings(INFLUXDB_CONNECTIONS=CONNECTIONS)
+    def test_multiple_aliases(self):
+        """Test every alias gets its own configured client"""
+        other = self.connections["other"]
+        self.assertIsNot(other, self.connections["default"])
+        self.assertEqual(other.url, "http://influx-other:8086")
+        self.assertEqual(other.org, "other")
+        self.assertTrue(other.api_client.configuration.enable_gzip)
+        self.assertEqual(other.api_client.configuration.connection_pool_maxsize, 2)
+
+    def test_missing_alias(self):
+        with self.assertRaises(exceptions.ConnectionDoesNotExist):
+            self.connections["missing"]
+
+    def test_close_all(self):
+        client = self.connections["default"]
+        self.connections.close_all()
+        self.assertIsNot(client, self.connections["default"])
+
+    def test_shared_by_clients(self):
+        """Test the influx Client reuses the process wide connection"""
+        first = Client(measurement="first")
+        second = Client(measurement="second")
+        self.assertIs(first.client, second.client)
@@ -0,0 +1,133 @@
+import threading
+import time
+import unittest
+from unittest.mock import patch
+from influxdb_client.client.flux_table import FluxColumn, FluxRecord, FluxTable
+
+from .mocks import MockInfluxClient
+from .test_views import PriceModel
+from django_influxdb.durations import parse_time
+from django_influxdb.fanout import fan_out, split_range, split_tags
+
+
+class ChunkedPriceModel(PriceModel):
+    query_chunk = "1d"
+    query_tag_chunk = 2
+    query_concurrency = 2
+
+
+class TestSplit(unittest.TestCase):
+
+    def test_split_range(self):
+        ranges = split_range("2021-01-01T00:00:00Z", "2021-01-04T12:00:00Z", "1d", "1h")
+        self.assertEqual(len(ranges), 4)
+        self.assertEqual(ranges[0], ("2021-01-01T00:00:00Z", "2021-01-02T00:00:00Z"))
+        self.assertEqual(ranges[-1], ("2021-01-04T00:00:00Z", "2021-01-04T12:00:00Z"))
+
+    def test_aligned_to_windows(self):
+        """Test the chunks are whole multiples of the aggregate window"""
+        ranges = split_range("2021-01-01T00:00:00Z", "2021-01-01T01:00:00Z", "25m", "10m")
+        self.assertEqual([r[1] for r in ranges], ["2021-01-01T00:20:00Z", "2021-01-01T00:40:00Z",
+                                                  "2021-01-01T01:00:00Z"])
+
+    def test_relative_range(self):
+        ranges = split_range("3d", "now()", "1d", "5m")
+        self.assertEqual(ranges[0][0], "3d")
+        self.assertEqual(ranges[-1][1], "now()")
+        for (_, stop), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(stop, start)
+            self.assertIsNotNone(parse_time(start))
+
+    def test_no_split(self):
+        self.assertEqual(split_range("1mo", "now()", "1d"), [("1mo", "now()")])
+        self.assertEqual(split_range("1h", "now()", "1d"), [("1h", "now()")])
+
+    def test_split_tags(self):
+        tags = {"symbol": ["BTC", "ETH", "LTC"], "exchange": "binance"}
+        self.assertEqual(split_tags(tags, 2), [{"symbol": ["BTC", "ETH"], "exchange": "binance"},
+                                               {"symbol": ["LTC"], "exchange": "binance"}])
+        self.assertEqual(split_tags(tags, None), [tags])
+
+
+class TestFanOut(unittest.TestCase):
+
+    def test_order_and_concurrency(self):
+        running = []
+        lock = threading.Lock()
+
+        def job(i):
+            with lock:
+                running.append(1)
+            time.sleep(0.01 * (5 - i))
+            with lock:
+                concurrent = len(running)
+                running.pop()
+            return i, concurrent
+        results = list(fan_out(job, range(5), 2))
+        self.assertEqual([r[0] for r in results], list(range(5)))
+        self.assertTrue(all(r[1] <= 2 for r in results))
+
+    def test_model(self):
+        with patch("django_influxdb.models.InfluxClient") as client:
+            client.return_value.query.side_effect = MockInfluxClient.query
+            model = ChunkedPriceModel(data={"symbol": "BTC,ETH,LTC".split(",")})
+            results = model.filter("2021-01-01T00:00:00Z", "2021-01-03T00:00:00Z", "1h")
+        # 2 days x 2 tag chunks
+        self.assertEqual(len(results), 4)
+        calls = [c[1] for c in client.return_value.query.call_args_list]
+        self.assertEqual(sorted({c["time_stop"] for c in calls}),
+                         ["2021-01-02T00:00:00Z", "2021-01-03T00:00:00Z"])
+        self.assertEqual(sorted(len(c["tags"]["symbol"]) for c in calls), [1, 1, 2, 2])
+
+    def test_model_order(self):
+        """Test the split query returns the records in the order of the unsplit query - series by series"""
+        def query(time_start, time_stop, tags, **kwargs):
+            symbols = tags["symbol"] if isinstance(tags["symbol"], list) else [tags["symbol"]]
+            days = [t for t in ["2021-01-01", "2021-01-02"] if time_start <= t + "T00:00:00Z" < time_stop]
+            tables = []
+            for symbol in symbols:
+                table = FluxTable()
+                table.columns = [FluxColumn(0, "_start", group=True), FluxColumn(1, "symbol", group=True)]
+                table.records = [FluxRecord(0, {"_start": time_start, "symbol": symbol, "_field": "price",
+                                                "_value": 1, "price": 1, "_time": day}) for day in days]
+                tables.append(table)
+            return tables
+        symbols = ["BTC", "ETH", "LTC"]
+        results = {}
+        for model_class in (PriceModel, ChunkedPriceModel):
+            with patch("django_influxdb.models.InfluxClient") as client:
+                client.return_value.query.side_effect = query
+                model = model_class(data={"symbol": symbols})
+                rows = model.filter("2021-01-01T00:00:00Z", "2021-01-03T00:00:00Z", "1h")
+            results[model_class] = [(row["symbol"], row["timestamp"]) for row in rows]
+        self.assertEqual(results[ChunkedPriceModel], results[PriceModel])
+        self.assertEqual(results[PriceModel][:2], [("BTC", "2021-01-01"), ("BTC", "2021-01-02")])
+
+    def test_stream(self):
+        """Test stream yields the first series before the last sub-query has run"""
+        started = []
+        release = threading.Event()
+
+        def query(time_start, time_stop, tags, **kwargs):
+            started.append(time_start)
+            if time_stop == "2021-01-04T00:00:00Z":
+                release.wait(5)
+            table = FluxTable()
+            table.columns = [FluxColumn(0, "_start", group=True), FluxColumn(1, "symbol", group=True)]
+            table.records = [FluxRecord(0, {"_start": time_start, "symbol": tags["symbol"], "_field": "price",
+                                            "_value": 1, "price": 1, "_time": time_start})]
+            return [table]
+
+        class StreamedPriceModel(ChunkedPriceModel):
+            query_concurrency = 1
+
+        with patch("django_influxdb.models.InfluxClient") as client:
+            client.return_value.query.side_effect = query
+            rows = StreamedPriceModel(data={"symbol": "BTC"}).stream("2021-01-01T00:00:00Z",
+                                                                     "2021-01-04T00:00:00Z", "1h")
+            first = next(rows)
+            self.assertEqual(first["timestamp"], "2021-01-01T00:00:00Z")
+            self.assertNotIn("2021-01-03T00:00:00Z", started)
+            release.set()
+            rest = list(rows)
+        self.assertEqual([row["timestamp"] for row in rest], ["2021-01-02T00:00:00Z", "2021-01-03T00:00:00Z"])
@@ -0,0 +1,77 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+from influxdb_client.client.flux_table import FluxColumn, FluxRecord, FluxTable
+
+from django_influxdb.durations import parse_time, window_start
+from django_influxdb.incremental import TailCache
+
+EVERY = timedelta(minutes=5)
+
+
+def get_table(symbol: str, times: list) -> FluxTable:
+    table = FluxTable()
+    table.columns = [FluxColumn(0, "_start", group=True), FluxColumn(1, "symbol", group=True),
+                     FluxColumn(2, "_time", group=False), FluxColumn(3, "_value", group=False)]
+    for moment in times:
+        table.records.append(FluxRecord(0, {"_start": times[0], "symbol": symbol, "_time": moment,
+                                            "_value": moment.minute}))
+    return table
+
+
+class TestTailCache(unittest.TestCase):
+    """Test the rolling window query merging"""
+
+    def setUp(self):
+        self.cache = TailCache(max_entries=2)
+        self.boundary = window_start(datetime.now(timezone.utc), EVERY)
+
+    def test_supports(self):
+        self.assertTrue(TailCache.supports("1h", "now()", "5m"))
+        self.assertFalse(TailCache.supports("2021-10-10T14:00:00Z", "now()", "5m"))
+        self.assertFalse(TailCache.supports("1h", "now()", "1mo"))
+
+    def test_delta_query(self):
+        """Test the second query fetches only from the last boundary and replaces the partial window"""
+        complete = [self.boundary - EVERY * i for i in range(3, -1, -1)]
+        partial = datetime.now(timezone.utc)
+        query = MagicMock(return_value=[get_table("BTC", complete + [partial])])
+        records = list(self.cache.query("key", query, "1h", "5m"))
+        self.assertEqual(len(records), 5)
+        self.assertEqual(query.call_args[0][0], "1h")
+
+        boundary = self.cache.get("key").boundary
+        later = partial + timedelta(seconds=1)
+        query.return_value = [get_table("BTC", [later]), get_table("ETH", [partial])]
+        records = list(self.cache.query("key", query, "1h", "5m"))
+        self.assertEqual(parse_time(query.call_args[0][0]), boundary)
+        # The old partial window is replaced, the new series is appended
+        self.assertEqual([r.get_time() for r in records], complete + [later, partial])
+
+    def test_trim_head(self):
+        """Test the windows which ended before the range start are dropped"""
+        old = [self.boundary - EVERY * i for i in range(20, 0, -1)]
+        query = MagicMock(return_value=[get_table("BTC", old)])
+        self.cache.query("key", query, "1h", "5m")
+        query.return_value = []
+        records = list(self.cache.query("key", query, "30m", "5m"))
+        start = datetime.now(timezone.utc) - timedelta(minutes=30)
+        self.assertTrue(all(r.get_time() > start for r in records))
+        self.assertEqual(len(records), 5)
+
+    def test_widen(self):
+        """Test a wider range than the cached one fetches the whole range"""
+        query = MagicMock(return_value=[get_table("BTC", [self.boundary])])
+        self.cache.query("key", query, "1h", "5m")
+        self.cache.query("key", query, "24h", "5m")
+        self.assertEqual(query.call_args[0][0], "24h")
+        # The narrower range is merged again
+        self.cache.query("key", query, "1h", "5m")
+        self.assertNotEqual(query.call_args[0][0], "1h")
+
+    def test_lru(self):
+        query = MagicMock(return_value=[])
+        for key in ["a", "b", "c"]:
+            self.cache.query(key, query, "1h", "5m")
+        self.assertIsNone(self.cache.get("a"))
+        self.assertIsNotNone(self.cache.get("c"))
@@ -0,0 +1,57 @@
+import unittest
+from unittest.mock import MagicMock
+from django.test import override_settings
+
+from .mocks import MockInfluxClient
+from django_influxdb.influxdb import Client
+from django_influxdb.instrumentation import NO_MEASUREMENT, collector, measure, phase_finished
+
+ENABLED = {"ENABLED": True, "SLOW_QUERY_THRESHOLD": 0}
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        collector.reset()
+        self.measurements = []
+        self.client = Client(measurement="prices", use_cache=False)
+        self.client.client = MagicMock()
+        self.client.client.query_api.return_value.query.return_value = MockInfluxClient.query(None, None)
+
+    def hook(self, measurement):
+        self.measurements.append(measurement)
+
+    def test_disabled(self):
+        self.assertIs(measure("query"), NO_MEASUREMENT)
+        with override_settings(INFLUXDB_INSTRUMENTATION={"ENABLED": False, "HOOKS": [self.hook]}):
+            self.client.query(time_start="1h")
+        self.assertEqual(self.measurements, [])
+        self.assertEqual(collector.samples(), {})
+
+    def test_query(self):
+        settings = {**ENABLED, "HOOKS": [self.hook]}
+        with override_settings(INFLUXDB_INSTRUMENTATION=settings):
+            with self.assertLogs("django_influxdb.slow_queries"):
+                self.client.query(time_start="1h")
+        self.assertEqual([m.phase for m in self.measurements], ["build_query", "query"])
+        query = self.measurements[1]
+        self.assertEqual(query.rows, 1)
+        self.assertEqual(query.query, self.client.query)
+        self.assertGreater(self.measurements[0].bytes, 0)
+        sample = collector.samples()[("query", (("bucket", self.client.bucket), ("measurement", "prices")))]
+        self.assertEqual((sample["count"], sample["rows"], sample["errors"]), (1, 1, 0))
+        self.assertIn('influxdb_phase_rows_total{phase="query",bucket="', collector.render())
+
+    def test_signal_and_errors(self):
+        received = []
+
+        def receiver(sender, measurement, **kwargs):
+            received.append((sender, measurement.error))
+        phase_finished.connect(receiver)
+        self.addCleanup(phase_finished.disconnect, receiver)
+        with override_settings(INFLUXDB_INSTRUMENTATION=ENABLED):
+            with self.assertRaises(ValueError):
+                with measure("write", measurement="prices"):
+                    raise ValueError()
+        self.assertEqual(received, [("write", ValueError)])
+        self.assertEqual(collector.samples()[("write", (("measurement", "prices"),))]["errors"], 1)
@@ -0,0 +1,74 @@
+import unittest
+from datetime import datetime, timezone
+from influxdb_client import Point, WritePrecision
+
+from django_influxdb.line_protocol import LineProtocolEncoder
+
+
+class TestLineProtocolEncoder(unittest.TestCase):
+    """Test the line protocol encoder against influxdb_client.Point"""
+
+    def setUp(self):
+        self.encoder = LineProtocolEncoder("prices", tags=["symbol", "exchange"],
+                                           fields=[("price", float), ("volume", int), ("note", str)])
+
+    def point(self, tags, fields):
+        point = Point("prices")
+        for tag, value in sorted(tags.items()):
+            point.tag(tag, value)
+        for field, value in fields.items():
+            point.field(field, value)
+        return point.to_line_protocol()
+
+    def test_matches_point(self):
+        """Test the encoded rows match the Point serialization, escaping included"""
+        tags = {"symbol": "BTC USD", "exchange": "a,b=c"}
+        fields = {"price": 1.5, "volume": 10, "note": 'say "hi" \\'}
+        data, points = self.encoder.encode([{**tags, **fields}], timestamp=False)
+        self.assertEqual(points, 1)
+        self.assertEqual(data.decode(), self.point(tags, fields))
+
+    def test_items(self):
+        items = [{"tags": {"symbol": "BTC"}, "fields": {"price": 1.0}},
+                 {"tags": {"symbol": "ETH"}, "fields": {"price": 2.0}}]
+        data, points = self.encoder.encode_items(items, timestamp=False)
+        self.assertEqual(points, 2)
+        self.assertEqual(data, b"prices,symbol=BTC price=1.0\nprices,symbol=ETH price=2.0")
+
+    def test_columns(self):
+        """Test columnar input gives the same output as rows"""
+        columns = {"symbol": ["BTC", "ETH"], "price": [1.0, 2.0]}
+        rows = [{"symbol": "BTC", "price": 1.0}, {"symbol": "ETH", "price": 2.0}]
+        self.assertEqual(self.encoder.encode_columns(columns, timestamp=1),
+                         self.encoder.encode(rows, timestamp=1))
+
+    def test_skip_invalid_fields(self):
+        """Test NaN and missing fields are skipped and points without fields are dropped"""
+        data, points = self.encoder.encode([{"symbol": "BTC", "price": float("nan")},
+                                            {"symbol": "BTC", "price": 1.0, "volume": None}], timestamp=False)
+        self.assertEqual(points, 1)
+        self.assertEqual(data, b"prices,symbol=BTC price=1.0")
+
+    def test_timestamp(self):
+        """Test the batch timestamp and a row timestamp in ms precision"""
+        moment = datetime(2021, 10, 10, 14, 0, 0, 123000, tzinfo=timezone.utc)
+        data, _ = self.encoder.encode([{"price": 1.5}, {"price": 2.0, "timestamp": moment}], timestamp=moment)
+        expected = self.point({}, {"price": 1.5}) + " 1633874400123"
+        self.assertEqual(data.decode().split("\n")[0], expected)
+        self.assertEqual(data.decode().split("\n")[1], "prices price=2.0 1633874400123")
+
+    def test_undeclared_tags(self):
+        """Test the keys of a row which aren't declared fields are its tags when no tags are declared"""
+        encoder = LineProtocolEncoder("prices", fields=[("price", float)])
+        rows = [{"symbol": "BTC", "exchange": "a b", "price": 1.5}]
+        items = [{"tags": {"symbol": "BTC", "exchange": "a b"}, "fields": {"price": 1.5}}]
+        data, _ = encoder.encode(rows, timestamp=False)
+        self.assertEqual(data, b"prices,exchange=a\\ b,symbol=BTC price=1.5")
+        self.assertEqual(data, encoder.encode_items(items, timestamp=False)[0])
+
+    def test_dynamic_types(self):
+        """Test the encoder without declared fields picks the formatter per value"""
+        encoder = LineProtocolEncoder("prices", precision=WritePrecision.S)
+        items = [{"tags": {"b": "1", "a": "2"}, "fields": {"i": 1, "f": 1.5, "b": True}}]
+        data, _ = encoder.encode_items(items, timestamp=False)
+        self.assertEqual(data, b"prices,a=2,b=1 i=1i,f=1.5,b=true")
@@ -1,8 +1,12 @@
+import json
+import pickle
 import unittest
 from unittest.mock import patch
 from influxdb_client.client.flux_table import FluxRecord, FluxTable
+from rest_framework.utils.encoders import JSONEncoder
 
 from .mocks import MockInfluxClient, MOCK_RECORD
+from django_influxdb import exceptions
 from django_influxdb.models import InfluxModel
 from django.conf import settings
 
@@ -54,3 +58,145 @@ class TestInfluxModel(unittest.TestCase):
         self.model.field = MOCK_RECORD["_field"]
         self.model.save()
         self.assertTrue(mock.called)
+
+
+class TestResultRecords(unittest.TestCase):
+    """Test the single pass cleaning into compact records"""
+
+    def setUp(self):
+        self.model = InfluxModel()
+        self.model.influx_tags = ["symbol"]
+        self.model.fields = [{"name": "price", "type": float}, {"name": "volume", "type": float}]
+
+    def get_tables(self):
+        tables = []
+        for i, field in enumerate(["price", "volume"]):
+            t = FluxTable()
+            t.records = []
+            for value in range(3):
+                r = FluxRecord(table=i)
+                r.values = {"_time": value, "_field": field, "_value": value, "symbol": "BTC", "_start": 0}
+                t.records.append(r)
+            tables.append(t)
+        return tables
+
+    def test_clean_results(self):
+        """Test the unpivoted field value is set on its model field"""
+        self.model._flatten_results(self.get_tables())
+        results = self.model.clean_results()
+        self.assertEqual(len(results), 6)
+        self.assertEqual(dict(results[0]), {"timestamp": 0, "symbol": "BTC", "price": 0, "volume": None})
+        self.assertEqual(dict(results[-1]), {"timestamp": 2, "symbol": "BTC", "price": None, "volume": 2})
+
+    def test_record(self):
+        """Test the record behaves like a read only dict"""
+        result = self.model._clean_result(self.get_tables()[0].records[1])
+        self.assertEqual(result, {"timestamp": 1, "symbol": "BTC", "price": 1, "volume": None})
+        self.assertEqual(result.get("missing"), None)
+        self.assertEqual(list(result), ["timestamp", "symbol", "price", "volume"])
+        self.assertEqual(pickle.loads(pickle.dumps(result)), result)
+        self.assertEqual(json.loads(JSONEncoder().encode(result))["price"], 1)
+
+
+class TestModelSchema(unittest.TestCase):
+    """Test the schema compiled when the model class is defined"""
+
+    def get_model(self, **attrs):
+        attrs = {"measurement": "prices", "required_influx_tags": ["symbol"],
+                 "optional_influx_tags": ["exchange"], "fields": [{"name": "price", "type": float}], **attrs}
+        return type("Price", (InfluxModel,), attrs)
+
+    def test_declaration_errors(self):
+        with self.assertRaises(exceptions.InvalidModelSchema):
+            self.get_model(fields=[{"name": "price"}])
+        with self.assertRaises(exceptions.InvalidModelSchema):
+            self.get_model(fields=[{"name": "price", "type": "float"}])
+        with self.assertRaises(exceptions.InvalidModelSchema):
+            self.get_model(optional_influx_tags=["symbol"])
+
+    def test_validate(self):
+        model = self.get_model()(data=[{"symbol": "BTC", "price": "1.5"},
+                                       {"symbol": "ETH", "exchange": "binance", "price": 2}])
+        model._validate()
+        self.assertEqual(model.validated_data, [
+            {"tags": {"symbol": "BTC"}, "fields": {"price": 1.5}},
+            {"tags": {"symbol": "ETH", "exchange": "binance"}, "fields": {"price": 2.0}}])
+        self.assertEqual(model.influx_tags, ["symbol", "exchange"])
+
+    def test_missing_values(self):
+        model = self.get_model()
+        with self.assertRaisesRegex(KeyError, "Missing required tag symbol"):
+            model(data={"price": 1})._validate()
+        with self.assertRaisesRegex(KeyError, "Missing field: price"):
+            model(data={"symbol": "BTC"})._validate()
+
+    def test_replaced_fields(self):
+        """Test the schema follows the fields replaced on an object"""
+        model = self.get_model()()
+        model.fields = [{"name": "volume", "type": int}]
+        self.assertEqual(model._generate_fields({"volume": "3"}), {"volume": 3})
+
+
+class TestBulkSave(unittest.TestCase):
+    """Test the chunked bulk writes"""
+
+    class Price(InfluxModel):
+        measurement = "prices"
+        bucket = "test"
+        required_influx_tags = ["symbol"]
+        fields = [{"name": "price", "type": float}]
+
+    def setUp(self):
+        patcher = patch("django_influxdb.models.InfluxClient")
+        self.client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def get_items(self, count: int):
+        for i in range(count):
+            yield {"symbol": "BTC", "price": i, "timestamp": 1600000000000 + i}
+
+    def test_chunks(self):
+        stats = self.Price.bulk_save(self.get_items(25), batch_size=10, sync=True)
+        self.assertEqual([s["points"] for s in stats], [10, 10, 5])
+        self.assertEqual(self.client.write.call_count, 3)
+        kwargs = self.client.write.call_args[1]
+        self.assertTrue(kwargs["sync"])
+        self.assertEqual(kwargs["data"][0], {"tags": {"symbol": "BTC"}, "fields": {"price": 20.0},
+                                             "time": 1600000000020})
+
+    def test_concurrent(self):
+        stats = self.Price.bulk_save(self.get_items(100), batch_size=10, concurrency=4)
+        self.assertEqual([s["chunk"] for s in stats], list(range(10)))
+        self.assertEqual(sum(s["points"] for s in stats), 100)
+        # Synchronous by default - the backfill can't overflow the write buffer
+        self.assertTrue(self.client.write.call_args[1]["sync"])
+
+    def test_invalid_item(self):
+        with self.assertRaises(KeyError):
+            self.Price.bulk_save([{"price": 1}])
+
+
+class TestAggregations(unittest.TestCase):
+    """Test the declared aggregations"""
+
+    class Candle(InfluxModel):
+        measurement = "prices"
+        bucket = "test"
+        required_influx_tags = ["symbol"]
+        fields = [{"name": "price", "type": float}]
+        aggregations = {"ohlc": {"open": ("price", "first"), "close": ("price", "last")}}
+
+    def test_declaration_error(self):
+        with self.assertRaises(exceptions.InvalidAggregation):
+            type("Candle", (InfluxModel,), {"aggregations": {"ohlc": "first_and_last"}})
+
+    @patch("django_influxdb.models.InfluxClient")
+    def test_pivoted_columns(self, mock):
+        table = FluxTable()
+        record = FluxRecord(table=0)
+        record.values = {"_time": 1, "_start": 0, "symbol": "BTC", "open": 1.0, "close": 2.0}
+        table.records = [record]
+        mock.return_value.query.return_value = [table]
+        results = self.Candle(data={"symbol": "BTC"}).filter("1d", aggregate="1h", aggregation="ohlc")
+        self.assertEqual(mock.return_value.aggregation, self.Candle._aggregations["ohlc"])
+        self.assertEqual(dict(results[0]), {"timestamp": 1, "symbol": "BTC", "open": 1.0, "close": 2.0})
@@ -0,0 +1,99 @@
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from django_influxdb import exceptions
+from django_influxdb.models import InfluxModel
+from django_influxdb.preaggregation import RollupBuffer
+
+
+class Gauge(InfluxModel):
+    measurement = "prices"
+    bucket = "test"
+    required_influx_tags = ["symbol"]
+    optional_influx_tags = ["exchange"]
+    fields = [{"name": "price", "type": float}, {"name": "volume", "type": int}]
+    pre_aggregation = {"interval": "10s", "fields": {"price": "mean", "high": ("price", "max"),
+                                                     "volume": "sum", "trades": ("price", "count")}}
+
+
+class TestPreAggregation(unittest.TestCase):
+    """Test the in-memory rollups of the saved points"""
+
+    def get_rows(self, *items):
+        return [Gauge._schema.validate_row(item) for item in items]
+
+    def test_declaration_errors(self):
+        attrs = {"measurement": "prices", "fields": [{"name": "price", "type": float}]}
+        for declaration in ({"interval": "1mo", "fields": {"price": "mean"}}, {"interval": "10s"},
+                            {"interval": "10s", "fields": {"price": "median"}},
+                            {"interval": "10s", "fields": {"high": ("volume", "max")}}):
+            with self.assertRaises(exceptions.InvalidModelSchema):
+                type("Price", (InfluxModel,), {**attrs, "pre_aggregation": declaration})
+
+    def test_aggregate(self):
+        """Test 1 point is built per series and window, stamped with the window stop"""
+        buffer = RollupBuffer(Gauge)
+        buffer.add(self.get_rows({"symbol": "BTC", "price": 1, "volume": 2, "timestamp": 1600000000000},
+                                 {"symbol": "BTC", "price": 3, "volume": 5, "timestamp": 1600000009999},
+                                 {"symbol": "ETH", "price": 7, "volume": 1, "timestamp": 1600000001000},
+                                 {"symbol": "BTC", "price": 4, "volume": 1, "timestamp": 1600000010000}))
+        points = buffer.take(everything=True)
+        self.assertEqual(points, [
+            {"tags": {"symbol": "BTC"}, "fields": {"price": 2.0, "high": 3.0, "volume": 7, "trades": 2},
+             "time": 1600000010000},
+            {"tags": {"symbol": "ETH"}, "fields": {"price": 7.0, "high": 7.0, "volume": 1, "trades": 1},
+             "time": 1600000010000},
+            {"tags": {"symbol": "BTC"}, "fields": {"price": 4.0, "high": 4.0, "volume": 1, "trades": 1},
+             "time": 1600000020000}])
+        self.assertEqual(buffer.encoder.encode_items(points[:1])[0],
+                         b"prices,symbol=BTC high=3.0,price=2.0,trades=2i,volume=7i 1600000010000")
+        self.assertEqual(buffer.take(everything=True), [])
+
+    def test_late_point(self):
+        """Test a late point is merged into the written window and the merged aggregates are written again"""
+        model = type("Gauge", (Gauge,), {"pre_aggregation": {**Gauge.pre_aggregation, "grace": "1h"}})
+        buffer = RollupBuffer(model)
+        moment = int(time.time() * 1000) - 60000
+        buffer.add(self.get_rows(*({"symbol": "BTC", "price": 1, "volume": 10, "timestamp": moment}
+                                   for _ in range(100))))
+        self.assertEqual(buffer.take()[0]["fields"],
+                         {"price": 1.0, "high": 1.0, "volume": 1000, "trades": 100})
+        self.assertEqual(buffer.take(), [])
+        buffer.add(self.get_rows({"symbol": "BTC", "price": 3, "volume": 10, "timestamp": moment}))
+        points = buffer.take()
+        self.assertEqual(len(points), 1)
+        self.assertEqual(points[0]["fields"],
+                         {"price": 103 / 101, "high": 3.0, "volume": 1010, "trades": 101})
+        # Older than the grace period
+        buffer.add(self.get_rows({"symbol": "BTC", "price": 3, "volume": 10, "timestamp": 1600000000000}))
+        self.assertEqual(buffer.take(), [])
+        self.assertEqual(buffer.dropped_points, 1)
+
+    def test_unfinished_window(self):
+        """Test the current window is kept until it's over"""
+        buffer = RollupBuffer(Gauge)
+        buffer.add(self.get_rows({"symbol": "BTC", "price": 1, "volume": 2},
+                                 {"symbol": "BTC", "price": 1, "volume": 2, "timestamp": 1600000000000}))
+        self.assertEqual(len(buffer.take()), 1)
+        self.assertEqual(len(buffer.take(everything=True)), 1)
+
+    @patch("django_influxdb.preaggregation.Client")
+    def test_flush(self, client):
+        buffer = RollupBuffer(Gauge)
+        buffer.add(self.get_rows({"symbol": "BTC", "price": 1, "volume": 2, "timestamp": 1600000000000}))
+        self.assertEqual(buffer.flush(), 1)
+        client.assert_called_once_with("prices", bucket="test", using="default")
+        client.return_value.write.assert_called_once()
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_save(self):
+        """Test save adds the points to the buffer of the model instead of writing them"""
+        buffers = MagicMock()
+        with patch("django_influxdb.models.rollup_buffers", buffers), \
+                patch("django_influxdb.models.InfluxClient") as client:
+            Gauge(data={"symbol": "BTC", "price": 1, "volume": 2}).save()
+        client.assert_not_called()
+        buffers.__getitem__.assert_called_once_with(Gauge)
+        buffers.__getitem__.return_value.add.assert_called_once_with(
+            [{"tags": {"symbol": "BTC"}, "fields": {"price": 1.0, "volume": 2}}])
@@ -0,0 +1,50 @@
+import unittest
+from unittest.mock import patch
+from django.core.paginator import Paginator
+
+from .mocks import MockInfluxClient
+from .test_views import PriceModel
+
+
+class TestInfluxQuerySet(unittest.TestCase):
+    """Test the lazy queryset with a mocked InfluxDB client"""
+
+    def setUp(self):
+        patcher = patch("django_influxdb.models.InfluxClient")
+        self.client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.client.query.side_effect = MockInfluxClient.query
+        self.client.count.return_value = 95
+        self.queryset = PriceModel.objects.filter(symbol="BTC").range("1d").aggregate("1h")
+
+    def test_lazy(self):
+        """Test nothing is queried before evaluation"""
+        queryset = self.queryset.order_by("-timestamp")[10:20]
+        self.assertFalse(self.client.query.called)
+        self.assertEqual(len(list(queryset)), 1)
+        kwargs = self.client.query.call_args[1]
+        self.assertEqual(kwargs["limit"], 10)
+        self.assertEqual(kwargs["offset"], 10)
+        self.assertEqual(kwargs["aggregate"], "1h")
+        self.assertEqual(kwargs["tags"], {"symbol": "BTC"})
+
+    def test_chained_slices(self):
+        queryset = self.queryset[10:50][5:100]
+        self.assertEqual((queryset.offset, queryset.limit), (15, 35))
+
+    def test_count(self):
+        """Test the count is pushed down and the slice is applied on it"""
+        self.assertEqual(self.queryset.count(), 95)
+        self.assertEqual(self.queryset[90:100].count(), 5)
+        self.assertFalse(self.client.query.called)
+
+    def test_paginator(self):
+        """Test the Django paginator fetches only the requested page"""
+        page = Paginator(self.queryset, 10).page(3)
+        self.assertEqual(len(page), 1)
+        kwargs = self.client.query.call_args[1]
+        self.assertEqual((kwargs["offset"], kwargs["limit"]), (20, 10))
+
+    def test_mixed_ordering(self):
+        with self.assertRaises(ValueError):
+            self.queryset.order_by("symbol", "-timestamp")
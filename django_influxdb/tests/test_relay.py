@@ -0,0 +1,105 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+from django_influxdb import exceptions
+from django_influxdb.relay import RelaySender, RelayServer, decode_datagram, encode_frame, parse_address
+
+
+class TestRelay(unittest.TestCase):
+    """Test the write relay over a Unix socket"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.address = os.path.join(directory.name, "relay.sock")
+        self.writer = MagicMock()
+        self.server = RelayServer(self.writer, address=self.address, bucket="default", org="org")
+        self.addCleanup(self.server.close)
+        self.received = threading.Semaphore(0)
+        handle = self.server.handle
+
+        def handle_and_count(datagram):
+            handle(datagram)
+            self.received.release()
+        self.server.handle = handle_and_count
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+
+    def wait(self, count: int = 1):
+        for _ in range(count):
+            self.assertTrue(self.received.acquire(timeout=5))
+
+    def get_sender(self, **options):
+        sender = RelaySender(address=self.address, **options)
+        self.addCleanup(sender.close)
+        return sender
+
+    def test_frame(self):
+        frame = encode_frame("bucket", "org", "ms", b"m v=1\nm v=2", 2)
+        self.assertEqual(decode_datagram(frame), (("bucket", "org", "ms"), b"m v=1\nm v=2", 2))
+
+    def test_plain_line_protocol(self):
+        self.assertEqual(decode_datagram(b"m v=1\nm v=2\n", "bucket", "org"),
+                         (("bucket", "org", "ns"), b"m v=1\nm v=2", 2))
+        with self.assertRaises(ValueError):
+            decode_datagram(b"m v=1")
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address("udp://127.0.0.1:8095")[1], ("127.0.0.1", 8095))
+        self.assertEqual(parse_address("udp://[::1]:8095")[1], ("::1", 8095))
+        self.assertEqual(parse_address("/tmp/relay.sock")[1], "/tmp/relay.sock")
+
+    def test_relay(self):
+        """Test the points sent by a sender are handed to the relay writer"""
+        self.get_sender().write("bucket", "org", b"m v=1", points=1, precision="ms")
+        self.wait()
+        self.writer.write.assert_called_once_with("bucket", "org", b"m v=1", points=1, precision="ms")
+        self.assertEqual(self.server.stats["points"], 1)
+
+    def test_split(self):
+        """Test the data bigger than a datagram is split on line boundaries"""
+        data = b"\n".join(f"measurement value={i}".encode() for i in range(100))
+        self.get_sender(max_datagram=200, send_timeout=5).write("bucket", "org", data, points=100)
+        while self.server.stats["points"] < 100:
+            self.wait()
+        chunks = [i[0][2] for i in self.writer.write.call_args_list]
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b"\n".join(chunks), data)
+        self.assertEqual(sum(i[1]["points"] for i in self.writer.write.call_args_list), 100)
+
+    def test_malformed(self):
+        self.server.handle(b"\x00\x01")
+        self.assertEqual(self.server.stats["errors"], 1)
+        self.writer.write.assert_not_called()
+
+    def test_buffer_full(self):
+        """Test the relay keeps running when the upstream buffer is full"""
+        self.writer.write.side_effect = exceptions.WriteBufferFull("full")
+        self.server.handle(encode_frame("bucket", "org", "ms", b"m v=1\nm v=2", 2))
+        self.assertEqual(self.server.stats["dropped"], 2)
+        self.wait()
+        self.writer.write.side_effect = None
+        self.get_sender().write("bucket", "org", b"m v=3")
+        self.wait()
+        self.assertEqual(self.server.stats["points"], 3)
+
+    def test_unreachable(self):
+        """Test the points are written directly when the relay isn't running"""
+        writer = MagicMock()
+        with patch("django_influxdb.writer.writers", {"default": writer}):
+            RelaySender(address=self.address + ".missing").write("bucket", "org", b"m v=1")
+        writer.write.assert_called_once_with("bucket", "org", b"m v=1", points=1, precision="ms")
+
+    def test_busy(self):
+        """Test a full relay queue doesn't block - the points are written directly"""
+        sender = self.get_sender()
+        self.assertFalse(sender._socket.getblocking())
+        writer = MagicMock()
+        with patch.object(sender, "_socket") as sender_socket, \
+                patch("django_influxdb.writer.writers", {"default": writer}):
+            sender_socket.sendto.side_effect = BlockingIOError
+            sender.write("bucket", "org", b"m v=1")
+        writer.write.assert_called_once_with("bucket", "org", b"m v=1", points=1, precision="ms")
@@ -0,0 +1,45 @@
+import json
+import unittest
+from datetime import datetime, timezone
+from rest_framework.renderers import JSONRenderer
+
+from django_influxdb.records import make_record
+from django_influxdb.renderers import ColumnarJSONRenderer, CSVRenderer, FastJSONRenderer, NDJSONRenderer
+
+TIME = datetime(2021, 1, 1, 12, 30, tzinfo=timezone.utc)
+
+
+def get_rows():
+    keys = ("timestamp", "symbol", "price")
+    return [make_record(keys, (TIME, "BTC", 25000.5)), make_record(keys, (TIME, "ÉTH", None)),
+            make_record(("timestamp", "symbol", "volume"), (TIME, 'say "hi"', 3)),
+            {"timestamp": TIME, "symbol": "LTC", "price": 100}]
+
+
+class TestRenderers(unittest.TestCase):
+
+    def test_fast_json(self):
+        rows = get_rows()
+        self.assertEqual(FastJSONRenderer().render(rows), JSONRenderer().render(rows))
+        page = {"count": 4, "next": "http://testserver/?page=2", "previous": None, "results": rows}
+        self.assertEqual(FastJSONRenderer().render(page), JSONRenderer().render(page))
+        self.assertEqual(FastJSONRenderer().render("Bad request"), JSONRenderer().render("Bad request"))
+
+    def test_columnar(self):
+        content = json.loads(ColumnarJSONRenderer().render(get_rows()))
+        self.assertEqual(list(content), ["timestamp", "symbol", "price", "volume"])
+        self.assertEqual(content["price"], [25000.5, None, None, 100])
+        self.assertEqual(content["volume"], [None, None, 3, None])
+        self.assertEqual(content["timestamp"][0], "2021-01-01T12:30:00Z")
+        page = json.loads(ColumnarJSONRenderer().render({"count": 4, "results": get_rows()}))
+        self.assertEqual(page["results"]["symbol"][-1], "LTC")
+
+    def test_ndjson(self):
+        lines = NDJSONRenderer().render(get_rows()).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], json.loads(JSONRenderer().render(get_rows())))
+
+    def test_csv(self):
+        lines = CSVRenderer().render(get_rows()).decode().splitlines()
+        self.assertEqual(lines[0], "timestamp,symbol,price,volume")
+        self.assertEqual(lines[1], "2021-01-01T12:30:00Z,BTC,25000.5,")
+        self.assertEqual(lines[3], '2021-01-01T12:30:00Z,"say ""hi""",,3')
@@ -0,0 +1,75 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from .mocks import MockInfluxClient
+from .test_views import PriceModel
+from django_influxdb import exceptions
+from django_influxdb.durations import parse_time
+from django_influxdb.routing import compile_rollups, route
+
+ROLLUPS = [{"bucket": "prices_1h", "resolution": "1h", "retention": "90d"},
+           {"bucket": "prices_1d", "resolution": "1d", "retention": "3650d"}]
+
+
+class RolledUpPriceModel(PriceModel):
+    rollups = ROLLUPS
+
+
+class TestRouting(unittest.TestCase):
+    """Test the routing of queries to the rollup buckets"""
+
+    def setUp(self):
+        self.rollups = compile_rollups(ROLLUPS)
+
+    def test_compile(self):
+        self.assertEqual([r.bucket for r in self.rollups], ["prices_1d", "prices_1h"])
+        self.assertEqual(self.rollups[0].shift, timedelta(days=1))
+        with self.assertRaises(exceptions.InvalidModelSchema):
+            compile_rollups([{"bucket": "prices_1h"}])
+        with self.assertRaises(exceptions.InvalidModelSchema):
+            compile_rollups([{"bucket": "prices_1h", "resolution": "1h", "retention": "forever"}])
+
+    def test_fine_aggregate(self):
+        """Test aggregates finer than the rollups are read from the raw bucket"""
+        self.assertEqual(route("prices", self.rollups, "365d", "now()", "5m"),
+                         [("prices", "365d", "now()", None)])
+
+    def test_tiers(self):
+        routes = route("prices", self.rollups, "365d", "now()", "1d")
+        self.assertEqual(routes[0].bucket, "prices_1d")
+        self.assertEqual(routes[-1].bucket, "prices")
+        self.assertEqual(routes[-1].time_stop, "now()")
+        # The routes are consecutive once the shift is applied and aligned to the windows
+        for previous, following in zip(routes, routes[1:]):
+            stop = parse_time(previous.time_stop) - (previous.shift or timedelta())
+            start = parse_time(following.time_start) - (following.shift or timedelta())
+            self.assertEqual(stop, start)
+            self.assertEqual(stop.hour, 0)
+
+    def test_retention(self):
+        """Test ranges older than a rollup retention aren't routed to it"""
+        routes = route("prices", self.rollups, "200d", "30d", "1h")
+        self.assertEqual([r.bucket for r in routes], ["prices", "prices_1h"])
+
+    def test_single(self):
+        start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        now = datetime.now(timezone.utc)
+        time_start = (now - timedelta(days=30)).replace(hour=0, minute=0, second=0, microsecond=0)
+        time_stop = time_start + timedelta(days=10)
+        routes = route("prices", self.rollups, time_start.isoformat(), time_stop.isoformat(), "1h",
+                       single=True)
+        self.assertEqual(len(routes), 1)
+        self.assertEqual(routes[0].bucket, "prices_1h")
+        self.assertEqual(parse_time(routes[0].time_start), time_start + timedelta(hours=1))
+        routes = route("prices", self.rollups, start.isoformat(), "now()", "1h", single=True)
+        self.assertEqual(routes[0].bucket, "prices")
+
+    def test_model(self):
+        with patch("django_influxdb.models.InfluxClient") as client:
+            client.return_value.query.side_effect = MockInfluxClient.query
+            RolledUpPriceModel(data={"symbol": "BTC"}).filter("365d", aggregate="1d")
+        buckets = [c[1]["bucket"] for c in client.call_args_list]
+        self.assertEqual(buckets[0], "prices_1d")
+        self.assertEqual(buckets[-1], "test")
+        self.assertIn("prices_1h", buckets)
@@ -0,0 +1,118 @@
+import asyncio
+import hashlib
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+from django.core.cache import caches
+from django.test import override_settings
+
+from .mocks import MockInfluxClient
+from django_influxdb.fanout import fan_out
+from django_influxdb.influxdb import Client
+from django_influxdb.singleflight import SingleFlight, get_single_flight
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def run_concurrently(self, flight: SingleFlight, function, callers: int = 5) -> list:
+        return list(fan_out(lambda _: flight.do("key", function), range(callers), callers))
+
+    def test_collapsed(self):
+        calls = []
+
+        def query():
+            calls.append(1)
+            time.sleep(0.1)
+            return ["tables"]
+        flight = SingleFlight()
+        results = self.run_concurrently(flight, query)
+        self.assertEqual(results, [["tables"]] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((flight.stats["executed"], flight.stats["collapsed"]), (1, 4))
+        # Later callers run the query again
+        flight.do("key", query)
+        self.assertEqual(len(calls), 2)
+
+    def test_shared_error(self):
+        def query():
+            time.sleep(0.05)
+            raise ValueError("failed")
+        flight = SingleFlight()
+        errors = []
+
+        def call(_):
+            try:
+                flight.do("key", query)
+            except ValueError as e:
+                errors.append(e)
+        list(fan_out(call, range(3), 3))
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(flight.stats["executed"], 1)
+
+    def test_cross_process(self):
+        """Test 2 single flights sharing a Django cache (as 2 processes) run the query once"""
+        caches["default"].clear()
+        started = threading.Event()
+        calls = []
+
+        def query():
+            calls.append(1)
+            started.set()
+            time.sleep(0.1)
+            return ["tables"]
+        first = SingleFlight(cache="default", poll_interval=0.01)
+        second = SingleFlight(cache="default", poll_interval=0.01)
+        leader = threading.Thread(target=first.do, args=("key", query))
+        leader.start()
+        started.wait()
+        self.assertEqual(second.do("key", query), ["tables"])
+        leader.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(second.stats["remote_hits"], 1)
+
+    def test_expired_lock(self):
+        """Test a leader whose lock expired doesn't release the lock of the next leader"""
+        cache = caches["default"]
+        cache.clear()
+        flight = SingleFlight(cache="default")
+        lock_key = f"{flight.key_prefix}:lock:{hashlib.sha256(repr('key').encode()).hexdigest()}"
+
+        def query():
+            # The lock expires and another process takes it while the query runs
+            cache.set(lock_key, "other", 30)
+            return ["tables"]
+        self.assertEqual(flight.do("key", query), ["tables"])
+        self.assertEqual(cache.get(lock_key), "other")
+
+    def test_async(self):
+        calls = []
+
+        async def query():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return ["tables"]
+
+        async def run():
+            return await asyncio.gather(*(flight.ado("key", query) for _ in range(5)))
+        flight = SingleFlight()
+        self.assertEqual(asyncio.run(run()), [["tables"]] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats["collapsed"], 4)
+
+    def test_client(self):
+        with override_settings(INFLUXDB_SINGLE_FLIGHT=True):
+            flight = get_single_flight()
+
+            def query(_):
+                client = Client(measurement="prices", use_cache=False)
+                client.client = MagicMock()
+
+                def run(*args, **kwargs):
+                    time.sleep(0.1)
+                    return MockInfluxClient.query(None, None)
+                client.client.query_api.return_value.query.side_effect = run
+                return client.query(time_start="1h", tags={"symbol": "BTC"})
+            list(fan_out(query, range(4), 4))
+            self.assertEqual((flight.stats["executed"], flight.stats["collapsed"]), (1, 3))
+        self.assertIsNone(get_single_flight())
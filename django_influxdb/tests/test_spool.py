@@ -0,0 +1,149 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+from django.test import override_settings
+from influxdb_client.rest import ApiException
+
+from django_influxdb.influxdb import Client
+from django_influxdb.spool import DiskSpool, Segment, HEADER
+from django_influxdb import exceptions
+
+
+class TestDiskSpool(unittest.TestCase):
+    """Test the durable disk spool"""
+
+    def setUp(self):
+        patcher = patch("django_influxdb.spool.connections")
+        self.connections = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.write_api = MagicMock()
+        self.connections.__getitem__.return_value.write_api.return_value = self.write_api
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def get_spool(self, **options):
+        options = {"segment_size": 4096, "retry_interval": 0, "directory": self.directory, **options}
+        spool = DiskSpool(**options)
+        self.addCleanup(spool.close)
+        return spool
+
+    def test_flush(self):
+        """Test the spooled records of a bucket are sent together"""
+        spool = self.get_spool()
+        spool._start = lambda: None
+        spool.write("bucket", "org", b"m v=1")
+        spool.write("bucket", "org", b"m v=2", points=1)
+        spool.write("other", "org", b"m v=3")
+        del spool._start
+        self.assertTrue(spool.flush(timeout=5))
+        writes = [(i[0][0], i[0][2]) for i in self.write_api.write.call_args_list]
+        self.assertEqual(writes, [("bucket", b"m v=1\nm v=2"), ("other", b"m v=3")])
+
+    def test_replay(self):
+        """Test the points which weren't sent are replayed by the next spool"""
+        spool = self.get_spool()
+        spool._start = lambda: None
+        spool.write("bucket", "org", b"m v=1")
+        spool.close()
+        self.write_api.write.assert_not_called()
+        spool = self.get_spool()
+        self.assertTrue(spool.flush(timeout=5))
+        self.write_api.write.assert_called_once()
+        self.assertEqual(self.write_api.write.call_args[0][2], b"m v=1")
+        spool.close()
+        # Acknowledged records aren't sent again
+        self.assertTrue(self.get_spool().flush(timeout=5))
+        self.write_api.write.assert_called_once()
+
+    def test_rotation(self):
+        """Test the records are spread over segments and the drained segments are deleted"""
+        spool = self.get_spool(segment_size=256, batch_size=1)
+        spool._start = lambda: None
+        for i in range(20):
+            spool.write("bucket", "org", f"measurement value={i}".encode())
+        self.assertGreater(len(spool._segments), 1)
+        del spool._start
+        self.assertTrue(spool.flush(timeout=5))
+        self.assertEqual(self.write_api.write.call_count, 20)
+        self.assertEqual(self.write_api.write.call_args[0][2], b"measurement value=19")
+        self.assertEqual(len([i for i in os.listdir(spool.directory) if i.endswith(".spool")]), 1)
+
+    def test_retry(self):
+        """Test a failed batch is retried until it's written"""
+        self.write_api.write.side_effect = [Exception("down"), Exception("down"), None]
+        spool = self.get_spool()
+        spool.write("bucket", "org", b"m v=1")
+        self.assertTrue(spool.flush(timeout=5))
+        self.assertEqual(self.write_api.write.call_count, 3)
+
+    def test_rejected(self):
+        """Test a batch rejected for good is handed to the error callback and the next batches are sent"""
+        self.write_api.write.side_effect = [ApiException(status=400, reason="field type conflict"), None]
+        error_callback = MagicMock()
+        spool = self.get_spool(error_callback=error_callback)
+        spool._start = lambda: None
+        spool.write("bad", "org", b"m v=1")
+        spool.write("good", "org", b"m v=2")
+        del spool._start
+        self.assertTrue(spool.flush(timeout=5))
+        self.assertEqual(self.write_api.write.call_count, 2)
+        self.assertEqual(error_callback.call_args[0][:2], (("bad", "org", "ms"), b"m v=1"))
+
+    def test_spool_full(self):
+        spool = self.get_spool(segment_size=128, max_segments=2)
+        spool._start = lambda: None
+        with self.assertRaises(exceptions.WriteBufferFull):
+            for i in range(20):
+                spool.write("bucket", "org", f"measurement value={i}".encode())
+
+    def test_lanes(self):
+        """Test concurrent spools of an alias use separate lanes"""
+        self.assertNotEqual(self.get_spool().directory, self.get_spool().directory)
+
+    def test_abandoned_lane(self):
+        """Test the lane of a stopped process is replayed when fewer processes come back"""
+        first, second = self.get_spool(), self.get_spool()
+        second._start = lambda: None
+        second.write("bucket", "org", b"m v=1")
+        self.assertTrue(second.directory.endswith("lane-1"))
+        first.close()
+        second.close()
+        spool = self.get_spool()
+        self.assertTrue(spool.directory.endswith("lane-0"))
+        spool.write("bucket", "org", b"m v=2")
+        for _ in range(500):
+            if self.write_api.write.call_count == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(sorted(i[0][2] for i in self.write_api.write.call_args_list), [b"m v=1", b"m v=2"])
+        spool.close()
+        # The replayed points aren't sent again
+        spool = self.get_spool()
+        spool.write("bucket", "org", b"m v=3")
+        self.assertTrue(spool.flush(timeout=5))
+        time.sleep(0.1)
+        self.assertEqual(self.write_api.write.call_count, 3)
+
+    def test_torn_record(self):
+        """Test a record with a bad checksum ends the segment"""
+        spool = self.get_spool()
+        spool._start = lambda: None
+        spool.write("bucket", "org", b"m v=1")
+        spool.write("bucket", "org", b"m v=2")
+        segment = spool._segments[0]
+        end = segment.end
+        segment._mmap[end - 1:end] = b"X"
+        self.assertEqual(Segment(segment.path, 4096).end, end - HEADER.size - len(b"bucket\norg\nms\nm v=2"))
+
+    @override_settings(INFLUXDB_WRITE_MODE="spool")
+    def test_client_write(self):
+        """Test Client.write appends to the spool in the spool mode"""
+        spool = MagicMock()
+        with patch("django_influxdb.influxdb.spools", {"default": spool}):
+            Client(measurement="m", bucket="bucket").write([{"tags": {"tag": "a"}, "fields": {"value": 1}}],
+                                                           timestamp=False)
+        spool.write.assert_called_once()
+        self.assertEqual(spool.write.call_args[0][2], b"m,tag=a value=1i")
@@ -0,0 +1,109 @@
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+from django.test import override_settings
+from influxdb_client import Task
+from influxdb_client.rest import ApiException
+
+from django_influxdb import exceptions
+from django_influxdb.models import InfluxTasks
+from django_influxdb.tasks import EveryTask, MetadataIndex, get_environment
+
+FLUX = 'from(bucket: "prices") |> range(start: -1h) |> to(bucket: "prices_1h")'
+
+
+def get_task(task_id: str, name: str, flux: str = FLUX, every: str = "1h") -> Task:
+    flux = f'{flux} \n\noption task = {{name: "{name}", every: {every}}}'
+    return Task(id=task_id, name=name, org_id="org", flux=flux, every=every)
+
+
+class TestTaskSync(unittest.TestCase):
+    """Test the metadata index and the task sync with a mocked InfluxDB client"""
+
+    def setUp(self):
+        patcher = patch("django_influxdb.tasks.connections")
+        connections = patcher.start()
+        self.addCleanup(patcher.stop)
+        connections.settings.return_value = {"ORG": "org"}
+        self.client = connections.__getitem__.return_value
+        org = MagicMock(id="org")
+        org.name = "org"
+        self.client.organizations_api.return_value.find_organizations.return_value = [org]
+        self.client.buckets_api.return_value.find_buckets.return_value.buckets = []
+        self.tasks_api = self.client.tasks_api.return_value
+        pages = [[get_task(str(i), f"task{i}") for i in range(2)], [get_task("2", "task2")]]
+        self.tasks_api.find_tasks.side_effect = lambda **kwargs: pages.pop(0)
+
+    def get_index(self) -> MetadataIndex:
+        with patch.object(MetadataIndex, "task_page_size", 2):
+            return MetadataIndex()
+
+    def test_index(self):
+        index = self.get_index()
+        self.assertEqual(sorted(index.tasks), ["task0", "task1", "task2"])
+        self.assertEqual(self.tasks_api.find_tasks.call_args[1], {"limit": 2, "after": "1"})
+        self.assertEqual(index.org.id, "org")
+        index.org_name = "other"
+        with self.assertRaises(exceptions.NonExistingOrg):
+            index.org
+
+    def test_page_limits(self):
+        """InfluxDB accepts at most 100 orgs or buckets per page and lists the orgs by offset"""
+        def get_items(items, limit, offset=0, after=None):
+            if not 1 <= limit <= 100:
+                raise ApiException(status=400, reason="limit must be between 1 and 100")
+            start = offset if after is None else int(after) + 1
+            return items[start:start + limit]
+
+        orgs = [MagicMock(id=str(i)) for i in range(150)]
+        for org in orgs:
+            org.name = f"org{org.id}"
+        buckets = [MagicMock(id=str(i)) for i in range(250)]
+        for bucket in buckets:
+            bucket.name = f"bucket{bucket.id}"
+        self.client.organizations_api.return_value.find_organizations.side_effect = \
+            lambda limit, offset=0: get_items(orgs, limit, offset=offset)
+        self.client.buckets_api.return_value.find_buckets.side_effect = \
+            lambda limit, after=None: MagicMock(buckets=get_items(buckets, limit, after=after))
+        index = MetadataIndex()
+        self.assertEqual(len(index.orgs), 150)
+        self.assertEqual(len(index.buckets), 250)
+        index.org_name = "org149"
+        self.assertEqual(index.org.id, "149")
+
+    def test_sync(self):
+        index = self.get_index()
+        unchanged = InfluxTasks(name="task0", flux=FLUX, task_interval="1h", destination_bucket="prices_1h")
+        self.assertEqual(EveryTask("task0", index=index).sync(unchanged), ("unchanged", []))
+        changed = InfluxTasks(name="task1", flux=FLUX, task_interval="5m", destination_bucket="prices_1h")
+        action, diff = EveryTask("task1", index=index).sync(changed, dry_run=True)
+        self.assertEqual((action, diff), ("update", ["-every: 1h", "+every: 5m"]))
+        self.assertFalse(self.tasks_api.update_task.called)
+        EveryTask("task1", index=index).sync(changed)
+        self.assertEqual(self.tasks_api.update_task.call_args[0][0].every, "5m")
+
+    def test_create(self):
+        index = self.get_index()
+        new = InfluxTasks(name="task3", flux=FLUX, task_interval="1h", destination_bucket="prices_1h")
+        action, diff = EveryTask("task3", index=index).sync(new)
+        self.assertEqual(action, "create")
+        self.assertIn("+" + FLUX, diff)
+        self.assertTrue(self.tasks_api.create_task_every.called)
+        self.client.buckets_api.return_value.create_bucket.assert_called_once_with(bucket_name="prices_1h",
+                                                                                   org_id="org")
+        self.assertIn("prices_1h", index.buckets)
+
+
+class TestTemplates(unittest.TestCase):
+
+    def test_environment_cache(self):
+        with patch("django_influxdb.tasks.connections"):
+            task = EveryTask("task", source_bucket='"prices"', filter='filter(fn: (r) => r._value > 0)',
+                             time_start="-1h", destination_bucket="prices_1h", flux_template_folder="missing")
+            flux = task.load_template()
+        self.assertIn('to(bucket: "prices_1h"', flux)
+        self.assertIs(get_environment("missing"), get_environment("missing"))
+        self.assertIsNot(get_environment("missing"), get_environment("other"))
+        with override_settings(INFLUXDB_TEMPLATE_BYTECODE_CACHE=tempfile.gettempdir()):
+            self.assertIsNotNone(get_environment("missing").bytecode_cache)
+        self.assertIsNone(get_environment("missing").bytecode_cache)
@@ -0,0 +1,114 @@
+import json
+from datetime import datetime, timezone
+import unittest
+from unittest.mock import patch
+from rest_framework.test import APIRequestFactory
+
+from .mocks import MockInfluxClient, MOCK_RECORD
+from django_influxdb.models import InfluxModel
+from django_influxdb.views import ListViewSet
+
+
+class PriceModel(InfluxModel):
+    measurement = "prices"
+    bucket = "test"
+    required_influx_tags = ["symbol"]
+    fields = [{"name": "price", "type": float}]
+
+
+class PriceViewSet(ListViewSet):
+    influx_model = PriceModel
+    required_filter_params = ["symbol"]
+    authentication_classes = []
+    permission_classes = []
+
+
+class TestListViewSet(unittest.TestCase):
+    """Test the list viewset with a mocked InfluxDB client"""
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = PriceViewSet.as_view({"get": "list"})
+        patcher = patch("django_influxdb.models.InfluxClient")
+        self.client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.client.query.side_effect = MockInfluxClient.query
+        self.client.query_stream.side_effect = lambda **kw: iter(MockInfluxClient.query(**kw)[0].records)
+
+    def get(self, **params):
+        return self.view(self.factory.get("/prices/", params))
+
+    def test_missing_params(self):
+        response = self.get(time_start="1h")
+        self.assertEqual(response.status_code, 400)
+
+    def test_list(self):
+        response = self.get(time_start="1h", symbol="BTC")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]["price"], MOCK_RECORD["price"])
+
+    def test_stream_json(self):
+        response = self.get(time_start="1h", symbol="BTC", stream="json")
+        self.assertTrue(response.streaming)
+        rows = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(rows[0]["symbol"], "BTC")
+
+    def test_format(self):
+        response = self.get(time_start="1h", symbol="BTC", format="columns")
+        response.render()
+        self.assertEqual(json.loads(response.content)["price"], [MOCK_RECORD["price"]])
+        response = self.get(time_start="1h", symbol="BTC", format="csv")
+        response.render()
+        self.assertEqual(response.content.decode().splitlines()[0], "timestamp,symbol,price")
+
+    def test_conditional_historical(self):
+        params = {"time_start": "2021-01-01T00:00:00Z", "time_stop": "2021-01-02T00:00:00Z", "symbol": "BTC"}
+        response = self.get(**params)
+        self.assertEqual(response["Cache-Control"], "private, max-age=86400")
+        request = self.factory.get("/prices/", params, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.client.query.reset_mock()
+        response = self.view(request)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(self.client.query.called)
+        response = self.view(self.factory.get("/prices/", {**params, "format": "csv"},
+                                              HTTP_IF_NONE_MATCH=response["ETag"]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_relative(self):
+        first = self.get(time_start="1h", symbol="BTC", aggregate="1h")
+        second = self.get(time_start="1h", symbol="BTC", aggregate="1h")
+        self.assertEqual(first["ETag"], second["ETag"])
+        self.assertLessEqual(int(first["Cache-Control"].split("max-age=")[1]), 60)
+        self.assertIn("Accept", first["Vary"])
+        self.assertFalse(self.get(time_start="1h", symbol="BTC", aggregate="5m").has_header("Last-Modified"))
+
+    def test_change_probe(self):
+        view = PriceViewSet.as_view({"get": "list"}, change_probe=True, cache_control="public")
+        self.client.latest_time.return_value = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        response = view(self.factory.get("/prices/", {"time_start": "1h", "symbol": "BTC"}))
+        self.assertEqual(response["Last-Modified"], "Fri, 01 Jan 2021 00:00:00 GMT")
+        self.assertIn("public", response["Cache-Control"])
+        request = self.factory.get("/prices/", {"time_start": "1h", "symbol": "BTC"},
+                                   HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(view(request).status_code, 304)
+        self.client.latest_time.return_value = datetime(2021, 1, 2, tzinfo=timezone.utc)
+        request = self.factory.get("/prices/", {"time_start": "1h", "symbol": "BTC"},
+                                   HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(view(request).status_code, 200)
+
+    def test_stream_ndjson(self):
+        response = self.get(time_start="1h", symbol="BTC", stream="ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])["price"], MOCK_RECORD["price"])
+
+    def test_bad_stream_format(self):
+        response = self.get(time_start="1h", symbol="BTC", stream="xml")
+        self.assertEqual(response.status_code, 400)
+
+    def test_aggregation(self):
+        response = self.get(time_start="1h", symbol="BTC", aggregation="max")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.aggregation, "max")
+        response = self.get(time_start="1h", symbol="BTC", aggregation="nope")
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,100 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from django_influxdb.influxdb import Client
+from django_influxdb.writer import BatchWriter
+from django_influxdb import exceptions
+
+
+class TestBatchWriter(unittest.TestCase):
+    """Test the background batch writer"""
+
+    def setUp(self):
+        patcher = patch("django_influxdb.writer.connections")
+        self.connections = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.write_api = MagicMock()
+        self.connections.__getitem__.return_value.write_api.return_value = self.write_api
+
+    def get_writer(self, **options):
+        options = {"flush_interval": 10000, "retry_interval": 0, **options}
+        writer = BatchWriter(**options)
+        self.addCleanup(writer.close)
+        return writer
+
+    def test_flush(self):
+        """Test the buffered points are sent together on flush"""
+        writer = self.get_writer()
+        writer.write("bucket", "org", b"m v=1")
+        writer.write("bucket", "org", b"m v=2")
+        self.assertTrue(writer.flush(timeout=5))
+        self.write_api.write.assert_called_once()
+        self.assertEqual(self.write_api.write.call_args[0][2], b"m v=1\nm v=2")
+
+    def test_batch_size(self):
+        """Test every write request is limited to the batch size"""
+        writer = self.get_writer(batch_size=2)
+        for i in range(5):
+            writer.write("bucket", "org", f"m v={i}".encode())
+        writer.flush(timeout=5)
+        self.assertEqual(self.write_api.write.call_count, 3)
+
+    def test_group_by_bucket(self):
+        writer = self.get_writer()
+        writer.write("first", "org", b"m v=1")
+        writer.write("second", "org", b"m v=2")
+        writer.flush(timeout=5)
+        buckets = [i[0][0] for i in self.write_api.write.call_args_list]
+        self.assertEqual(buckets, ["first", "second"])
+
+    def test_buffer_full(self):
+        """Test writers get an exception when the buffer stays full"""
+        writer = self.get_writer(buffer_size=1, buffer_timeout=10)
+        writer._start = lambda: None
+        writer.write("bucket", "org", b"m v=1")
+        with self.assertRaises(exceptions.WriteBufferFull):
+            writer.write("bucket", "org", b"m v=2")
+
+    def test_callbacks(self):
+        """Test the retry and error callbacks on a failing write"""
+        self.write_api.write.side_effect = Exception("down")
+        retry_callback = MagicMock()
+        error_callback = MagicMock()
+        writer = self.get_writer(max_retries=1, retry_callback=retry_callback, error_callback=error_callback)
+        writer.write("bucket", "org", b"m v=1")
+        writer.flush(timeout=5)
+        self.assertEqual(retry_callback.call_count, 1)
+        error_callback.assert_called_once()
+
+    def test_success_callback(self):
+        success_callback = MagicMock()
+        writer = self.get_writer(success_callback=success_callback)
+        writer.write("bucket", "org", b"m v=1")
+        writer.flush(timeout=5)
+        success_callback.assert_called_once()
+
+    def test_closed(self):
+        writer = self.get_writer()
+        writer.close()
+        with self.assertRaises(exceptions.WriterClosed):
+            writer.write("bucket", "org", b"m v=1")
+
+
+class TestClientWrite(unittest.TestCase):
+    def setUp(self):
+        self.client = Client(measurement="test-write")
+        self.data = [{"tags": {"symbol": "BTC"}, "fields": {"price": 1.5}}]
+
+    @patch("django_influxdb.influxdb.writers")
+    def test_batching(self, writers):
+        self.client.write(self.data)
+        writer = writers.__getitem__.return_value
+        writer.write.assert_called_once()
+        self.assertIn(b"test-write,symbol=BTC price=1.5", writer.write.call_args[0][2])
+
+    @patch("django_influxdb.influxdb.writers")
+    def test_sync(self, writers):
+        self.client.client = MagicMock()
+        self.client.write(self.data, sync=True)
+        self.assertFalse(writers.__getitem__.called)
+        self.assertTrue(self.client.client.write_api.return_value.write.called)
@@ -1,10 +1,21 @@
+import hashlib
+import math
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
-from rest_framework.renderers import JSONRenderer
-from rest_framework.decorators import renderer_classes
+from rest_framework.settings import api_settings
 from rest_framework import pagination
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 from . import exceptions
+from .cache import get_ttl, get_version
+from .instrumentation import measure
+from .renderers import RESULT_RENDERERS
+from .streaming import STREAM_CONTENT_TYPES, STREAM_ENCODERS
 
 
 class InfluxGenericViewSet(ViewSet):
@@ -52,12 +63,42 @@ class InfluxGenericViewSet(ViewSet):
             response = self.handle_exception(exc)
 
         self.response = self.finalize_response(request, response, *args, **kwargs)
+        with measure("render", view=type(self).__name__) as m:
+            if m and isinstance(self.response, Response):
+                # Rendered here instead of by the handler, so that the rendering is measured
+                self.response.render()
+                m.bytes = len(self.response.content)
         return self.response
 
 
 class ListViewSet(InfluxGenericViewSet):
     additional_filter_params = []
     required_filter_params = []
+    stream_param = "stream"
+    stream_format = None  # Set to "json" or "ndjson" to always stream the results without pagination
+    # Query param which selects the aggregation - the name of a model aggregation or a function name
+    aggregation_param = "aggregation"
+    # The result renderers are selected with ?format=fastjson, columns, ndjson or csv
+    renderer_classes = list(api_settings.DEFAULT_RENDERER_CLASSES) + RESULT_RENDERERS
+    # ETag validators - unchanged results are answered with 304 Not Modified without querying them
+    conditional_requests = True
+    # Version the ranges which touch now() by the time of their latest point (1 last() query) as well
+    change_probe = False
+    # Cache-Control of the results - "public" lets shared caches (CDNs) store them, None leaves it out
+    cache_control = "private"
+
+    def get_stream_format(self, request):
+        """Get the streaming format from the query params. Streamed results are not paginated."""
+        stream_format = request.GET.get(self.stream_param, self.stream_format)
+        if stream_format and stream_format not in STREAM_ENCODERS:
+            formats = ",".join(STREAM_ENCODERS)
+            raise exceptions.MissingParametersException(f"Stream format must be one of: [{formats}]")
+        return stream_format
+
+    def stream(self, request, rows, stream_format: str):
+        """Stream the rows while they are read from InfluxDB - the memory usage doesn't depend on the size"""
+        return StreamingHttpResponse(STREAM_ENCODERS[stream_format](rows),
+                                     content_type=STREAM_CONTENT_TYPES[stream_format])
 
     def _check_and_split_value(self, value):
         # Check for multiple values
@@ -77,19 +118,151 @@ class ListViewSet(InfluxGenericViewSet):
                 tags[param] = self._check_and_split_value(value)
         return tags
 
-    @renderer_classes(JSONRenderer)
+    def get_queryset(self, request, *args, **kwargs):
+        """Lazy queryset for the request - nothing is fetched until the paginator slices it"""
+        time_start = request.GET.get("time_start")
+        time_stop = request.GET.get("time_stop", "now()")
+        aggregate = request.GET.get("aggregate")
+        aggregation = request.GET.get(self.aggregation_param)
+        tags = self.generate_tags(request, *args, **kwargs)
+        queryset = self.influx_model.objects.filter(**tags).range(time_start, time_stop)
+        return queryset.aggregate(aggregate, aggregation)
+
+    def get_validators(self, request, *args, **kwargs):
+        """(ETag, last modified timestamp, max age) of the result - None when it can't be versioned.
+        The ETag is derived from the query params, the accepted format and the version of the range: constant
+        for historical ranges, the current aggregate window (and the latest point with change_probe) for
+        ranges which touch now()."""
+        time_start = request.GET.get("time_start")
+        if not time_start:
+            return None
+        time_stop = request.GET.get("time_stop", "now()")
+        aggregate = request.GET.get("aggregate") or self.influx_model.default_aggregation
+        version = get_version(time_start, time_stop, aggregate)
+        last_modified = None
+        if version != "historical" and self.change_probe:
+            latest = self.influx_model(data=self.generate_tags(request, *args, **kwargs)).latest_time(
+                time_start, time_stop)
+            last_modified = int(latest.timestamp()) if latest is not None else None
+            version = f"{version}:{last_modified}"
+        if version is None:
+            return None
+        params = sorted((key, tuple(values)) for key, values in request.GET.lists())
+        parts = [type(self).__module__, type(self).__qualname__, params, request.META.get("HTTP_ACCEPT"),
+                 sorted(kwargs.items()), version]
+        etag = quote_etag(hashlib.sha256(repr(parts).encode()).hexdigest()[:32])
+        return etag, last_modified, int(get_ttl(time_start, time_stop, aggregate))
+
+    def set_cache_headers(self, response, validators) -> None:
+        etag, last_modified, max_age = validators
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
+        if self.cache_control:
+            patch_cache_control(response, **{self.cache_control: True, "max_age": max_age})
+        patch_vary_headers(response, ["Accept"])
+
     def list(self, request, *args, **kwargs):
+        """The results - conditional requests for unchanged results are answered with 304 Not Modified"""
+        try:
+            validators = self.get_validators(request, *args, **kwargs) if self.conditional_requests else None
+        except (exceptions.InvalidTimestamp, exceptions.InvalidAggregation) as e:
+            return Response(f"{e}", status=400)
+        except exceptions.InfluxApiException:
+            return Response("Bad request - check required fields for proper formating", status=400)
+        if validators is None:
+            return self.list_results(request, *args, **kwargs)
+        etag, last_modified, _ = validators
+        response = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = self.list_results(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            self.set_cache_headers(response, validators)
+        return response
+
+    def list_results(self, request, *args, **kwargs):
         time_start = request.GET.get("time_start")
         time_stop = request.GET.get("time_stop", "now()")
         aggregate = request.GET.get("aggregate")
-        data = self.generate_tags(request, *args, **kwargs)
+        stream_format = self.get_stream_format(request)
         try:
-            dataset = self.influx_model(data=data).filter(time_start, time_stop, aggregate)
-        except exceptions.InvalidTimestamp as e:
+            if stream_format:
+                data = self.generate_tags(request, *args, **kwargs)
+                aggregation = request.GET.get(self.aggregation_param)
+                rows = self.influx_model(data=data).stream(time_start, time_stop, aggregate, aggregation)
+                return self.stream(request, rows, stream_format)
+            queryset = self.get_queryset(request, *args, **kwargs)
+            page = self.paginator.paginate_queryset(queryset, request, view=self)
+            if page is not None:
+                return self.paginator.get_paginated_response(page)
+            return Response(list(queryset))
+        except (exceptions.InvalidTimestamp, exceptions.InvalidAggregation) as e:
             return Response(f"{e}", status=400)
         except exceptions.InfluxApiException:
             return Response("Bad request - check required fields for proper formating", status=400)
-        page = self.paginator.paginate_queryset(dataset, request, view=self)
-        if page is not None:
-            return self.paginator.get_paginated_response(page)
-        return Response(dataset)
+
+    @classmethod
+    def as_async_view(cls, **initkwargs):
+        """Async Django view of the list action - the InfluxDB queries don't block the event loop.
+        The DRF authentication, permissions and throttling run in a thread like in the sync view and their
+        errors are returned as DRF responses. The results are rendered as JSON."""
+        async def view(request, *args, **kwargs):
+            if request.method != "GET":
+                return HttpResponseNotAllowed(["GET"])
+            self = cls(**initkwargs)
+            self.action_map = {"get": "list"}
+            self.args = args
+            self.kwargs = kwargs
+            request = self.initialize_request(request, *args, **kwargs)
+            self.request = request
+            self.headers = self.default_response_headers
+            try:
+                await sync_to_async(self.initial)(request, *args, **kwargs)
+            except Exception as exc:
+                response = self.finalize_response(request, self.handle_exception(exc), *args, **kwargs)
+                return response.render()
+            return await self.alist(request, *args, **kwargs)
+        view.cls = cls
+        view.initkwargs = initkwargs
+        return view
+
+    async def apaginate(self, queryset, request):
+        """Page of the queryset in the format of the PageNumberPagination - None for an invalid page"""
+        page_size = self.paginator.page_size
+        if not page_size:
+            return await queryset.afetch()
+        param = self.paginator.page_query_param
+        try:
+            number = int(request.GET.get(param, 1))
+        except ValueError:
+            return None
+        count = await queryset.acount()
+        if number < 1 or number > max(math.ceil(count / page_size), 1):
+            return None
+        results = await queryset[(number - 1) * page_size:number * page_size].afetch()
+        url = request.build_absolute_uri()
+        previous = None
+        if number == 2:
+            previous = remove_query_param(url, param)
+        elif number > 2:
+            previous = replace_query_param(url, param, number - 1)
+        return {"count": count,
+                "next": replace_query_param(url, param, number + 1) if number * page_size < count else None,
+                "previous": previous,
+                "results": results}
+
+    async def alist(self, request, *args, **kwargs):
+        """The list action for the async view - the results are paginated, streaming is not supported"""
+        try:
+            self.param_check()
+            data = await self.apaginate(self.get_queryset(request, *args, **kwargs), request)
+        except exceptions.MissingParametersException as e:
+            return JsonResponse(f"{e}", status=400, safe=False)
+        except (exceptions.InvalidTimestamp, exceptions.InvalidAggregation) as e:
+            return JsonResponse(f"{e}", status=400, safe=False)
+        except exceptions.InfluxApiException:
+            return JsonResponse("Bad request - check required fields for proper formating", status=400,
+                                safe=False)
+        if data is None:
+            return JsonResponse({"detail": "Invalid page."}, status=404)
+        return JsonResponse(data, encoder=JSONEncoder, safe=False)
@@ -0,0 +1,227 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from influxdb_client import WritePrecision
+from influxdb_client.client.write_api import SYNCHRONOUS
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import exceptions
+from .connections import connections, DEFAULT_INFLUX_ALIAS
+from .instrumentation import measure
+
+logger = logging.getLogger(__name__)
+
+
+def get_write_setting(key: str):
+    defaults = {"INFLUXDB_WRITE_MODE": "batching", "INFLUXDB_BATCH_SIZE": 500, "INFLUXDB_FLUSH_SIZE": 100,
+                "INFLUXDB_FLUSH_INTERVAL": 1000, "INFLUXDB_WRITE_BUFFER_SIZE": 10000,
+                "INFLUXDB_WRITE_BUFFER_TIMEOUT": 3000, "INFLUXDB_WRITE_MAX_RETRIES": 3,
+                "INFLUXDB_WRITE_RETRY_INTERVAL": 1000, "INFLUXDB_WRITE_CALLBACKS": {}}
+    return getattr(settings, key, defaults[key])
+
+
+class BatchWriter:
+    """Background writer which buffers line protocol points across many Client.write calls.
+
+    The buffer is flushed when it holds INFLUXDB_FLUSH_SIZE points, every INFLUXDB_FLUSH_INTERVAL ms and on
+    close. Every write request sends at most INFLUXDB_BATCH_SIZE points. The buffer is bounded by
+    INFLUXDB_WRITE_BUFFER_SIZE points - writers block for up to INFLUXDB_WRITE_BUFFER_TIMEOUT ms when it is
+    full.
+    The callbacks receive the batch configuration tuple (bucket, org, precision) and the line protocol data:
+    success_callback(conf, data), error_callback(conf, data, exception), retry_callback(conf, data, exception)
+    """
+
+    def __init__(self, using: str = DEFAULT_INFLUX_ALIAS, success_callback=None, error_callback=None,
+                 retry_callback=None, **options):
+        self.using = using
+        option_settings = {"batch_size": "INFLUXDB_BATCH_SIZE", "flush_size": "INFLUXDB_FLUSH_SIZE",
+                           "flush_interval": "INFLUXDB_FLUSH_INTERVAL",
+                           "buffer_size": "INFLUXDB_WRITE_BUFFER_SIZE",
+                           "buffer_timeout": "INFLUXDB_WRITE_BUFFER_TIMEOUT",
+                           "max_retries": "INFLUXDB_WRITE_MAX_RETRIES",
+                           "retry_interval": "INFLUXDB_WRITE_RETRY_INTERVAL"}
+        for option, key in option_settings.items():
+            setattr(self, option, options.get(option, get_write_setting(key)))
+        callbacks = get_write_setting("INFLUXDB_WRITE_CALLBACKS")
+        self.success_callback = success_callback or self._load_callback(callbacks.get("success"))
+        self.error_callback = error_callback or self._load_callback(callbacks.get("error"))
+        self.retry_callback = retry_callback or self._load_callback(callbacks.get("retry"))
+        # Buffer entries are ((bucket, org, precision), line protocol bytes, number of points)
+        self._buffer = deque()
+        self._pending = 0
+        self._in_flight = 0
+        self._closed = False
+        self._flush_requested = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    @classmethod
+    def _load_callback(cls, path):
+        if path is None or callable(path):
+            return path
+        return import_string(path)
+
+    def _start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=f"influxdb-writer-{self.using}",
+                                            daemon=True)
+            self._thread.start()
+
+    def write(self, bucket: str, org: str, data: bytes, points: int = 1,
+              precision: str = WritePrecision.MS) -> None:
+        """Add line protocol data with the given number of points to the buffer.
+        Raises WriteBufferFull if there is no room for the points before the buffer timeout."""
+        if not points:
+            return
+        deadline = time.monotonic() + self.buffer_timeout / 1000
+        with self._cond:
+            if self._closed:
+                raise exceptions.WriterClosed("The InfluxDB writer is closed")
+            # Always accept a write into an empty buffer, otherwise big writes could never fit
+            while self._pending and self._pending + points > self.buffer_size:
+                self._flush_requested = True
+                self._start()
+                self._cond.notify_all()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise exceptions.WriteBufferFull(f"The write buffer is full ({self._pending} points)")
+                self._cond.wait(remaining)
+            self._buffer.append(((bucket, org, precision), data, points))
+            self._pending += points
+            if self._pending >= self.flush_size:
+                self._cond.notify_all()
+            self._start()
+
+    def _take_batch(self) -> list:
+        """Pop entries from the buffer until the batch size is reached. Must be called with the lock held."""
+        batch = []
+        size = 0
+        while self._buffer and size < self.batch_size:
+            entry = self._buffer.popleft()
+            size += entry[2]
+            batch.append(entry)
+        self._pending -= size
+        self._in_flight += size
+        return batch
+
+    def _run(self) -> None:
+        interval = self.flush_interval / 1000
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + interval
+                while (not self._closed and not self._flush_requested and self._pending < self.flush_size):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if not self._buffer:
+                    self._flush_requested = False
+                    if self._closed:
+                        return
+                    continue
+                batch = self._take_batch()
+                # Room was freed in the buffer - wake up the blocked writers
+                self._cond.notify_all()
+            try:
+                self._send(batch)
+            finally:
+                with self._cond:
+                    self._in_flight -= sum(entry[2] for entry in batch)
+                    if not self._buffer:
+                        self._flush_requested = False
+                    self._cond.notify_all()
+
+    def _send(self, batch: list) -> None:
+        """Write a batch grouped by bucket, org and precision"""
+        grouped = {}
+        for conf, data, _ in batch:
+            grouped.setdefault(conf, []).append(data)
+        write_api = connections[self.using].write_api(write_options=SYNCHRONOUS)
+        for conf, chunks in grouped.items():
+            with measure("write_batch", using=self.using, bucket=conf[0]) as m:
+                data = b"\n".join(chunks)
+                if m:
+                    m.rows, m.bytes = data.count(b"\n") + 1, len(data)
+                self._send_with_retries(write_api, conf, data)
+
+    def _send_with_retries(self, write_api, conf: tuple, data: bytes) -> None:
+        bucket, org, precision = conf
+        attempt = 0
+        while True:
+            try:
+                write_api.write(bucket, org, data, write_precision=precision)
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    if self.error_callback:
+                        self.error_callback(conf, data, e)
+                    else:
+                        logger.error("Failed to write a batch to InfluxDB bucket %s: %s", bucket, e)
+                    return
+                if self.retry_callback:
+                    self.retry_callback(conf, data, e)
+                time.sleep(self.retry_interval * 2 ** attempt / 1000)
+                attempt += 1
+                continue
+            if self.success_callback:
+                self.success_callback(conf, data)
+            return
+
+    def flush(self, timeout: float = None) -> bool:
+        """Send all the buffered points and wait for them to be written. Returns False on timeout."""
+        with self._cond:
+            if not self._buffer and not self._in_flight:
+                return True
+            self._flush_requested = True
+            self._start()
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: not self._buffer and not self._in_flight, timeout)
+
+    def close(self, timeout: float = None) -> None:
+        """Flush the buffer and stop the background thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+class WriterHandler:
+    """Process wide registry of batch writers - 1 writer per connection alias"""
+
+    def __init__(self):
+        self._writers = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def __getitem__(self, alias: str) -> BatchWriter:
+        if self._pid != os.getpid():
+            # The writer threads don't survive a fork
+            self._writers = {}
+            self._pid = os.getpid()
+        try:
+            return self._writers[alias]
+        except KeyError:
+            pass
+        with self._lock:
+            if alias not in self._writers:
+                self._writers[alias] = BatchWriter(using=alias)
+            return self._writers[alias]
+
+    def flush_all(self, timeout: float = None) -> None:
+        for writer in list(self._writers.values()):
+            writer.flush(timeout)
+
+    def close_all(self, timeout: float = None) -> None:
+        with self._lock:
+            writers = list(self._writers.values())
+            self._writers = {}
+        for writer in writers:
+            writer.close(timeout)
+
+
+writers = WriterHandler()
+atexit.register(writers.close_all)
@@ -14,10 +14,15 @@ setup(name='django-influxdb',
       author='Atanas K',
       author_email='atkozhuharov@gmail.com',
       license='MIT',
+      python_requires='>=3.8',
       install_requires=[
           'django>=2.2',
           'jinja2',
           'djangorestframework>3.0',
           'influxdb-client>=1.16'
       ],
-      packages=find_packages())
+      extras_require={
+          'async': ['influxdb-client[async]>=1.28']
+      },
+      packages=find_packages(),
+      package_data={'django_influxdb': ['flux/*.j2']})